@@ -0,0 +1,27 @@
+"""Add per-user data revision counter
+
+Revision ID: 0d6b9e2f4a83
+Revises: 5a8c3f71d2e6
+Create Date: 2026-10-18 16:37:12.905184
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0d6b9e2f4a83'
+down_revision: Union[str, None] = '5a8c3f71d2e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('revision', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('revision')
@@ -0,0 +1,37 @@
+"""Add upload_sessions table for resumable uploads
+
+Revision ID: 3f7a2c9d5e14
+Revises: 0d6b9e2f4a83
+Create Date: 2026-10-18 19:24:07.118532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f7a2c9d5e14'
+down_revision: Union[str, None] = '0d6b9e2f4a83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'upload_sessions',
+        sa.Column('id', sa.Text(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.Text(), nullable=False),
+        sa.Column('expiry', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_with_rowid=False
+    )
+    op.create_index('ix_upload_sessions_expiry', 'upload_sessions', ['expiry'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_upload_sessions_expiry', table_name='upload_sessions')
+    op.drop_table('upload_sessions')
@@ -0,0 +1,35 @@
+"""Add sessions table for server-side browser sessions
+
+Revision ID: 5a8c3f71d2e6
+Revises: e41f0a9c6b27
+Create Date: 2026-10-18 15:02:51.447310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a8c3f71d2e6'
+down_revision: Union[str, None] = 'e41f0a9c6b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'sessions',
+        sa.Column('id', sa.Text(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('expiry', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_with_rowid=False
+    )
+    op.create_index('ix_sessions_expiry', 'sessions', ['expiry'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sessions_expiry', table_name='sessions')
+    op.drop_table('sessions')
@@ -0,0 +1,35 @@
+"""Add last access time and storage tier to secfilemetadata
+
+Revision ID: 8e2b6f0c3a91
+Revises: 3f7a2c9d5e14
+Create Date: 2026-10-18 21:02:43.540317
+
+"""
+import time
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2b6f0c3a91'
+down_revision: Union[str, None] = '3f7a2c9d5e14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('secfilemetadata', sa.Column('last_access', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('secfilemetadata', sa.Column('tier', sa.Text(), nullable=False, server_default='hot'))
+
+    # Existing files count as read now, so they aren't all moved to cold storage on the first run
+    op.execute(sa.text('UPDATE secfilemetadata SET last_access = :now').bindparams(now=int(time.time())))
+    op.create_index('ix_secfilemetadata_tier_last_access', 'secfilemetadata', ['tier', 'last_access'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_secfilemetadata_tier_last_access', table_name='secfilemetadata')
+    with op.batch_alter_table('secfilemetadata') as batch_op:
+        batch_op.drop_column('tier')
+        batch_op.drop_column('last_access')
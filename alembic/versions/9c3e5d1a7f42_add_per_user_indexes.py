@@ -0,0 +1,114 @@
+"""Add per-user indexes and cluster checklist tables on their primary keys
+
+Revision ID: 9c3e5d1a7f42
+Revises: 4b1702ebb496
+Create Date: 2026-10-18 09:12:44.201937
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c3e5d1a7f42'
+down_revision: Union[str, None] = '4b1702ebb496'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    ('ix_calendar_user_id_name', 'calendar', ['user_id', 'name'], False),
+    ('ix_contacts_user_id', 'contacts', ['user_id'], False),
+    ('ix_custominput_user_id_type', 'custominput', ['user_id', 'type', 'name', 'uuid'], False),
+    ('ix_events_person_id', 'events', ['person_id'], False),
+    ('ix_families_user_id', 'families', ['user_id'], True),
+    ('ix_medical_user_id', 'medical', ['user_id'], False),
+    ('ix_providers_user_id', 'providers', ['user_id'], False),
+    ('ix_savedsupplies_user_id_gobag', 'savedsupplies', ['user_id', 'gobag'], False),
+    ('ix_savedsupplies_user_id_shelter', 'savedsupplies', ['user_id', 'shelter'], False),
+    ('ix_secfilemetadata_user_id_filename', 'secfilemetadata', ['user_id', 'filename'], False),
+    ('ix_supplies_item', 'supplies', ['item'], False),
+    ('ix_tasks_task', 'tasks', ['task'], False),
+    ('ix_tokens_user_id', 'tokens', ['user_id'], False),
+]
+
+
+def checklist_tables():
+    """
+    Column definitions of the composite-key per-user checklist tables
+    """
+    return {
+        'customtasks': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('task_uuid', sa.Text(), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'task_uuid'),
+        ],
+        'gobags': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('supply_uuid', sa.Text(), sa.ForeignKey('supplies.uuid'), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'supply_uuid'),
+        ],
+        'savedsupplies': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('supply_uuid', sa.Text(), sa.ForeignKey('supplies.uuid'), nullable=False),
+            sa.Column('gobag', sa.Text(), nullable=False),
+            sa.Column('shelter', sa.Text(), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'supply_uuid'),
+        ],
+        'savedtasks': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('task_uuid', sa.Text(), sa.ForeignKey('tasks.uuid'), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'task_uuid'),
+        ],
+        'shelters': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('supply_uuid', sa.Text(), sa.ForeignKey('supplies.uuid'), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'supply_uuid'),
+        ],
+    }
+
+
+def rebuild_tables(with_rowid):
+    """
+    Copy each checklist table into a fresh one with or without SQLite's hidden rowid
+    """
+    for table, columns in checklist_tables().items():
+        names = ", ".join(column.name for column in columns if isinstance(column, sa.Column))
+        op.create_table(f'{table}_new', *columns, sqlite_with_rowid=with_rowid)
+        op.execute(f'INSERT INTO {table}_new ({names}) SELECT {names} FROM {table}')
+        op.drop_table(table)
+        op.rename_table(f'{table}_new', table)
+
+
+def check_unique_families():
+    """
+    Stop before changing anything if a user has more than one household row, as households are made unique
+    per user. Which row to keep is left to whoever runs the migration.
+    """
+    duplicated = op.get_bind().execute(sa.text(
+        'SELECT user_id FROM families GROUP BY user_id HAVING COUNT(*) > 1 ORDER BY user_id')).scalars().all()
+    if duplicated:
+        raise RuntimeError(
+            "Cannot add the unique index ix_families_user_id: the families table has more than one row for "
+            f"user ids {', '.join(map(str, duplicated))}. The app only ever read the row with the lowest id "
+            "for each user; delete or merge the others, then run the migration again.")
+
+
+def upgrade() -> None:
+    check_unique_families()
+
+    if op.get_bind().dialect.name == 'sqlite':
+        rebuild_tables(with_rowid=False)
+
+    for name, table, columns, unique in INDEXES:
+        op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade() -> None:
+    for name, table, columns, unique in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+
+    if op.get_bind().dialect.name == 'sqlite':
+        rebuild_tables(with_rowid=True)
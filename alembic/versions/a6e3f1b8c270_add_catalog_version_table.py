@@ -0,0 +1,32 @@
+"""Add catalog_version table shared by every process caching the reference tables
+
+Revision ID: a6e3f1b8c270
+Revises: c5d1a7e93b48
+Create Date: 2026-10-19 10:42:51.337905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6e3f1b8c270'
+down_revision: Union[str, None] = 'c5d1a7e93b48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Left empty until init_db next seeds the reference tables
+    op.create_table(
+        'catalog_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('generation', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('catalog_version')
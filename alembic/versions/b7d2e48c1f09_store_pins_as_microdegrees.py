@@ -0,0 +1,86 @@
+"""Store meetup pins as integer microdegrees with a grid cell index
+
+Revision ID: b7d2e48c1f09
+Revises: 9c3e5d1a7f42
+Create Date: 2026-10-18 11:03:27.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d2e48c1f09'
+down_revision: Union[str, None] = '9c3e5d1a7f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+MICRODEGREES = 1_000_000
+CELL_MICRODEGREES = 100_000
+CELLS_PER_ROW = 3600
+
+
+def grid_cell(latitude_e6, longitude_e6):
+    """
+    Index of the 0.1 degree grid cell containing a point given in microdegrees
+    """
+    row = min((latitude_e6 + 90 * MICRODEGREES) // CELL_MICRODEGREES, CELLS_PER_ROW // 2 - 1)
+    column = min((longitude_e6 + 180 * MICRODEGREES) // CELL_MICRODEGREES, CELLS_PER_ROW - 1)
+    return row * CELLS_PER_ROW + column
+
+
+def upgrade() -> None:
+    rows = op.get_bind().execute(sa.text('SELECT user_id, latitude, longitude, title FROM coordinates')).all()
+
+    pins = {}
+    for row in rows:
+        latitude_e6 = round(row.latitude * MICRODEGREES)
+        longitude_e6 = round(row.longitude * MICRODEGREES)
+        pins[(row.user_id, latitude_e6, longitude_e6)] = {
+            'user_id': row.user_id,
+            'latitude_e6': latitude_e6,
+            'longitude_e6': longitude_e6,
+            'cell': grid_cell(latitude_e6, longitude_e6),
+            'title': row.title
+        }
+
+    op.drop_table('coordinates')
+    coordinates = op.create_table(
+        'coordinates',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('latitude_e6', sa.Integer(), nullable=False),
+        sa.Column('longitude_e6', sa.Integer(), nullable=False),
+        sa.Column('cell', sa.Integer(), nullable=False),
+        sa.Column('title', sa.Text()),
+        sa.PrimaryKeyConstraint('user_id', 'latitude_e6', 'longitude_e6'),
+        sqlite_with_rowid=False
+    )
+    op.create_index('ix_coordinates_user_id_cell', 'coordinates', ['user_id', 'cell'])
+    if pins:
+        op.bulk_insert(coordinates, list(pins.values()))
+
+
+def downgrade() -> None:
+    rows = op.get_bind().execute(
+        sa.text('SELECT user_id, latitude_e6, longitude_e6, title FROM coordinates')).all()
+
+    op.drop_index('ix_coordinates_user_id_cell', table_name='coordinates')
+    op.drop_table('coordinates')
+    coordinates = op.create_table(
+        'coordinates',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('latitude', sa.Float(), nullable=False),
+        sa.Column('longitude', sa.Float(), nullable=False),
+        sa.Column('title', sa.Text()),
+        sa.PrimaryKeyConstraint('user_id', 'latitude', 'longitude')
+    )
+    if rows:
+        op.bulk_insert(coordinates, [{
+            'user_id': row.user_id,
+            'latitude': row.latitude_e6 / MICRODEGREES,
+            'longitude': row.longitude_e6 / MICRODEGREES,
+            'title': row.title
+        } for row in rows])
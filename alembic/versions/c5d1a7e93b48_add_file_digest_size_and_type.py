@@ -0,0 +1,32 @@
+"""Add content digest, size and MIME type to secfilemetadata
+
+Revision ID: c5d1a7e93b48
+Revises: 8e2b6f0c3a91
+Create Date: 2026-10-18 22:11:09.204815
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d1a7e93b48'
+down_revision: Union[str, None] = '8e2b6f0c3a91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Left empty for files stored earlier, until they are next uploaded
+    op.add_column('secfilemetadata', sa.Column('digest', sa.Text(), nullable=True))
+    op.add_column('secfilemetadata', sa.Column('size', sa.Integer(), nullable=True))
+    op.add_column('secfilemetadata', sa.Column('mimetype', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('secfilemetadata') as batch_op:
+        batch_op.drop_column('mimetype')
+        batch_op.drop_column('size')
+        batch_op.drop_column('digest')
@@ -0,0 +1,175 @@
+"""Store checklist selections and progress as per-user, per-kit bitmaps over catalog ids
+
+Revision ID: e41f0a9c6b27
+Revises: b7d2e48c1f09
+Create Date: 2026-10-18 13:41:06.882150
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41f0a9c6b27'
+down_revision: Union[str, None] = 'b7d2e48c1f09'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Old per-item tables: (table, uuid column) holding each kit's selected items
+SELECTED = {'gobag': ('gobags', 'supply_uuid'), 'shelter': ('shelters', 'supply_uuid'),
+            'task': ('customtasks', 'task_uuid')}
+
+
+def pack(bits):
+    """
+    Encode an integer bitset as a little-endian bitmap
+    """
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def unpack(bitmap):
+    """
+    Decode a stored bitmap back into an integer bitset
+    """
+    return int.from_bytes(bitmap or b'', 'little')
+
+
+def catalog_ids(connection, kit):
+    """
+    Map of catalog uuid to id for the table a kit's checklist is drawn from
+    """
+    table = 'tasks' if kit == 'task' else 'supplies'
+    return dict(connection.execute(sa.text(f'SELECT uuid, id FROM {table}')).all())
+
+
+def old_tables():
+    """
+    Column definitions of the per-item checklist tables replaced by bitmaps
+    """
+    return {
+        'customtasks': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('task_uuid', sa.Text(), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'task_uuid'),
+        ],
+        'gobags': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('supply_uuid', sa.Text(), sa.ForeignKey('supplies.uuid'), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'supply_uuid'),
+        ],
+        'savedsupplies': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('supply_uuid', sa.Text(), sa.ForeignKey('supplies.uuid'), nullable=False),
+            sa.Column('gobag', sa.Text(), nullable=False),
+            sa.Column('shelter', sa.Text(), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'supply_uuid'),
+        ],
+        'savedtasks': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('task_uuid', sa.Text(), sa.ForeignKey('tasks.uuid'), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'task_uuid'),
+        ],
+        'shelters': [
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('supply_uuid', sa.Text(), sa.ForeignKey('supplies.uuid'), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'supply_uuid'),
+        ],
+    }
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+
+    # Rows of (user_id, uuid) per kit for selected and done items
+    selected = {kit: connection.execute(sa.text(f'SELECT user_id, {column} FROM {table}')).all()
+                for kit, (table, column) in SELECTED.items()}
+    done = {kit: connection.execute(sa.text(
+        f"SELECT user_id, supply_uuid FROM savedsupplies WHERE {kit} = 'Yes'")).all()
+        for kit in ('gobag', 'shelter')}
+    done['task'] = connection.execute(sa.text('SELECT user_id, task_uuid FROM savedtasks')).all()
+
+    # Fold catalog items into bitmaps; anything else is progress on a custom item
+    bitmaps = {}
+    custom_done = set()
+    for kit in SELECTED:
+        ids = catalog_ids(connection, kit)
+        for field, rows in (('selected', selected[kit]), ('done', done[kit])):
+            for user_id, item_uuid in rows:
+                entry = bitmaps.setdefault((user_id, kit), {'selected': 0, 'done': 0})
+                if item_uuid in ids:
+                    entry[field] |= 1 << ids[item_uuid]
+                elif field == 'done':
+                    custom_done.add((user_id, item_uuid))
+
+    op.add_column('custominput', sa.Column('done', sa.Integer(), nullable=False, server_default='0'))
+
+    checklists = op.create_table(
+        'checklists',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('kit', sa.Text(), nullable=False),
+        sa.Column('selected', sa.LargeBinary(), nullable=False),
+        sa.Column('done', sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'kit'),
+        sqlite_with_rowid=False
+    )
+    if bitmaps:
+        op.bulk_insert(checklists, [
+            {'user_id': user_id, 'kit': kit, 'selected': pack(entry['selected']), 'done': pack(entry['done'])}
+            for (user_id, kit), entry in bitmaps.items()])
+
+    for user_id, item_uuid in custom_done:
+        connection.execute(sa.text('UPDATE custominput SET done = 1 WHERE user_id = :user_id AND uuid = :uuid'),
+                           {'user_id': user_id, 'uuid': item_uuid})
+
+    op.drop_index('ix_savedsupplies_user_id_gobag', table_name='savedsupplies')
+    op.drop_index('ix_savedsupplies_user_id_shelter', table_name='savedsupplies')
+    for table in old_tables():
+        op.drop_table(table)
+
+
+def downgrade() -> None:
+    connection = op.get_bind()
+    rows = connection.execute(sa.text('SELECT user_id, kit, selected, done FROM checklists')).all()
+    custom = connection.execute(sa.text('SELECT user_id, type, uuid FROM custominput WHERE done = 1')).all()
+
+    with_rowid = connection.dialect.name != 'sqlite'
+    tables = {table: op.create_table(table, *columns, sqlite_with_rowid=with_rowid)
+              for table, columns in old_tables().items()}
+    op.create_index('ix_savedsupplies_user_id_gobag', 'savedsupplies', ['user_id', 'gobag'])
+    op.create_index('ix_savedsupplies_user_id_shelter', 'savedsupplies', ['user_id', 'shelter'])
+
+    # Expand bitmaps back into one row per user per item
+    inserts = {table: [] for table in tables}
+    saved_supplies = {}
+    for row in rows:
+        uuids = {catalog_id: item_uuid for item_uuid, catalog_id in catalog_ids(connection, row.kit).items()}
+        selected, done = unpack(row.selected), unpack(row.done)
+        table, column = SELECTED[row.kit]
+        for catalog_id, item_uuid in uuids.items():
+            if selected >> catalog_id & 1:
+                inserts[table].append({'user_id': row.user_id, column: item_uuid})
+            if done >> catalog_id & 1:
+                if row.kit == 'task':
+                    inserts['savedtasks'].append({'user_id': row.user_id, 'task_uuid': item_uuid})
+                else:
+                    saved_supplies.setdefault((row.user_id, item_uuid), {'gobag': 'No', 'shelter': 'No'})[
+                        row.kit] = 'Yes'
+
+    for user_id, kit, item_uuid in custom:
+        if kit == 'task':
+            inserts['savedtasks'].append({'user_id': user_id, 'task_uuid': item_uuid})
+        else:
+            saved_supplies.setdefault((user_id, item_uuid), {'gobag': 'No', 'shelter': 'No'})[kit] = 'Yes'
+
+    inserts['savedsupplies'] = [{'user_id': user_id, 'supply_uuid': item_uuid, **flags}
+                                for (user_id, item_uuid), flags in saved_supplies.items()]
+    for table, values in inserts.items():
+        if values:
+            op.bulk_insert(tables[table], values)
+
+    op.drop_table('checklists')
+    with op.batch_alter_table('custominput') as batch_op:
+        batch_op.drop_column('done')
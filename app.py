@@ -4,82 +4,118 @@ as configures the mailserver and error logging.
 """
 
 import base64
-from email.message import EmailMessage
+import gc
 import os
 import logging
 from logging.handlers import SMTPHandler, RotatingFileHandler
 import smtplib
 import sys
 
+from email.message import EmailMessage
+
 from dotenv import load_dotenv
-from flask import Flask, g, render_template, request
-from flask_mail import Mail
+from flask import Flask, current_app, g, jsonify, render_template, request
 from flask_wtf import CSRFProtect
 
+from assets import IMMUTABLE, init_assets, is_fingerprinted
 from auth_routes import auth_routes
+from catalog import init_catalog
 from data_routes import data_routes
-from dbmodels import Base
-from flask_session import Session
+from fragments import init_fragment_cache
 from helpers import apology, login_required
 from preppydb import db_session
+from revisions import init_revisions
+from sessions import init_sessions
+from storage import init_storage
 from supply_routes import supply_routes
 from task_routes import task_routes
+from templating import init_templates
 from userinfo_routes import userinfo_routes
+from utils import init_query_budgets
 
 load_dotenv()
 csrf = CSRFProtect()
 
-# Configure application
-app = Flask(__name__)
-
-# Initialize db models
-Base.metadata.create_all(bind=db_session.bind)
-
-# Secret key for flash
-if os.environ.get('FLASK_ENV') == 'production':
-    app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
-else:
-    app.secret_key = 'development-secret-key'
 
+def create_app():
+    """
+    Build and configure the application. The database schema is kept up to date by a separate step
+    (python init_db.py --migrate), so building an app never writes to the db.
+    """
+    app = Flask(__name__)
 
-# Configure session to use filesystem (instead of signed cookies)
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+    # Secret key for flash
+    if os.environ.get('FLASK_ENV') == 'production':
+        app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
+    else:
+        app.secret_key = 'development-secret-key'
+
+    # Configure sessions to be stored server-side in the db (or in signed cookies if SESSION_BACKEND=cookie)
+    app.config["PERMANENT_SESSION_LIFETIME"] = int(os.getenv("SESSION_LIFETIME", "86400"))
+    init_sessions(app)
+
+    # Enable CSRFProtection. Tokens expire after CSRF_TIME_LIMIT seconds, and revalidated pages change
+    # ETag well before the tokens in their forms do.
+    app.config["WTF_CSRF_TIME_LIMIT"] = int(os.getenv("CSRF_TIME_LIMIT", "3600"))
+    csrf.init_app(app)
+
+    # Track per-user data revisions so pages can be revalidated with ETags, and cache renders per revision
+    init_revisions(app)
+    init_fragment_cache(app)
+
+    # Register route blueprints
+    app.register_blueprint(auth_routes)
+    app.register_blueprint(data_routes)
+    app.register_blueprint(supply_routes)
+    app.register_blueprint(task_routes)
+    app.register_blueprint(userinfo_routes)
+
+    # Configure mail server and upload directory for user files (the mail extension is set up on first send)
+    app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
+    app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT'))
+    app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
+    app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS') == 'True'
+    app.config['MAIL_USE_SSL'] = os.getenv('MAIL_USE_SSL') == 'True'
+    app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER')
+
+    # Move files nobody has read for a while to cheaper cold storage, if COLD_STORAGE_FOLDER is set
+    init_storage(app)
+
+    # Set SameSite cookie attribute to strict
+    app.config.update(
+        SESSION_COOKIE_SAMESITE='Strict'
+    )
 
+    app.before_request(generate_nonce)
 
-# Enable CSRFProtection
-csrf.init_app(app)
+    # Serve fingerprinted static assets built by build_assets.py (after the nonce is set, as responses need it)
+    init_assets(app)
 
+    app.context_processor(inject_nonce)
+    app.teardown_appcontext(shutdown_session)
+    app.after_request(after_request)
+    app.register_error_handler(500, internal_error)
+    app.add_url_rule("/", view_func=index, methods=["GET"])
+    app.add_url_rule("/cache_stats", view_func=cache_stats, methods=["GET"])
 
-# Register route blueprints
-app.register_blueprint(auth_routes)
-app.register_blueprint(data_routes)
-app.register_blueprint(supply_routes)
-app.register_blueprint(task_routes)
-app.register_blueprint(userinfo_routes)
+    if not app.debug:
+        init_logging(app)
 
-if __name__ == "__main__":
-    app.run()
+    # Hold routes to their query budgets (development aid, when QUERY_BUDGETS=on)
+    init_query_budgets(app)
 
-# Configure mail server and upload directory for user files
-app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
-app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT'))
-app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
-app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS') == 'True'
-app.config['MAIL_USE_SSL'] = os.getenv('MAIL_USE_SSL') == 'True'
-app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER')
-mail = Mail(app)
+    # Compile every template now rather than on each worker's first request for it
+    init_templates(app)
 
+    # Load reference data once per process, then exempt everything built so far from garbage collection:
+    # workers forked from a preloading server then keep sharing those pages instead of copying them
+    init_catalog(app)
+    gc.freeze()
 
-# Set SameSite cookie attribute to strict
-app.config.update(
-    SESSION_COOKIE_SAMESITE='Strict'
-)
+    return app
 
 
-@app.before_request
 def generate_nonce():
     """
     Function to generate nonce for use in csp headers
@@ -87,7 +123,6 @@ def generate_nonce():
     g.nonce = base64.b64encode(os.urandom(16)).decode('utf-8')
 
 
-@app.context_processor
 def inject_nonce():
     """
     Function to inject nonce into all routes for use in csp headers
@@ -95,12 +130,27 @@ def inject_nonce():
     return {"nonce": g.nonce}
 
 
-@app.after_request
+def shutdown_session(exception=None):
+    """
+    Return the request's database session to the connection pool
+    """
+    db_session.remove()
+
+
 def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
+    """Ensure responses are revalidated before reuse, except fingerprinted assets which never change"""
+    if is_fingerprinted(current_app):
+        response.headers["Cache-Control"] = IMMUTABLE
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+
+    # Preload the assets every page links to from layout.html
+    if response.mimetype == 'text/html':
+        response.headers['Link'] = current_app.extensions['assets'].preload
+
+    # A 304 reuses the cached page, whose scripts carry the nonce of the CSP it was first sent with
+    if response.status_code == 304:
+        return response
 
     # Set CSP headers
     response.headers['Content-Security-Policy'] = (
@@ -131,13 +181,18 @@ class CustomSMTPHandler(SMTPHandler):
     Set up custom handler so can handle SSL or TLS depending on user-set environmental variables
     """
 
+    def __init__(self, *args, use_ssl=False, use_tls=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.use_ssl = use_ssl
+        self.use_tls = use_tls
+
     def emit(self, record):
         try:
-            if app.config['MAIL_USE_SSL']:
+            if self.use_ssl:
                 smtp = smtplib.SMTP_SSL(self.mailhost, self.mailport, timeout=self.timeout)
             else:
                 smtp = smtplib.SMTP(self.mailhost, self.mailport, timeout=self.timeout)
-                if app.config['MAIL_USE_TLS']:
+                if self.use_tls:
                     smtp.starttls()
             smtp.login(self.username, self.password)
 
@@ -155,12 +210,14 @@ class CustomSMTPHandler(SMTPHandler):
             smtp.send_message(email)
             smtp.quit()
         except (smtplib.SMTPException, KeyError, smtplib.SMTPAuthenticationError) as e:
-            app.logger.error("Failed to set up CustomSMTPHandler: %s", e)
+            logging.getLogger(__name__).error("Failed to set up CustomSMTPHandler: %s", e)
             self.handleError(record)
 
 
-if not app.debug:
-    # Log info level events to a file
+def init_logging(app):
+    """
+    Log info level events to a file and the console, and email error-level events
+    """
     file_handler = RotatingFileHandler(
         'logs/error.log', maxBytes=10240, backupCount=10
     )
@@ -187,12 +244,14 @@ if not app.debug:
                 credentials=(app.config['MAIL_USERNAME'],
                              app.config['MAIL_PASSWORD']),
                 secure=() if app.config['MAIL_USE_TLS'] else None,
-                timeout=30
+                timeout=30,
+                use_ssl=app.config['MAIL_USE_SSL'],
+                use_tls=app.config['MAIL_USE_TLS']
             )
 
             mail_handler.setLevel(logging.ERROR)
             app.logger.addHandler(mail_handler)
-        except (smtplib.SMTPException, KeyError) as e:
+        except KeyError as e:
             app.logger.error("Failed to set up mail handler: %s", e)
 
     # Console handler for docker
@@ -203,15 +262,27 @@ if not app.debug:
     app.logger.addHandler(console_handler)
 
 
-@app.errorhandler(500)
 def internal_error(error):
     return apology("We're so sorry, you've encountered an internal server error.", 500)
 
 
-@app.route("/", methods=["GET"])
 @login_required
 def index():
     """
     Routing to the index page.
     """
     return render_template("index.html")
+
+
+@login_required
+def cache_stats():
+    """
+    Report fragment cache counters for tuning, when enabled with FRAGMENT_CACHE_STATS=on
+    """
+    if os.getenv('FRAGMENT_CACHE_STATS', 'off') != 'on' or current_app.extensions['fragment_cache'] is None:
+        return apology("Not found.", 404)
+    return jsonify(pages=current_app.extensions['fragment_cache'].stats(), shared=current_app.extensions['shared_pages'].stats())
+
+
+if __name__ == "__main__":
+    create_app().run()
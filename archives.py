@@ -0,0 +1,77 @@
+"""
+Module builds ZIP archives on the fly, handing each piece to the response as soon as it is written, so an
+archive of any size is sent without being held in memory or written to disk
+"""
+
+import time
+import zipfile
+
+
+class ArchiveBuffer:
+    """
+    Unseekable file the archive is written to, emptied into the response after each write. Without tell()
+    or seek(), zipfile writes each entry's sizes and CRC after its data instead of going back for them.
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        parts, self._parts = self._parts, []
+        return parts
+
+
+def archive_name(name, taken):
+    """
+    A name for a file inside the archive: no directories (so unpacking can't write outside the target
+    folder) and unique within the archive
+    """
+    name = name.replace('/', '_').replace('\\', '_').lstrip('.') or 'file'
+    candidate, n = name, 1
+    while candidate in taken:
+        stem, dot, ext = name.rpartition('.')
+        candidate = f"{stem} ({n}).{ext}" if dot and stem else f"{name} ({n})"
+        n += 1
+    taken.add(candidate)
+    return candidate
+
+
+def stream_zip(entries, chunk_size, on_error):
+    """
+    Yield a ZIP archive of entries, pairs of a name and a function opening that file's plaintext (with
+    its length in .size), one chunk at a time. Files are stored uncompressed: most documents kept here
+    are scans and PDFs that are compressed already. A file that can't be opened is left out and listed
+    in a final entry, after on_error(name, error) is called for it.
+    """
+    buffer = ArchiveBuffer()
+    taken = set()
+    missing = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, open_file in entries:
+            try:
+                source = open_file()
+            except Exception as e:
+                on_error(name, e)
+                missing.append(name)
+                continue
+
+            with source:
+                info = zipfile.ZipInfo(archive_name(name, taken), time.localtime()[:6])
+                info.file_size = source.size
+                with archive.open(info, 'w') as dest:
+                    for chunk in iter(lambda: source.read(chunk_size), b''):
+                        dest.write(chunk)
+                        yield from buffer.drain()
+            yield from buffer.drain()
+
+        if missing:
+            archive.writestr(archive_name('MISSING FILES.txt', taken),
+                             "These files could not be read and are not in this archive:\n" + "\n".join(missing))
+    yield from buffer.drain()
@@ -0,0 +1,91 @@
+"""
+Module links templates to the fingerprinted static assets written by build_assets.py and serves them
+precompressed with long-lived caching
+"""
+
+import json
+import os
+
+from collections import namedtuple
+
+from flask import request, send_from_directory
+
+# Fingerprinted files never change, so browsers may keep them for a year without revalidating
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Stylesheets and scripts every page pulls in through layout.html, in preload order
+LAYOUT_ASSETS = (('css/bootstrap.css', 'style'), ('css/styles.css', 'style'), ('js/layout.js', 'script'))
+
+# Precompressed variants written by the build, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Built asset paths, and the Link header that preloads the layout assets
+Assets = namedtuple('Assets', ['built', 'preload'])
+
+
+def load_manifest(static_folder):
+    """
+    Read the build manifest of source -> fingerprinted paths, or an empty one if assets haven't been built
+    """
+    try:
+        with open(os.path.join(static_folder, 'dist', 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def is_fingerprinted(app):
+    """
+    Whether the current request is for a fingerprinted asset
+    """
+    return request.endpoint == 'static' and request.view_args.get('filename') in app.extensions['assets'].built
+
+
+def init_assets(app):
+    """
+    Point url_for('static') at fingerprinted assets and serve them precompressed with immutable caching
+    """
+    manifest = load_manifest(app.static_folder)
+    built = frozenset(manifest.values())
+
+    @app.url_defaults
+    def fingerprinted_static(endpoint, values):
+        """
+        Swap a static filename for its fingerprinted build, when there is one
+        """
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    @app.before_request
+    def serve_precompressed():
+        """
+        Answer requests for fingerprinted assets with the best precompressed variant the client accepts
+        """
+        if not is_fingerprinted(app):
+            return None
+
+        filename = request.view_args['filename']
+        for encoding, suffix in ENCODINGS:
+            if encoding in request.accept_encodings:
+                response = send_from_directory(app.static_folder, filename + suffix,
+                                               mimetype=guess_mimetype(filename), conditional=True)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename, conditional=True)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    # Let the browser (or an Early Hints-capable proxy) fetch layout assets before the page arrives
+    preload = ", ".join(
+        f"<{app.static_url_path}/{manifest.get(source, source)}>; rel=preload; as={kind}"
+        for source, kind in LAYOUT_ASSETS)
+
+    app.extensions['assets'] = Assets(built, preload)
+
+
+def guess_mimetype(filename):
+    """
+    Content type of a built asset, from its source extension
+    """
+    return 'text/css' if filename.endswith('.css') else 'text/javascript'
@@ -15,9 +15,10 @@ from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from preppydb import db_session
+from fragments import render_shared
 from helpers import apology
 from dbmodels import Families, Tokens, Users
-from utils import mail
+from utils import get_mail
 
 auth_routes = Blueprint('auth_routes', __name__)
 
@@ -80,7 +81,7 @@ def login():
 
     print(get_flashed_messages)
     # User reached route via GET (as by clicking a link or via redirect)
-    return render_template("login.html", nonce=g.nonce)
+    return render_shared("login.html")
 
 
 @auth_routes.route("/forgot", methods=['GET', 'POST'])
@@ -126,7 +127,7 @@ def forgot():
             msg = Message('Your token', sender=os.getenv(
                 'MAIL_USERNAME'), recipients=[email])
             msg.body = f"Your token is: {token}"
-            mail.send(msg)
+            get_mail().send(msg)
 
         except SQLAlchemyError as e:
             db_session.rollback()
@@ -137,7 +138,7 @@ def forgot():
             return apology(" ".join(errors))
         return redirect(url_for('auth_routes.verify'))
 
-    return render_template('forgot.html', nonce=g.nonce)
+    return render_shared('forgot.html')
 
 
 @auth_routes.route("/verify", methods=['GET', 'POST'])
@@ -173,7 +174,7 @@ def verify():
 
         return redirect(url_for('auth_routes.reset'))
 
-    return render_template("verify.html", nonce=g.nonce)
+    return render_shared("verify.html")
 
 
 @auth_routes.route("/reset", methods=['GET', 'POST'])
@@ -331,7 +332,7 @@ def register():
         return redirect(url_for('index'))
 
     # if requested via get, display registration form
-    return render_template("register.html", nonce=g.nonce)
+    return render_shared("register.html")
 
 
 def is_valid_email(email):
@@ -0,0 +1,93 @@
+"""
+Benchmark for batch uploads: time to store 20 files (10 compressible 2 MB documents and 10 random 5 MB
+scans) as 20 sequential /new_upload requests against one /new_uploads request, with UPLOAD_THREADS=1
+and the default 4
+
+python bench/batch_uploads.py [--rounds 3]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import print_table, run_variant, scratch, seeded_app, signed_in  # noqa: E402
+
+
+def batch_files():
+    """
+    (name, contents) of the 20 files, the same on every call
+    """
+    rng = random.Random(25)
+    words = [rng.randbytes(rng.randint(3, 9)).hex() for _ in range(500)]
+    files = []
+    for n in range(10):
+        text = ' '.join(rng.choice(words) for _ in range(200_000)).encode()[:2_000_000]
+        files.append((f'doc{n}.txt', text))
+    for n in range(10):
+        files.append((f'scan{n}.jpg', rng.randbytes(5_000_000)))
+    return files
+
+
+def run(rounds):
+    """
+    Store the files as single uploads and as one batch in each round, under new names each time, taking
+    turns at going first
+    """
+    scratch()
+    app = seeded_app()
+    client = signed_in(app, 'uploader@example.com', household=False)
+    files = batch_files()
+
+    def singles(prefix):
+        for name, contents in files:
+            response = client.post('/new_upload', data={'file': (io.BytesIO(contents), prefix + name)},
+                                   content_type='multipart/form-data')
+            assert response.status_code == 302, response.status_code
+
+    def batch(prefix):
+        response = client.post('/new_uploads', data={'files': [(io.BytesIO(contents), prefix + name)
+                                                               for name, contents in files]},
+                               content_type='multipart/form-data')
+        assert response.status_code == 201, response.status_code
+        assert all(entry['status'] == 'stored' for entry in response.json['files'])
+
+    results = {'singles': [], 'batch': []}
+    for n in range(rounds):
+        order = [('singles', singles), ('batch', batch)]
+        for kind, upload in order if n % 2 == 0 else reversed(order):
+            start = time.perf_counter()
+            upload(f'{kind}{n}-')
+            results[kind].append(time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--variant', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run(args.rounds)))
+        return
+
+    def spread(values):
+        return f'{min(values):.2f}-{max(values):.2f}'
+
+    size = sum(len(contents) for _, contents in batch_files())
+    rows = []
+    for threads in (1, 4):
+        results = run_variant(__file__, '--variant', '--rounds', args.rounds, UPLOAD_THREADS=str(threads))
+        rows.append([threads, spread(results['singles']), spread(results['batch'])])
+    print(f"20 files, {size / 1e6:.0f} MB; {args.rounds} rounds each through the test client, min-max seconds; "
+          f"CPUs: {os.cpu_count()}\n")
+    print_table(['UPLOAD_THREADS', '20 x /new_upload', '1 x /new_uploads'], rows)
+
+
+if __name__ == '__main__':
+    main()
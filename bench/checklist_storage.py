@@ -0,0 +1,205 @@
+"""
+Benchmark for the checklist bitmaps: db size, go-bag checklist load time and progress save time with
+one bitmap row per user and kit, against the one-row-per-item tables they replaced (migration
+e41f0a9c6b27). Each user has GOBAG go-bag, SHELTER shelter and TASKS task items, half of them done.
+
+python bench/checklist_storage.py [--users 100000]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import median_us, print_table, scratch, seeded_app  # noqa: E402
+
+GOBAG, SHELTER, TASKS = 40, 30, 15
+
+
+def legacy_tables(metadata):
+    """
+    The per-item tables as they were before the bitmaps, after migration 9c3e5d1a7f42 clustered them
+    """
+    from sqlalchemy import Column, Index, Integer, Table, Text
+
+    def per_item(name, key, *columns):
+        return Table(name, metadata, Column('user_id', Integer, primary_key=True),
+                     Column(key, Text, primary_key=True), *columns, sqlite_with_rowid=False)
+
+    savedsupplies = per_item('savedsupplies', 'supply_uuid', Column('gobag', Text, nullable=False),
+                             Column('shelter', Text, nullable=False))
+    Index('ix_savedsupplies_user_id_gobag', savedsupplies.c.user_id, savedsupplies.c.gobag)
+    Index('ix_savedsupplies_user_id_shelter', savedsupplies.c.user_id, savedsupplies.c.shelter)
+    return {'gobags': per_item('gobags', 'supply_uuid'), 'shelters': per_item('shelters', 'supply_uuid'),
+            'customtasks': per_item('customtasks', 'task_uuid'), 'savedsupplies': savedsupplies,
+            'savedtasks': per_item('savedtasks', 'task_uuid')}
+
+
+def items(catalog):
+    """
+    The go-bag, shelter and task entries every user has chosen
+    """
+    gobag = [supply for supply in catalog.supplies if supply.gobag == 'y'][:GOBAG]
+    shelter = [supply for supply in catalog.supplies if supply.shelter == 'y'][:SHELTER]
+    tasks = list(catalog.tasks_by_id.values())[:TASKS]
+    return gobag, shelter, tasks
+
+
+def fill(engine, statement, rows):
+    """
+    Insert rows through the engine's driver directly, as ORM inserts would take far longer than the
+    benchmark itself
+    """
+    connection = engine.raw_connection()
+    try:
+        connection.cursor().executemany(statement, rows)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def populate_bitmaps(engine, users, gobag, shelter, tasks):
+    from checklists import pack, to_bits
+
+    kits = {'gobag': gobag, 'shelter': shelter, 'task': tasks}
+    fill(engine, "INSERT INTO users (id, username, hash, revision) VALUES (?, ?, 'x', 0)",
+         ((user_id, f'user{user_id}@example.com') for user_id in range(1, users + 1)))
+    fill(engine, "INSERT INTO checklists (user_id, kit, selected, done) VALUES (?, ?, ?, ?)",
+         ((user_id, kit, pack(to_bits(entry.id for entry in entries)),
+           pack(to_bits(entry.id for entry in entries[:len(entries) // 2])))
+          for user_id in range(1, users + 1) for kit, entries in kits.items()))
+
+
+def populate_legacy(engine, tables, users, gobag, shelter, tasks):
+    done_gobag = {supply.uuid for supply in gobag[:GOBAG // 2]}
+    done_shelter = {supply.uuid for supply in shelter[:SHELTER // 2]}
+    tracked = list(dict.fromkeys(supply.uuid for supply in gobag + shelter))
+    user_ids = range(1, users + 1)
+    fill(engine, "INSERT INTO users (id, username, hash, revision) VALUES (?, ?, 'x', 0)",
+         ((user_id, f'user{user_id}@example.com') for user_id in user_ids))
+    fill(engine, "INSERT INTO gobags VALUES (?, ?)",
+         ((user_id, supply.uuid) for user_id in user_ids for supply in gobag))
+    fill(engine, "INSERT INTO shelters VALUES (?, ?)",
+         ((user_id, supply.uuid) for user_id in user_ids for supply in shelter))
+    fill(engine, "INSERT INTO customtasks VALUES (?, ?)",
+         ((user_id, task.uuid) for user_id in user_ids for task in tasks))
+    fill(engine, "INSERT INTO savedsupplies VALUES (?, ?, ?, ?)",
+         ((user_id, uuid, 'Yes' if uuid in done_gobag else 'No', 'Yes' if uuid in done_shelter else 'No')
+          for user_id in user_ids for uuid in tracked))
+    fill(engine, "INSERT INTO savedtasks VALUES (?, ?)",
+         ((user_id, task.uuid) for user_id in user_ids for task in tasks[:TASKS // 2]))
+
+
+def legacy_sync(session, tables, user_id, uuids):
+    """
+    Save go-bag progress as the per-item tables did: read the checked rows, upsert the added ones and
+    uncheck the removed ones in one transaction
+    """
+    from sqlalchemy import select, update
+
+    from preppydb import upsert
+
+    saved_supplies = tables['savedsupplies']
+    saved = set(session.execute(select(saved_supplies.c.supply_uuid).where(
+        (saved_supplies.c.user_id == user_id) & (saved_supplies.c.gobag == 'Yes'))).scalars())
+    added, removed = set(uuids) - saved, saved - set(uuids)
+    if added:
+        stmt = upsert(saved_supplies).values(
+            [{'user_id': user_id, 'supply_uuid': uuid, 'gobag': 'Yes', 'shelter': 'No'} for uuid in added])
+        stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'supply_uuid'], set_={'gobag': 'Yes'})
+        session.execute(stmt)
+    if removed:
+        session.execute(update(saved_supplies).where(
+            (saved_supplies.c.user_id == user_id) & saved_supplies.c.supply_uuid.in_(removed)
+        ).values({'gobag': 'No'}))
+    session.commit()
+
+
+def legacy_load(session, tables, user_id):
+    """
+    Load the go-bag checklist as the per-item tables did: the chosen catalog and custom items, then the
+    acquired ones
+    """
+    from sqlalchemy import select
+
+    from dbmodels import CustomInput, Supplies
+
+    gobags, saved_supplies = tables['gobags'], tables['savedsupplies']
+    chosen = select(Supplies.item.label('supply_name'), Supplies.uuid.label('supply_uuid')).where(
+        Supplies.uuid.in_(select(gobags.c.supply_uuid).where(gobags.c.user_id == user_id)))
+    custom = select(CustomInput.name, CustomInput.uuid).where(
+        (CustomInput.user_id == user_id) & (CustomInput.type == 'gobag'))
+    rows = session.execute(chosen.union(custom).order_by('supply_name')).all()
+    done = set(session.execute(select(saved_supplies.c.supply_uuid).where(
+        (saved_supplies.c.user_id == user_id) & (saved_supplies.c.gobag == 'Yes'))).scalars())
+    return {row.supply_uuid: {'supply_name': row.supply_name, 'done': row.supply_uuid in done} for row in rows}
+
+
+def db_size(engine):
+    """
+    Bytes in the db file, once everything written is in it
+    """
+    connection = engine.raw_connection()
+    try:
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        connection.close()
+    return os.path.getsize(engine.url.database)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    args = parser.parse_args()
+
+    workdir = scratch()
+    app = seeded_app()
+    from sqlalchemy import MetaData, create_engine, event
+    from sqlalchemy.orm import Session
+
+    from catalog import get_catalog
+    from checklists import load_checklist, sync_progress
+    from preppydb import db_session, engine, set_sqlite_pragmas
+
+    # The legacy db starts as a copy of the seeded one, before any checklist rows are added, and is
+    # tuned the same way
+    legacy_path = os.path.join(workdir, 'legacy.db')
+    db_size(engine)
+    shutil.copy(engine.url.database, legacy_path)
+    legacy_engine = create_engine(f'sqlite:///{legacy_path}')
+    event.listen(legacy_engine, 'connect', set_sqlite_pragmas)
+    legacy_session = Session(legacy_engine)
+    metadata = MetaData()
+    tables = legacy_tables(metadata)
+    metadata.create_all(legacy_engine)
+
+    gobag, shelter, tasks = items(get_catalog())
+    populate_bitmaps(engine, args.users, gobag, shelter, tasks)
+    populate_legacy(legacy_engine, tables, args.users, gobag, shelter, tasks)
+
+    def user():
+        return random.randint(1, args.users)
+
+    def progress():
+        return random.sample([supply.uuid for supply in gobag], GOBAG // 2)
+
+    with app.app_context():
+        load_us = median_us(lambda: load_checklist(user(), 'gobag'))
+        save_us = median_us(lambda: sync_progress('gobag', user(), progress(), []))
+        db_session.remove()
+    legacy_load_us = median_us(lambda: legacy_load(legacy_session, tables, user()))
+    legacy_save_us = median_us(lambda: legacy_sync(legacy_session, tables, user(), progress()))
+    legacy_session.close()
+
+    print(f"{args.users} users with {GOBAG} go-bag, {SHELTER} shelter and {TASKS} task items, half done\n")
+    print_table(['', 'per-item tables', 'bitmaps'], [
+        ['db size (MB)', f'{db_size(legacy_engine) / 1e6:.1f}', f'{db_size(engine) / 1e6:.1f}'],
+        ['go-bag load (us)', f'{legacy_load_us:.0f}', f'{load_us:.0f}'],
+        ['go-bag save (us)', f'{legacy_save_us:.0f}', f'{save_us:.0f}'],
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark for the set-based checklist sync: db statements and commits per /postgobag and /poststock
+request, and median request time, as the number of supplies checked off grows
+
+python bench/checklist_sync.py
+"""
+
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import print_table, scratch, seeded_app, signed_in, timings  # noqa: E402
+
+# Saving route, and the route choosing the supplies it saves progress on, for each kit
+KITS = {'gobag': ('/postbuild', '/postgobag'), 'shelter': ('/postshelter', '/poststock')}
+CUSTOM_ITEMS = 5
+
+
+class StatementCounter:
+    """
+    Count the statements and commits an engine runs while counting
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.statements = self.commits = 0
+        self.counting = False
+        event.listen(engine, 'before_cursor_execute', self.statement)
+        event.listen(engine, 'commit', self.commit)
+
+    def statement(self, *args):
+        self.statements += self.counting
+
+    def commit(self, *args):
+        self.commits += self.counting
+
+    def count(self, function):
+        self.statements = self.commits = 0
+        self.counting = True
+        try:
+            function()
+        finally:
+            self.counting = False
+        return self.statements, self.commits
+
+
+def main():
+    scratch()
+    app = seeded_app()
+    from catalog import get_catalog
+    from preppydb import engine
+
+    counter = StatementCounter(engine)
+    catalog = get_catalog()
+    rows = []
+    for kit, (choose, save) in KITS.items():
+        client = signed_in(app, f'{kit}@example.com')
+        supplies = [supply for supply in catalog.supplies if getattr(supply, kit) == 'y']
+        assert client.post(choose, data={'supply': [supply.item for supply in supplies]}).status_code == 302
+        custom = '/customsupply' if kit == 'gobag' else '/customstock'
+        for n in range(CUSTOM_ITEMS):
+            client.post(custom, data={'custom_supply': f'extra {n}'})
+
+        for checked in sorted({1, 10, 25, 50, len(supplies)}):
+            if checked > len(supplies):
+                continue
+            form = {'supply': [supply.uuid for supply in supplies[:checked]]}
+
+            def post():
+                assert client.post(save, data=form).status_code == 302
+
+            statements, commits = counter.count(post)
+            seconds = statistics.median(timings(post, 50))
+            rows.append([save, checked, statements, commits, f'{seconds * 1e3:.2f}'])
+
+    print(f"{CUSTOM_ITEMS} custom items per kit; statements and commits include the session's own\n")
+    print_table(['route', 'checked', 'statements', 'commits', 'ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
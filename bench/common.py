@@ -0,0 +1,121 @@
+"""
+Shared setup for the benchmarks: a scratch directory holding the db, keyfile, logs and uploads (as the
+tests use), and helpers to time calls, run a benchmark under other settings and print results.
+
+Each benchmark is run from the repo root, e.g. python bench/indexes.py, and leaves the repo's own db
+and uploads alone.
+"""
+
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def scratch(**settings):
+    """
+    Point the app at a new scratch directory, with settings added to the environment, and return the
+    directory. Settings are read when the app's modules are first imported, and init_db reads its csv
+    files from the working directory, so this runs before any of them are imported.
+    """
+    workdir = tempfile.mkdtemp(prefix='preppy-bench-')
+    for name in os.listdir(ROOT):
+        if name.endswith('.csv'):
+            shutil.copy(os.path.join(ROOT, name), workdir)
+    os.makedirs(os.path.join(workdir, 'logs'))
+    os.makedirs(os.path.join(workdir, 'uploads'))
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'preppy.db')}",
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'SECRET_KEY': 'bench-secret-key',
+        'MAIL_PORT': '25',
+        'TEMPLATE_CACHE_DIR': os.path.join(workdir, 'template-cache'),
+        **settings,
+    })
+    return workdir
+
+
+def seeded_app():
+    """
+    Seed the scratch db from the csv files and build an app on it, with CSRF checks off so forms can be
+    posted directly
+    """
+    import init_db
+    from app import create_app
+
+    init_db.init_db()
+    app = create_app()
+    app.config.update(WTF_CSRF_ENABLED=False)
+    return app
+
+
+def signed_in(app, email, household=True):
+    """
+    A test client signed in as a newly registered user, who has entered their household unless told not to
+    """
+    client = app.test_client()
+    response = client.post('/register', data={'username': email, 'password': 'pw', 'confirmation': 'pw'})
+    assert response.status_code == 302, response.status_code
+    if household:
+        response = client.post('/editfamily', data={'name': 'Doe', 'adults': 2, 'seniors': 1, 'children': 1,
+                                                    'pets': 1, 'state': 'CA', 'special': 'No'})
+        assert response.status_code == 302, response.status_code
+    return client
+
+
+def timings(function, repeat):
+    """
+    Seconds taken by each of repeat calls to function
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def median_us(function, repeat=200):
+    """
+    Median microseconds per call to function, after one call to warm it up
+    """
+    function()
+    return statistics.median(timings(function, repeat)) * 1e6
+
+
+def run_variant(script, *args, **settings):
+    """
+    Run a benchmark script in a fresh process with settings added to its environment, and return the
+    JSON document it prints last. Settings read at import (SQLite tuning, session backend, codec) differ
+    per process, so variants are compared this way.
+    """
+    result = subprocess.run([sys.executable, script, *map(str, args)], env=dict(os.environ, **settings),
+                            cwd=ROOT, check=True, stdout=subprocess.PIPE, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_table(headings, rows):
+    """
+    Print rows under headings as aligned columns, with numbers right-aligned
+    """
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(heading), *(len(row[column]) for row in rows)) for column, heading in enumerate(headings)]
+    for row in [headings, *rows]:
+        print('  '.join(cell.rjust(width) if is_number(cell) else cell.ljust(width)
+                        for cell, width in zip(row, widths)).rstrip())
+
+
+def is_number(cell):
+    try:
+        float(cell.replace(',', ''))
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,182 @@
+"""
+Benchmark for compressed containers and cold storage, on a generated corpus of text documents, HTML
+pages, incompressible "scans" and the app's csv files:
+
+- encrypted bytes per kind of file as Fernet tokens (how files were first stored) and as containers
+  with compression off and on
+- through the app, with UPLOAD_COMPRESSION off and zlib: time to upload and download every file, and
+  the bytes left in the upload folder
+- with zlib, after marking most files idle: time for the tiering job to move them, the bytes left hot
+  and cold, and time to the first 4 KiB of a hot file, a cold one (which recalls it) and a recalled one
+
+python bench/file_storage.py [--scale 1.0] [--idle 0.8]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import ROOT, print_table, run_variant, scratch, seeded_app, signed_in  # noqa: E402
+
+WORDS = ('prepare emergency water supply shelter family evacuation route contact medical insurance policy '
+         'battery radio flashlight blanket document copy passport deed county shelter pet carrier food '
+         'canned opener whistle mask plastic sheeting duct tape wrench pliers map charger cash').split()
+
+
+def corpus(scale):
+    """
+    (kind, name, contents) of each generated file, the same on every call
+    """
+    rng = random.Random(2026)
+
+    def prose(size):
+        words = []
+        length = 0
+        while length < size:
+            sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + '. '
+            words.append(sentence)
+            length += len(sentence)
+        return ''.join(words)[:size]
+
+    files = []
+    for n in range(int(120 * scale)):
+        files.append(('text', f'notes{n}.txt', prose(rng.randint(50_000, 400_000)).encode()))
+    for n in range(int(80 * scale)):
+        body = ''.join(f'<tr><td class="item">{rng.choice(WORDS)}</td><td>{rng.randint(1, 99)}</td></tr>\n'
+                       for _ in range(rng.randint(400, 1600)))
+        files.append(('html', f'page{n}.html', f'<html><body><table>\n{body}</table></body></html>'.encode()))
+    for n in range(int(10 * scale)):
+        files.append(('scan', f'scan{n}.jpg', rng.randbytes(rng.randint(1_000_000, 3_000_000))))
+    for name in sorted(os.listdir(ROOT)):
+        if name.endswith('.csv'):
+            with open(os.path.join(ROOT, name), 'rb') as f:
+                files.append(('csv', name, f.read()))
+    return files
+
+
+def folder_bytes(folder):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(folder) for name in names if name.endswith('.enc'))
+
+
+def encrypted_sizes(files):
+    """
+    Encrypted bytes of each kind of file, as Fernet tokens and as containers with each codec
+    """
+    import securefiles
+
+    fernet = securefiles.load_keys()[0]
+    sizes = {}
+    for kind, _, contents in files:
+        totals = sizes.setdefault(kind, {'plain': 0, 'fernet': 0, 'off': 0, 'zlib': 0})
+        totals['plain'] += len(contents)
+        totals['fernet'] += len(fernet.encrypt(contents))
+        for codec in ('off', 'zlib'):
+            dest = io.BytesIO()
+            securefiles.encrypt_stream(io.BytesIO(contents), dest, codec=securefiles.CODECS[codec])
+            totals[codec] += dest.tell()
+    return sizes
+
+
+def first_bytes_ms(client, name):
+    start = time.perf_counter()
+    response = client.get(f'/download?filename={name}', headers={'Range': 'bytes=0-4095'})
+    assert response.status_code == 206 and len(response.data) == 4096, response.status_code
+    return (time.perf_counter() - start) * 1e3
+
+
+def through_app(scale, idle):
+    """
+    Upload and download the corpus as one user, then tier the idle share of it and read back from each tier
+    """
+    workdir = scratch()
+    os.environ['COLD_STORAGE_FOLDER'] = os.path.join(workdir, 'cold')
+    app = seeded_app()
+    from sqlalchemy import update
+
+    from dbmodels import SecFileMetadata
+    from preppydb import engine
+    from storage import TieringJob
+
+    files = corpus(scale)
+    client = signed_in(app, 'storage@example.com', household=False)
+    start = time.perf_counter()
+    for _, name, contents in files:
+        response = client.post('/new_upload', data={'file': (io.BytesIO(contents), name)},
+                               content_type='multipart/form-data')
+        assert response.status_code == 302, response.status_code
+    uploaded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _, name, contents in files:
+        assert client.get(f'/download?filename={name}').data == contents
+    downloaded = time.perf_counter() - start
+    stored = folder_bytes(app.config['UPLOAD_FOLDER'])
+
+    # Leave the first files recently read and mark the rest as unread for a long time
+    names = [name for _, name, _ in files]
+    idle_names = names[int(len(names) * (1 - idle)):]
+    with engine.begin() as connection:
+        connection.execute(update(SecFileMetadata).where(SecFileMetadata.filename.in_(idle_names))
+                           .values(last_access=0))
+    start = time.perf_counter()
+    moved = TieringJob(app, interval=0, batch=100).run()
+    tiered = time.perf_counter() - start
+
+    hot_after = folder_bytes(app.config['UPLOAD_FOLDER'])
+    cold_after = folder_bytes(app.config['COLD_STORAGE_FOLDER'])
+    # Reads are timed on files with at least the 4 KiB asked for
+    large = {name for _, name, contents in files if len(contents) >= 4096}
+    cold = [name for name in idle_names if name in large][:20]
+    hot = [name for name in names if name in large and name not in idle_names][:20]
+    cold_reads = [first_bytes_ms(client, name) for name in cold]
+    recalled_reads = [first_bytes_ms(client, name) for name in cold]
+    hot_reads = [first_bytes_ms(client, name) for name in hot]
+    return {'files': len(files), 'upload': uploaded, 'download': downloaded, 'hot': stored,
+            'moved': moved, 'tiering': tiered, 'hot_after': hot_after, 'cold_after': cold_after,
+            'first_hot': statistics.median(hot_reads), 'first_cold': statistics.median(cold_reads),
+            'first_recalled': statistics.median(recalled_reads)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplies the number of generated files")
+    parser.add_argument('--idle', type=float, default=0.8, help="share of files marked idle before tiering")
+    parser.add_argument('--variant', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(through_app(args.scale, args.idle)))
+        return
+
+    scratch()
+    files = corpus(args.scale)
+    sizes = encrypted_sizes(files)
+    print(f"{len(files)} files, {sum(len(contents) for *_, contents in files) / 1e6:.1f} MB\n")
+    print_table(['kind', 'plain MB', 'Fernet MB', 'container MB', 'zlib container MB'], [
+        [kind, *(f'{totals[key] / 1e6:.2f}' for key in ('plain', 'fernet', 'off', 'zlib'))]
+        for kind, totals in sizes.items()])
+
+    results = {codec: run_variant(__file__, '--variant', '--scale', args.scale, '--idle', args.idle,
+                                  UPLOAD_COMPRESSION=codec) for codec in ('off', 'zlib')}
+    print()
+    print_table(['UPLOAD_COMPRESSION', 'upload all s', 'download all s', 'upload folder MB'], [
+        [codec, f"{result['upload']:.2f}", f"{result['download']:.2f}", f"{result['hot'] / 1e6:.1f}"]
+        for codec, result in results.items()])
+
+    tiering = results['zlib']
+    print(f"\nzlib, {args.idle:.0%} of files idle: moved {tiering['moved']} files in {tiering['tiering']:.2f} s, "
+          f"leaving {tiering['hot_after'] / 1e6:.1f} MB hot and {tiering['cold_after'] / 1e6:.1f} MB cold")
+    print("median ms to the first 4 KiB: "
+          f"hot {tiering['first_hot']:.1f}, cold (recalled on read) {tiering['first_cold']:.1f}, "
+          f"recalled {tiering['first_recalled']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark for the per-user indexes: query plans and lookup times of the hot per-user filters on a db
+of many users, with the indexes and with them dropped (as the tables were before migration 9c3e5d1a7f42)
+
+python bench/indexes.py [--users 10000]
+"""
+
+import argparse
+import os
+import random
+import sys
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import median_us, print_table, scratch  # noqa: E402
+
+# Each hot lookup, the index it relies on and the parameters to look up for a user
+LOOKUPS = [
+    ('contacts by user', 'ix_contacts_user_id',
+     "SELECT * FROM contacts WHERE user_id = :user_id", {}),
+    ('medical by user', 'ix_medical_user_id',
+     "SELECT * FROM medical WHERE user_id = :user_id", {}),
+    ('providers by user', 'ix_providers_user_id',
+     "SELECT * FROM providers WHERE user_id = :user_id", {}),
+    ('calendar by user, name', 'ix_calendar_user_id_name',
+     "SELECT id FROM calendar WHERE user_id = :user_id AND name = :name", {'name': 'Member 1'}),
+    ('events by person', 'ix_events_person_id',
+     "SELECT * FROM events WHERE person_id = :user_id", {}),
+    ('families by user', 'ix_families_user_id',
+     "SELECT * FROM families WHERE user_id = :user_id", {}),
+    ('tokens by user', 'ix_tokens_user_id',
+     "SELECT token FROM tokens WHERE user_id = :user_id", {}),
+    ('files by user, name', 'ix_secfilemetadata_user_id_filename',
+     "SELECT secure_filename FROM secfilemetadata WHERE user_id = :user_id AND filename = :name",
+     {'name': 'file1.pdf'}),
+    ('custom items by user, kit', 'ix_custominput_user_id_type',
+     "SELECT name, uuid FROM custominput WHERE user_id = :user_id AND type = :kit", {'kit': 'gobag'}),
+    ('supplies by item', 'ix_supplies_item',
+     "SELECT * FROM supplies WHERE item = :name", {'name': 'water'}),
+    ('tasks by name', 'ix_tasks_task',
+     "SELECT * FROM tasks WHERE task = :name", {'name': 'get_vaccinated'}),
+]
+
+
+def populate(engine, users):
+    """
+    Give each of users users a household, contacts, medical and provider records, household members
+    with events, stored files, custom items and a reset token
+    """
+    from sqlalchemy import insert
+
+    from dbmodels import (Calendar, Contacts, CustomInput, Events, Families, Medical, Providers,
+                          SecFileMetadata, Tokens, Users)
+
+    ids = range(1, users + 1)
+    now = datetime.now()
+    rows = {
+        Users: [{'id': i, 'username': f'user{i}@example.com', 'hash': 'x'} for i in ids],
+        Families: [{'user_id': i, 'last_name': 'Doe', 'adults': 2, 'state_id': 5} for i in ids],
+        Contacts: [{'user_id': i, 'first_name': f'Contact {n}', 'last_name': 'Doe', 'phone': '555'}
+                   for i in ids for n in range(3)],
+        Medical: [{'user_id': i, 'first_name': f'Member {n}', 'blood_type': 'O+'} for i in ids for n in range(2)],
+        Providers: [{'user_id': i, 'last_name': 'Smith', 'phone': '555'} for i in ids],
+        Calendar: [{'id': i * 2 + n, 'user_id': i, 'name': f'Member {n}'} for i in ids for n in range(2)],
+        Events: [{'person_id': i * 2 + n % 2, 'title': 'School', 'start_time': '08:00', 'start_day': 'Mon',
+                  'end_time': '15:00', 'end_day': 'Mon', 'address': 'Here'} for i in ids for n in range(4)],
+        SecFileMetadata: [{'user_id': i, 'filename': f'file{n}.pdf', 'secure_filename': f'{i}-{n}.enc'}
+                          for i in ids for n in range(3)],
+        CustomInput: [{'user_id': i, 'type': ('gobag', 'shelter', 'task')[n % 3], 'name': f'Item {n}',
+                       'uuid': f'{i}-{n}'} for i in ids for n in range(5)],
+        Tokens: [{'user_id': i, 'token': f'token-{i}', 'timestamp': now} for i in ids],
+    }
+    with engine.begin() as connection:
+        for table, values in rows.items():
+            connection.execute(insert(table), values)
+
+
+def measure(engine, users):
+    """
+    Query plan and median lookup time of each hot lookup, for random users
+    """
+    from sqlalchemy import text
+
+    results = {}
+    with engine.connect() as connection:
+        for label, _, sql, params in LOOKUPS:
+            query = text(sql)
+
+            def lookup():
+                connection.execute(query, {'user_id': random.randint(1, users), **params}).all()
+
+            plan = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), {'user_id': 1, **params}).all()
+            results[label] = (' / '.join(row[-1] for row in plan), median_us(lookup))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args()
+
+    scratch()
+    import init_db
+    from sqlalchemy import text
+    from preppydb import engine
+
+    init_db.init_db()
+    populate(engine, args.users)
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+    indexed = measure(engine, args.users)
+
+    with engine.begin() as connection:
+        for _, index, _, _ in LOOKUPS:
+            connection.execute(text(f"DROP INDEX {index}"))
+        connection.execute(text("ANALYZE"))
+    unindexed = measure(engine, args.users)
+
+    print(f"{args.users} users\n")
+    print_table(['lookup', 'plan without indexes', 'plan with indexes'],
+                [[label, unindexed[label][0], indexed[label][0]] for label, *_ in LOOKUPS])
+    print()
+    print_table(['lookup', 'us without', 'us with'],
+                [[label, f'{unindexed[label][1]:.1f}', f'{indexed[label][1]:.1f}'] for label, *_ in LOOKUPS])
+
+
+if __name__ == '__main__':
+    main()
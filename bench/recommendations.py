@@ -0,0 +1,69 @@
+"""
+Benchmark for the bitset supply recommendations: a precomputed catalog lookup against the SQL join the
+go-bag and shelter pages used to run for each request, for every household mask and kit, checking both
+give the same disasters and supplies
+
+python bench/recommendations.py
+"""
+
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import median_us, print_table, scratch, timings  # noqa: E402
+
+
+def sql_recommendation(session, kit, mask):
+    """
+    (disaster, supply) pairs for a household mask and kit, as the pages used to query them
+    """
+    from sqlalchemy import or_
+
+    from catalog import AGE_CLASSES
+    from dbmodels import DisasterSupplies, Sits, Supplies
+
+    present = [getattr(Supplies, age_class) == 'y'
+               for position, age_class in enumerate(AGE_CLASSES) if mask >> position & 1]
+    return (session.query(Sits.sit, Supplies.item)
+            .join(DisasterSupplies, Sits.id == DisasterSupplies.disaster_id)
+            .join(Supplies, DisasterSupplies.item_id == Supplies.id)
+            .filter(getattr(Supplies, kit) == 'y')
+            .filter(or_(*present))
+            .order_by(Sits.probability)
+            .all())
+
+
+def main():
+    scratch()
+    import init_db
+    from catalog import AGE_CLASSES, KITS, Catalog, get_catalog
+    from preppydb import db_session
+
+    init_db.init_db()
+    catalog = get_catalog()
+    state_id = catalog.states_by_code['CA'].id
+
+    rows = []
+    mismatches = 0
+    for kit in KITS:
+        for mask in range(1, 1 << len(AGE_CLASSES)):
+            sits, _ = catalog.recommend(state_id, mask, kit)
+            looked_up = {(sit, item) for sit, listing in sits.items() for item in listing['items']}
+            mismatches += looked_up != set(sql_recommendation(db_session, kit, mask))
+
+        sql_us = median_us(lambda: sql_recommendation(db_session, kit, 0b1111))
+        lookup_us = median_us(lambda: catalog.recommend(state_id, 0b1111, kit), repeat=10000)
+        rows.append([kit, f'{sql_us:.1f}', f'{lookup_us:.2f}'])
+
+    generation = catalog.generation
+    build_ms = statistics.median(timings(lambda: Catalog(db_session, generation), 5)) * 1e3
+    db_session.remove()
+
+    print(f"{len(catalog.recommendations)} precomputed listings, built in {build_ms:.0f} ms per catalog load")
+    print(f"households whose SQL and lookup listings differ: {mismatches} of {2 * ((1 << len(AGE_CLASSES)) - 1)}\n")
+    print_table(['kit', 'us SQL', 'us lookup'], rows)
+
+
+if __name__ == '__main__':
+    main()
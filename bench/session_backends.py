@@ -0,0 +1,119 @@
+"""
+Benchmark for the session backends: median time to open and to save a changed session through the SQL
+backend's session interface as the number of stored sessions grows, with signed-cookie sessions
+alongside for comparison
+
+python bench/session_backends.py [--counts 1000,10000,100000,1000000] [--samples 2000]
+"""
+
+import argparse
+import os
+import random
+import secrets
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import print_table, scratch, seeded_app  # noqa: E402
+
+
+def payload(user_id):
+    """
+    What the app keeps in a signed-in session
+    """
+    return {'user_id': user_id, 'last_name': 'Doe', 'csrf_token': secrets.token_hex(20)}
+
+
+def add_sessions(engine, interface, start, count):
+    """
+    Store count unexpired sessions, numbered from start, and return their ids
+    """
+    expiry = int(time.time()) + 86400
+    sids = [secrets.token_urlsafe(32) for _ in range(count)]
+    connection = engine.raw_connection()
+    try:
+        connection.cursor().executemany(
+            "INSERT INTO sessions (id, data, expiry) VALUES (?, ?, ?)",
+            ((sid, interface.serializer.dumps(payload(start + n)).encode('utf-8'), expiry)
+             for n, sid in enumerate(sids)))
+        connection.commit()
+    finally:
+        connection.close()
+    return sids
+
+
+def requests_with(app, interface, cookies):
+    """
+    Requests carrying each session cookie value
+    """
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    name = interface.get_cookie_name(app)
+    return [Request(EnvironBuilder(headers={'Cookie': f'{name}={cookie}'}).get_environ()) for cookie in cookies]
+
+
+def open_and_save(app, interface, requests):
+    """
+    Median microseconds to open each request's session, and to save it after changing it
+    """
+    reads, writes = [], []
+    for request in requests:
+        start = time.perf_counter()
+        session = interface.open_session(app, request)
+        reads.append(time.perf_counter() - start)
+        assert session.get('user_id') is not None
+
+        session['last_name'] = secrets.token_hex(4)
+        response = app.response_class()
+        start = time.perf_counter()
+        interface.save_session(app, session, response)
+        writes.append(time.perf_counter() - start)
+    return statistics.median(reads) * 1e6, statistics.median(writes) * 1e6
+
+
+def signed_cookies(app, interface, count):
+    """
+    Signed session cookie values for count users
+    """
+    cookies = []
+    for user_id in range(count):
+        response = app.response_class()
+        session = interface.session_class(payload(user_id))
+        session.modified = True
+        interface.save_session(app, session, response)
+        cookies.append(response.headers['Set-Cookie'].split(';')[0].split('=', 1)[1])
+    return cookies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', default='1000,10000,100000,1000000')
+    parser.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+
+    scratch(SESSION_BACKEND='sql')
+    app = seeded_app()
+    from flask.sessions import SecureCookieSessionInterface
+
+    from preppydb import engine
+
+    sql = app.session_interface
+    cookie = SecureCookieSessionInterface()
+    cookie_requests = requests_with(app, cookie, signed_cookies(app, cookie, args.samples))
+
+    rows = []
+    sids = []
+    for count in map(int, args.counts.split(',')):
+        sids += add_sessions(engine, sql, len(sids), count - len(sids))
+        sql_read, sql_write = open_and_save(app, sql, requests_with(app, sql, random.choices(sids, k=args.samples)))
+        cookie_read, cookie_write = open_and_save(app, cookie, cookie_requests)
+        rows.append([f'{count:,}', f'{sql_read:.0f}', f'{sql_write:.0f}', f'{cookie_read:.0f}', f'{cookie_write:.0f}'])
+
+    print(f"median of {args.samples} random sessions, microseconds\n")
+    print_table(['sessions', 'sql open', 'sql save', 'cookie open', 'cookie save'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark for the SQLite tuning profile: write throughput of concurrent /postgobag and /tasksave posts
+from several processes sharing one db file (as gunicorn workers do), with SQLITE_TUNING on and off
+
+python bench/sqlite_tuning.py [--processes 8] [--pairs 40]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import print_table, run_variant, scratch, seeded_app, signed_in  # noqa: E402
+
+
+def post_pairs(client, supplies, tasks, pairs, start, finished):
+    """
+    Wait for every process to be ready, then post pairs of go-bag and task progress saves
+    """
+    start.wait()
+    rejected = 0
+    for n in range(pairs):
+        rejected += client.post('/postgobag', data={'supply': supplies[:n % len(supplies) + 1]}).status_code != 302
+        rejected += client.post('/tasksave', data={'task': tasks[:n % len(tasks) + 1]}).status_code != 302
+    finished.put((time.perf_counter(), rejected))
+
+
+def run(processes, pairs):
+    """
+    Time processes forked from one app, each posting pairs as its own user, and count the saves that
+    failed or were rejected
+    """
+    workdir = scratch()
+    app = seeded_app()
+    from catalog import get_catalog
+
+    catalog = get_catalog()
+    supplies = [supply.uuid for supply in catalog.supplies if supply.gobag == 'y']
+    tasks = [task.uuid for task in catalog.tasks_by_id.values()]
+    clients = [signed_in(app, f'writer{n}@example.com') for n in range(processes)]
+
+    context = multiprocessing.get_context('fork')
+    start = context.Barrier(processes + 1)
+    finished = context.Queue()
+    workers = [context.Process(target=post_pairs, args=(client, supplies, tasks, pairs, start, finished))
+               for client in clients]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    began = time.perf_counter()
+    ends, rejected = zip(*(finished.get() for _ in workers))
+    for worker in workers:
+        worker.join()
+
+    with open(os.path.join(workdir, 'logs', 'error.log'), encoding='utf-8') as log:
+        failed = sum('Database error' in line for line in log)
+    return {'seconds': max(ends) - began, 'requests': processes * pairs * 2, 'failed': failed + sum(rejected)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--pairs', type=int, default=40)
+    parser.add_argument('--variant', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run(args.processes, args.pairs)))
+        return
+
+    rows = []
+    for tuning in ('off', 'on'):
+        result = run_variant(__file__, '--variant', '--processes', args.processes, '--pairs', args.pairs,
+                             SQLITE_TUNING=tuning)
+        rows.append([tuning, result['requests'], f"{result['seconds']:.2f}",
+                     f"{result['requests'] / result['seconds']:.1f}", result['failed']])
+    print(f"{args.processes} processes, {args.pairs} /postgobag + /tasksave pairs each\n")
+    print_table(['SQLITE_TUNING', 'requests', 'seconds', 'req/s', 'failed saves'], rows)
+
+
+if __name__ == '__main__':
+    main()
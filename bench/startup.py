@@ -0,0 +1,134 @@
+"""
+Benchmark for app startup: time to import app.py and to run create_app() in fresh processes, their peak
+memory, and a preloading gunicorn as the Dockerfile runs it: time from start to first response, and the
+memory (PSS) of its master and workers after serving some requests
+
+python bench/startup.py [--runs 5] [--workers 4] [--requests 400]
+"""
+
+import argparse
+import json
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import ROOT, print_table, run_variant, scratch  # noqa: E402
+
+
+def build():
+    """
+    Time importing the app and building it in this process
+    """
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    app.create_app()
+    built = time.perf_counter()
+    return {'import': imported - start, 'create_app': built - imported,
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def pss_mb(pid):
+    """
+    Proportional set size of a process: its private memory plus its share of memory it shares
+    """
+    with open(f'/proc/{pid}/smaps_rollup', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children', encoding='utf-8') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def serve(workers, requests):
+    """
+    Start gunicorn on the scratch app, time its first response, send it requests, and measure its memory
+    """
+    port = free_port()
+    url = f'http://127.0.0.1:{port}/login'
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--preload', '-w', str(workers),
+                               '--threads', '4', '-b', f'127.0.0.1:{port}', '--pythonpath', ROOT,
+                               'app:create_app()'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(url).read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if server.poll() is not None:
+                    raise RuntimeError('gunicorn exited before serving a request')
+                time.sleep(0.01)
+        first_response = time.perf_counter() - start
+
+        for _ in range(requests):
+            urllib.request.urlopen(url).read()
+        worker_pids = children(server.pid)
+        return {'first_response': first_response, 'master_pss': pss_mb(server.pid),
+                'workers_pss': sum(pss_mb(pid) for pid in worker_pids)}
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--variant', choices=['build', 'serve'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        scratch()
+        if args.variant == 'build':
+            # The db is set up beforehand in a process of its own, as the Dockerfile does before the
+            # server starts
+            subprocess.run([sys.executable, os.path.join(ROOT, 'init_db.py')], check=True,
+                           env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL)
+            print(json.dumps(build()))
+        else:
+            import init_db
+            init_db.init_db()
+            print(json.dumps(serve(args.workers, args.requests)))
+        return
+
+    builds = [run_variant(__file__, '--variant', 'build') for _ in range(args.runs)]
+    serves = [run_variant(__file__, '--variant', 'serve', '--workers', args.workers, '--requests', args.requests)
+              for _ in range(args.runs)]
+
+    def spread(results, key, scale=1, digits=0):
+        values = [result[key] * scale for result in results]
+        return f'{min(values):.{digits}f}-{max(values):.{digits}f}'
+
+    print(f"{args.runs} runs each; gunicorn --preload with {args.workers} workers, PSS after "
+          f"{args.requests} requests\n")
+    print_table(['measure', 'min-max'], [
+        ['import app (ms)', spread(builds, 'import', 1e3)],
+        ['create_app() (ms)', spread(builds, 'create_app', 1e3)],
+        ['max RSS after create_app() (MB)', spread(builds, 'max_rss')],
+        ['gunicorn start to first response (s)', spread(serves, 'first_response', digits=2)],
+        ['gunicorn master PSS (MB)', spread(serves, 'master_pss')],
+        ['gunicorn workers PSS, all (MB)', spread(serves, 'workers_pss')],
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark for template warm-up: create_app() time and the first and a warm /login request in fresh
+processes, with templates compiled lazily on first use (as before warm-up), compiled at boot with no
+bytecode cache, and compiled at boot into an empty or an already populated bytecode cache directory.
+Lazy compiling is had by dropping the compiled templates once the app is built, so its create_app()
+still includes compiling them and is left out.
+
+python bench/templates.py [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import ROOT, print_table, run_variant, scratch  # noqa: E402
+
+MODES = {
+    'lazy': 'compiled on first use',
+    'off': 'at boot, TEMPLATE_CACHE_DIR=off',
+    'empty': 'at boot, empty cache dir',
+    'populated': 'at boot, populated cache dir',
+}
+
+
+def run(mode):
+    """
+    Time building the app and its first two /login requests
+    """
+    workdir = scratch()
+    cache_dir = 'off' if mode in ('lazy', 'off') else os.path.join(workdir, 'template-cache')
+    os.environ['TEMPLATE_CACHE_DIR'] = cache_dir
+
+    # The db, and for a populated cache an earlier boot, are set up in processes of their own
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, os.path.join(ROOT, 'init_db.py')], check=True, env=env,
+                   stdout=subprocess.DEVNULL)
+    if mode == 'populated':
+        subprocess.run([sys.executable, '-c', 'import app; app.create_app()'], check=True, env=env)
+
+    from app import create_app
+
+    start = time.perf_counter()
+    app = create_app()
+    built = time.perf_counter()
+    if mode == 'lazy':
+        app.jinja_env.cache.clear()
+
+    client = app.test_client()
+    timings = []
+    for _ in range(2):
+        start_request = time.perf_counter()
+        assert client.get('/login').status_code == 200
+        timings.append(time.perf_counter() - start_request)
+    return {'create_app': built - start, 'first': timings[0], 'warm': timings[1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--variant', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run(args.variant)))
+        return
+
+    def spread(results, key):
+        values = [result[key] * 1e3 for result in results]
+        return f'{min(values):.1f}-{max(values):.1f}'
+
+    rows = []
+    for mode, label in MODES.items():
+        results = [run_variant(__file__, '--variant', mode) for _ in range(args.runs)]
+        create_app = 'n/a' if mode == 'lazy' else spread(results, 'create_app')
+        rows.append([label, create_app, spread(results, 'first'), spread(results, 'warm')])
+    print(f"{args.runs} runs each, min-max milliseconds\n")
+    print_table(['templates', 'create_app()', 'first /login', 'warm /login'], rows)
+
+
+if __name__ == '__main__':
+    main()
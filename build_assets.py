@@ -0,0 +1,76 @@
+"""
+Module builds the static asset bundle: minifies the CSS and JS under static/, names each copy after a
+hash of its contents, precompresses it with gzip and brotli, and writes the manifest the app uses to
+link to them
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+import brotli
+import rcssmin
+import rjsmin
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST = os.path.join(DIST_DIR, 'manifest.json')
+
+# Source directories (relative to static/) and the minifier for their files
+SOURCES = {
+    'css': ('.css', rcssmin.cssmin),
+    'js': ('.js', rjsmin.jsmin),
+}
+
+
+def fingerprint(content):
+    """
+    Short content hash used in built file names
+    """
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def build_file(source, minify):
+    """
+    Minify, fingerprint and precompress one source file, returning its built path relative to static/
+    """
+    with open(os.path.join(STATIC_DIR, source), 'r', encoding='utf-8') as f:
+        content = minify(f.read()).encode('utf-8')
+
+    stem, ext = os.path.splitext(source)
+    built = f'dist/{stem}.{fingerprint(content)}{ext}'
+    path = os.path.join(STATIC_DIR, built)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as f:
+        f.write(content)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(content, quality=11))
+    return built
+
+
+def build_assets():
+    """
+    Rebuild static/dist from scratch and write its manifest of source -> built paths
+    """
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+
+    manifest = {}
+    for directory, (ext, minify) in SOURCES.items():
+        for name in sorted(os.listdir(os.path.join(STATIC_DIR, directory))):
+            if name.endswith(ext):
+                source = f'{directory}/{name}'
+                manifest[source] = build_file(source, minify)
+
+    with open(MANIFEST, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    for source, built in build_assets().items():
+        print(f'{source} -> {built}')
@@ -0,0 +1,263 @@
+"""
+Module holds an in-memory copy of the reference tables seeded by init_db (disasters, supplies, tasks and states)
+"""
+
+import os
+import secrets
+import threading
+import time
+
+from collections import namedtuple
+from types import MappingProxyType
+
+from flask import request
+from sqlalchemy import delete, insert, select
+
+from dbmodels import CatalogVersion, DisasterSupplies, DisasterTasks, Sits, StateDisasters, States, Supplies, Tasks
+from preppydb import Session, engine
+
+Sit = namedtuple('Sit', ['id', 'sit', 'probability'])
+Supply = namedtuple('Supply', ['id', 'uuid', 'item', 'per_person', 'gobag',
+                               'shelter', 'adult', 'child', 'senior', 'pet'])
+Task = namedtuple('Task', ['id', 'uuid', 'task', 'description'])
+State = namedtuple('State', ['id', 'state', 'full_name'])
+
+# Kits and household age classes, in bit order
+KITS = ('gobag', 'shelter')
+AGE_CLASSES = ('adult', 'senior', 'child', 'pet')
+
+# Seconds between checks for a reseed by another process, each one a single small query
+check_interval = float(os.getenv('CATALOG_CHECK_INTERVAL', '30'))
+
+# Loads and reseed checks land on a request now and then, so they are kept out of its query budget
+catalog_engine = engine.execution_options(budget_exempt=True)
+
+_catalog = None
+_checked_at = None
+_lock = threading.Lock()
+
+
+def _grouped(pairs, order):
+    """
+    Group (key, value) pairs into a read-only dict of tuples, with values sorted by the given order
+    """
+    groups = {}
+    for key, value in pairs:
+        groups.setdefault(key, []).append(value)
+    return MappingProxyType({key: tuple(sorted(values, key=order)) for key, values in groups.items()})
+
+
+def _members(bitset):
+    """
+    Yield the positions of the set bits in an integer bitset, lowest first
+    """
+    while bitset:
+        lowest = bitset & -bitset
+        yield lowest.bit_length() - 1
+        bitset ^= lowest
+
+
+def household_mask(adults, seniors, children, pets):
+    """
+    Bitmask of the age classes present in a household, in AGE_CLASSES order
+    """
+    mask = 0
+    for position, count in enumerate((adults, seniors, children, pets)):
+        if count > 0:
+            mask |= 1 << position
+    return mask
+
+
+class Catalog:
+    """
+    Read-only reference data keyed by id, uuid and name for constant-time lookups
+    """
+
+    def __init__(self, session, loaded_generation):
+        self.generation = loaded_generation
+
+        self.sits = tuple(sorted((Sit(row.id, row.sit, row.probability) for row in session.query(Sits)),
+                                 key=lambda sit: (sit.probability, sit.id)))
+        self.sits_by_id = MappingProxyType({sit.id: sit for sit in self.sits})
+        self.sits_by_name = MappingProxyType({sit.sit: sit for sit in self.sits})
+        sit_order = {sit.id: position for position, sit in enumerate(self.sits)}
+
+        supplies = [Supply(*(getattr(row, field) for field in Supply._fields))
+                    for row in session.query(Supplies).order_by(Supplies.id)]
+        self.supplies_by_id = MappingProxyType({supply.id: supply for supply in supplies})
+        self.supplies_by_uuid = MappingProxyType({supply.uuid: supply for supply in supplies})
+        self.supplies_by_item = MappingProxyType({supply.item: supply for supply in supplies})
+
+        tasks = [Task(row.id, row.uuid, row.task, row.description)
+                 for row in session.query(Tasks).order_by(Tasks.id)]
+        self.tasks_by_id = MappingProxyType({task.id: task for task in tasks})
+        self.tasks_by_uuid = MappingProxyType({task.uuid: task for task in tasks})
+        self.tasks_by_name = MappingProxyType({task.task: task for task in tasks})
+
+        self.states = tuple(State(row.id, row.state, row.full_name)
+                            for row in session.query(States).order_by(States.id))
+        self.states_by_id = MappingProxyType({state.id: state for state in self.states})
+        self.states_by_code = MappingProxyType({state.state: state for state in self.states})
+        self.state_codes = tuple(state.state for state in self.states)
+
+        # state id -> disaster ids, disaster id -> supply ids, disaster id -> task ids
+        self.state_disasters = _grouped(
+            ((row.state_id, row.disaster_id) for row in session.query(StateDisasters)
+             if row.disaster_id in sit_order),
+            order=sit_order.get)
+        self.disaster_supplies = _grouped(
+            ((row.disaster_id, row.item_id) for row in session.query(DisasterSupplies)), order=int)
+        task_ids = {task.uuid: task.id for task in tasks}
+        self.disaster_tasks = _grouped(
+            ((row.disaster_id, task_ids[row.task_uuid]) for row in session.query(DisasterTasks)
+             if row.task_uuid in task_ids),
+            order=int)
+
+        # Supply bitsets over supply ordinals (catalog order): one per kit, age class and disaster
+        self.supplies = tuple(supplies)
+        ordinals = {supply.id: ordinal for ordinal, supply in enumerate(self.supplies)}
+        self.kit_bits = MappingProxyType({kit: self._bits(lambda supply, kit=kit: getattr(supply, kit) == 'y')
+                                          for kit in KITS})
+        self.age_bits = tuple(self._bits(lambda supply, age_class=age_class: getattr(supply, age_class) == 'y')
+                              for age_class in AGE_CLASSES)
+        self.disaster_bits = MappingProxyType({
+            disaster_id: sum(1 << ordinals[item_id] for item_id in item_ids if item_id in ordinals)
+            for disaster_id, item_ids in self.disaster_supplies.items()})
+
+        # Every (state, household mask, kit) checklist, precomputed so pages only need a lookup
+        self.recommendations = self._recommendations()
+
+    def _bits(self, predicate):
+        """
+        Bitset of the supplies matching the predicate
+        """
+        return sum(1 << ordinal for ordinal, supply in enumerate(self.supplies) if predicate(supply))
+
+    def _recommendations(self):
+        """
+        Build the read-only disaster/supply listings for each state, household mask and kit
+        """
+        recommendations = {}
+        for kit in KITS:
+            for mask in range(1 << len(AGE_CLASSES)):
+                household = 0
+                for position in _members(mask):
+                    household |= self.age_bits[position]
+                household &= self.kit_bits[kit]
+
+                sit_items = []
+                supplies = {}
+                for sit in self.sits:
+                    items = tuple(self.supplies[ordinal].item
+                                  for ordinal in _members(self.disaster_bits.get(sit.id, 0) & household))
+                    if items:
+                        sit_items.append((sit, items))
+                        supplies.update(dict.fromkeys(items))
+                supplies = tuple(supplies)
+
+                for state_id in (None, *self.states_by_id):
+                    state_disasters = self.state_disasters.get(state_id, ())
+                    sits = MappingProxyType({
+                        sit.sit: MappingProxyType({'items': items, 'checked': sit.id in state_disasters})
+                        for sit, items in sit_items})
+                    recommendations[(state_id, mask, kit)] = (sits, supplies)
+        return MappingProxyType(recommendations)
+
+    def recommend(self, state_id, mask, kit):
+        """
+        Disasters with their suggested supplies, and all suggested supplies, for a household's kit
+        """
+        return self.recommendations.get((state_id, mask, kit), self.recommendations[(None, mask, kit)])
+
+    def state_disaster_names(self, state_id):
+        """
+        Names of the disasters most likely to affect residents of the given state
+        """
+        return frozenset(self.sits_by_id[disaster_id].sit
+                         for disaster_id in self.state_disasters.get(state_id, ()))
+
+    def disaster_task_rows(self):
+        """
+        (disaster, task) name pairs for every disaster, most probable disasters first
+        """
+        return [(sit.sit, self.tasks_by_id[task_id].task)
+                for sit in self.sits for task_id in self.disaster_tasks.get(sit.id, ())]
+
+
+def stored_generation():
+    """
+    The generation of the reference tables recorded in the db (None if never recorded)
+    """
+    with catalog_engine.connect() as connection:
+        return connection.execute(select(CatalogVersion.generation)).scalar()
+
+
+def _load(generation):
+    """
+    Replace the process-wide catalog with one loaded from the db. Called with the lock held.
+    """
+    global _catalog
+    session = Session(bind=catalog_engine)
+    try:
+        _catalog = Catalog(session, generation)
+    finally:
+        session.close()
+
+
+def get_catalog():
+    """
+    Return the process-wide catalog, loading it from the db on first use
+    """
+    catalog = _catalog
+    if catalog is not None:
+        return catalog
+
+    with _lock:
+        if _catalog is None:
+            _load(stored_generation())
+        return _catalog
+
+
+def invalidate():
+    """
+    Mark the catalog stale, e.g. after the reference tables have been reseeded: this process reloads it on
+    next use, and every other process after its next check
+    """
+    global _catalog
+    with engine.begin() as connection:
+        connection.execute(delete(CatalogVersion))
+        connection.execute(insert(CatalogVersion).values(id=1, generation=secrets.token_hex(8)))
+    with _lock:
+        _catalog = None
+
+
+def refresh_catalog():
+    """
+    Reload the catalog if another process has reseeded the tables, checking at most once every
+    CATALOG_CHECK_INTERVAL seconds so most requests don't touch the db for it
+    """
+    global _checked_at
+    if request.endpoint == 'static':
+        return
+    if _checked_at is not None and time.monotonic() - _checked_at < check_interval:
+        return
+
+    with _lock:
+        now = time.monotonic()
+        if _checked_at is not None and now - _checked_at < check_interval:
+            return
+        _checked_at = now
+        generation = stored_generation()
+        if _catalog is None or _catalog.generation != generation:
+            _load(generation)
+
+
+def init_catalog(app):
+    """
+    Load the catalog now, and have requests pick up a reseed by another process within
+    CATALOG_CHECK_INTERVAL seconds
+    """
+    global _checked_at
+    get_catalog()
+    _checked_at = time.monotonic()
+    app.before_request(refresh_catalog)
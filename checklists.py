@@ -0,0 +1,139 @@
+"""
+Module stores users' gobag, shelter and task checklists as bitmaps over catalog ids (one row per user
+and kit), alongside any custom items they have added
+"""
+
+from flask import current_app as app
+from sqlalchemy import delete, literal, null, select, union_all, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from catalog import get_catalog
+from dbmodels import Checklists, CustomInput
+from preppydb import db_session, upsert
+
+
+def to_bits(ids):
+    """
+    Integer bitset with a bit set for each catalog id
+    """
+    bits = 0
+    for catalog_id in ids:
+        bits |= 1 << catalog_id
+    return bits
+
+
+def pack(bits):
+    """
+    Encode an integer bitset as a little-endian bitmap for storage
+    """
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def unpack(bitmap):
+    """
+    Decode a stored bitmap back into an integer bitset
+    """
+    return int.from_bytes(bitmap or b'', 'little')
+
+
+def catalog_entries(kit):
+    """
+    Catalog entries a kit's checklist is drawn from, keyed by id and by uuid, and their name field
+    """
+    catalog = get_catalog()
+    if kit == 'task':
+        return catalog.tasks_by_id, catalog.tasks_by_uuid, 'task'
+    return catalog.supplies_by_id, catalog.supplies_by_uuid, 'item'
+
+
+def load_checklist(user_id, kit):
+    """
+    Return the user's chosen catalog and custom items for a kit, sorted by name, with whether each is done
+    """
+    by_id, _, name_field = catalog_entries(kit)
+
+    # The bitmap row and the custom items come back together in one round trip
+    query = union_all(
+        select(literal(False).label('custom'), Checklists.selected, Checklists.done.label('bitmap'),
+               null().label('name'), null().label('uuid'), null().label('done')).where(
+            (Checklists.user_id == user_id) & (Checklists.kit == kit)),
+        select(literal(True), null(), null(), CustomInput.name, CustomInput.uuid, CustomInput.done).where(
+            (CustomInput.user_id == user_id) & (CustomInput.type == kit)))
+
+    items = []
+    for row in db_session.execute(query):
+        if row.custom:
+            items.append({'name': row.name, 'uuid': row.uuid, 'done': bool(row.done)})
+            continue
+        selected, done = unpack(row.selected), unpack(row.bitmap)
+        for catalog_id in range(selected.bit_length()):
+            if selected >> catalog_id & 1 and catalog_id in by_id:
+                entry = by_id[catalog_id]
+                items.append({'name': getattr(entry, name_field), 'uuid': entry.uuid,
+                              'done': bool(done >> catalog_id & 1)})
+    return sorted(items, key=lambda item: item['name'])
+
+
+def replace_selections(kit, user_id, ids, errors):
+    """
+    Replace the catalog items chosen for a user's kit, clearing its progress and custom items, in one transaction
+    """
+    try:
+        stmt = upsert(Checklists).values(user_id=user_id, kit=kit, selected=pack(to_bits(ids)), done=b'')
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'kit'], set_={'selected': stmt.excluded.selected, 'done': b''})
+        db_session.execute(stmt)
+        db_session.execute(delete(CustomInput).where(
+            (CustomInput.user_id == user_id) & (CustomInput.type == kit)))
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        app.logger.error("Database error: %s", e)
+        errors.append("Error saving selections.")
+    return errors
+
+
+def sync_progress(kit, user_id, uuids, errors):
+    """
+    Record exactly the given catalog and custom items as done for the user's kit, in one transaction
+    """
+    _, by_uuid, _ = catalog_entries(kit)
+    done = to_bits(by_uuid[item].id for item in uuids if item in by_uuid)
+    custom_uuids = [item for item in uuids if item not in by_uuid]
+
+    try:
+        stmt = upsert(Checklists).values(user_id=user_id, kit=kit, selected=b'', done=pack(done))
+        stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'kit'], set_={'done': stmt.excluded.done})
+        db_session.execute(stmt)
+        db_session.execute(update(CustomInput).where(
+            (CustomInput.user_id == user_id) & (CustomInput.type == kit)
+        ).values({'done': CustomInput.uuid.in_(custom_uuids)}))
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        app.logger.error("Database error: %s", e)
+        errors.append("Error updating checklist.")
+    return errors
+
+
+def remove_item(kit, user_id, item_uuid, errors):
+    """
+    Remove a catalog or custom item from the user's checklist for a kit
+    """
+    _, by_uuid, _ = catalog_entries(kit)
+
+    try:
+        db_session.query(CustomInput).filter_by(user_id=user_id, uuid=item_uuid).delete()
+
+        if item_uuid in by_uuid:
+            row = db_session.query(Checklists).filter_by(user_id=user_id, kit=kit).first()
+            if row:
+                keep = ~(1 << by_uuid[item_uuid].id)
+                row.selected = pack(unpack(row.selected) & keep)
+                row.done = pack(unpack(row.done) & keep)
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        app.logger.error("Database error: %s", e)
+        errors.append("Error deleting item.")
+    return errors
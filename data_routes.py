@@ -2,43 +2,59 @@
 Module handles routes related to contacts, secure files, and meetup locations saved by user
 """
 
+import math
+import mimetypes
 import os
+import secrets
+import time
 import uuid
 
-from io import BytesIO
-
-from cryptography.fernet import Fernet, InvalidToken
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from flask import Blueprint, flash, g, redirect, render_template, request, session, jsonify, send_file, url_for
+from flask import (Blueprint, Response, flash, g, redirect, render_template, request, session, jsonify, send_file,
+                   stream_with_context, url_for)
 from flask import current_app as app
+from sqlalchemy import delete, insert, literal, select, tuple_
 from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import ClientDisconnected, RequestedRangeNotSatisfiable
 
-from dbmodels import Contacts, Coordinates, SecFileMetadata
+from archives import stream_zip
+from dbmodels import Contacts, Coordinates, SecFileMetadata, UploadSessions
+from fragments import cached_render
 from helpers import apology, login_required
-from preppydb import db_session
+from preppydb import begin_for_savepoints, db_session, upsert
+from revisions import revalidated
+from securefiles import CHUNK_SIZE, DecryptionError, PartialContainer, content_digest, encrypt_stream, open_decrypted
+from storage import HOT, Discard, atomic_write, locate, recall, remove_file, rename_file, stored_path
+from utils import MICRODEGREES, cells_within, distance_km, grid_cell, parse_degrees, to_microdegrees
 
 data_routes = Blueprint('data_routes', __name__)
 
 load_dotenv('global.env')
 
-# Configure encryption key
-KEYFILE = 'keyfile'
-
-if not os.path.exists(KEYFILE):
-    key = Fernet.generate_key()
-    with open(KEYFILE, 'wb') as f:
-        f.write(key)
-else:
-    with open(KEYFILE, 'rb') as f:
-        key = f.read()
-cipher_suite = Fernet(key)
-
 # Import Google API key
 api_key = os.getenv('GOOGLE_API_KEY')
 
+# Resumable uploads untouched for this long are abandoned, and removed a batch at a time
+UPLOAD_SESSION_LIFETIME = int(os.getenv('UPLOAD_SESSION_LIFETIME', '86400'))
+UPLOAD_SWEEP_BATCH = 50
+
+# Files of a batch upload are encrypted on a pool of this many threads per worker process. Hashing, zlib,
+# AES-GCM and file writes all release the GIL, so the files are processed in parallel.
+UPLOAD_THREADS = int(os.getenv('UPLOAD_THREADS', '4'))
+MAX_BATCH_FILES = 50
+
+upload_pool = None
+
+# A file's last access time is only rewritten once it is this many seconds old, so the range requests of
+# one download don't each write to the db
+ACCESS_RESOLUTION = 3600
+
 
 @data_routes.route('/contacts', methods=['GET'])
 @login_required
+@revalidated
+@cached_render('contacts.html')
 def contacts():
     """
     Retrieves db information about user's stored emergency contacts and sends to front end
@@ -57,7 +73,7 @@ def contacts():
         return apology("Error retrieving contacts.")
 
     url = f'https://maps.googleapis.com/maps/api/js?key={api_key}&libraries=places'
-    return render_template('contacts.html', last_name=last_name, results=results, url=url, api_key=api_key, nonce=g.nonce)
+    return {'last_name': last_name, 'results': results, 'url': url, 'api_key': api_key}
 
 
 @data_routes.route('/new_contact', methods=['POST'])
@@ -150,15 +166,33 @@ def evacuation():
         return redirect(url_for('userinfo_routes.family'))
     last_name = session['last_name']
     try:
-        pins = db_session.query(Coordinates.latitude, Coordinates.longitude,
+        rows = db_session.query(Coordinates.latitude_e6, Coordinates.longitude_e6,
                                 Coordinates.title).filter_by(user_id=session['user_id']).all()
-        pins = [pin._asdict() for pin in pins]
+        pins = [pin_dict(row) for row in rows]
     except SQLAlchemyError as e:
         app.logger.error(f"Database error: {e}")
         return apology("Error loading saved pin data.")
     return render_template('evacuation.html', api_key=api_key, pins=pins, last_name=last_name, nonce=g.nonce)
 
 
+def parse_pins(data):
+    """
+    Check submitted pins, each [latitude, longitude] or [latitude, longitude, title], and key them on
+    their fixed-point coordinates, last title wins. Raises ValueError for anything else.
+    """
+    if not isinstance(data, list):
+        raise ValueError("Pins must be a list.")
+    pins = {}
+    for pin in data:
+        if not isinstance(pin, list) or len(pin) not in (2, 3):
+            raise ValueError(f"Not a pin: {pin!r}")
+        title = pin[2] if len(pin) == 3 else ""
+        if not isinstance(title, str):
+            raise ValueError(f"Not a pin title: {title!r}")
+        pins[(to_microdegrees(parse_degrees(pin[0], 90)), to_microdegrees(parse_degrees(pin[1], 180)))] = title
+    return pins
+
+
 @data_routes.route('/save_coords', methods=["POST"])
 @login_required
 def save_coords():
@@ -166,80 +200,71 @@ def save_coords():
     Updates coordinates for locations saved by user in db
     """
 
-    errors = []
+    try:
+        pins = parse_pins(request.get_json(silent=True))
+    except (TypeError, ValueError) as e:
+        app.logger.error(f"Invalid pin data: {e}")
+        return jsonify({"error": "Invalid coordinates."}), 400
 
-    pins = request.json
+    # Reconcile stored pins with the submitted set in one transaction
+    user_id = session['user_id']
     try:
-        dbpins = db_session.query(Coordinates.latitude, Coordinates.longitude,
-                                  Coordinates.title).filter_by(user_id=session['user_id']).all()
-        pin_tuples = {(pin[0], pin[1]) for pin in pins}
+        stale = delete(Coordinates).where(Coordinates.user_id == user_id)
+        if pins:
+            stale = stale.where(tuple_(Coordinates.latitude_e6, Coordinates.longitude_e6).not_in(list(pins)))
+        db_session.execute(stale)
+
+        if pins:
+            stmt = upsert(Coordinates).values([
+                {'user_id': user_id, 'latitude_e6': latitude_e6, 'longitude_e6': longitude_e6,
+                 'cell': grid_cell(latitude_e6, longitude_e6), 'title': title}
+                for (latitude_e6, longitude_e6), title in pins.items()])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['user_id', 'latitude_e6', 'longitude_e6'], set_={'title': stmt.excluded.title})
+            db_session.execute(stmt)
+
+        db_session.commit()
     except SQLAlchemyError as e:
+        db_session.rollback()
         app.logger.error(f"Database error: {e}")
         flash("Error saving coordinates.")
         return redirect(url_for('data_routes.evacuation'))
 
-    # Delete any pins that don't exist in most recent coordinates sent by user
-    for row in dbpins:
-        database_tuple = (row.latitude, row.longitude)
-        if database_tuple not in pin_tuples:
-            try:
-                db_session.query(Coordinates).filter_by(
-                    user_id=session['user_id'], latitude=row.latitude, longitude=row.longitude).delete()
-                db_session.commit()
-            except SQLAlchemyError as e:
-                db_session.rollback()
-                app.logger.error(f"Database error: {e}")
-                errors.append("Error deleting pins.")
-                break
+    return jsonify({"success": True})
 
-    # Extract latitude and longitude
-    for pin in pins:
-        latitude = pin[0]
-        longitude = pin[1]
-        title = pin[2] if len(pin) == 3 else ""
 
-        # Check for each pin's coordinates in database
-        try:
-            result = db_session.query(Coordinates).filter_by(
-                user_id=session['user_id'], latitude=latitude, longitude=longitude).first()
-        except SQLAlchemyError as e:
-            app.logger.error(f"Database error: {e}")
-            errors.append("Error retrieving coordinates from database.")
-            break
+@data_routes.route('/nearby_pins', methods=["GET"])
+@login_required
+def nearby_pins():
+    """
+    Sends user's saved meetup locations within a radius (in km) of a point to the front end
+    """
 
-        # If not present, insert new row
-        if not result:
-            try:
-                new_coord = Coordinates(
-                    user_id=session['user_id'],
-                    latitude=latitude,
-                    longitude=longitude,
-                    title=title
-                )
-                db_session.add(new_coord)
-                db_session.commit()
-            except SQLAlchemyError as e:
-                db_session.rollback()
-                app.logger.error(f"Database error: {e}")
-                errors.append("Error adding coordinates.")
-                break
-
-        # If the pin's title has changed, update
-        if result:
-            if result.title != title:
-                try:
-                    db_session.query(Coordinates).filter_by(
-                        user_id=session['user_id'], latitude=latitude, longitude=longitude).update({'title': title})
-                    db_session.commit()
-                except SQLAlchemyError as e:
-                    db_session.rollback()
-                    app.logger.error(f"Database error: {e}")
-                    errors.append("Error updating title.")
+    try:
+        latitude = parse_degrees(request.args['latitude'], 90)
+        longitude = parse_degrees(request.args['longitude'], 180)
+        radius = float(request.args.get('radius', 10))
+        if not math.isfinite(radius) or radius < 0:
+            raise ValueError(f"Invalid radius: {radius}")
+    except (KeyError, ValueError) as e:
+        app.logger.error(f"Invalid search: {e}")
+        return jsonify({"error": "Please provide a valid latitude, longitude and radius."}), 400
+
+    # Narrow to the grid cells around the point, then filter on exact distance
+    try:
+        query = db_session.query(Coordinates.latitude_e6, Coordinates.longitude_e6,
+                                 Coordinates.title).filter_by(user_id=session['user_id'])
+        cells = cells_within(latitude, longitude, radius)
+        if cells is not None:
+            query = query.filter(Coordinates.cell.in_(cells))
+        rows = query.all()
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error: {e}")
+        return jsonify({"error": "Error loading saved pin data."}), 500
 
-    if errors:
-        flash(" ".join(errors))
-        return redirect(url_for('data_routes.evacuation'))
-    return jsonify({"success": True})
+    pins = [pin for pin in map(pin_dict, rows)
+            if distance_km(latitude, longitude, pin['latitude'], pin['longitude']) <= radius]
+    return jsonify(pins)
 
 
 @data_routes.route('/uploads', methods=["GET"])
@@ -256,13 +281,63 @@ def uploads():
     last_name = session['last_name']
 
     try:
-        results = db_session.query(SecFileMetadata.filename).filter_by(user_id=session['user_id'])
+        results = db_session.query(SecFileMetadata.filename, SecFileMetadata.size, SecFileMetadata.mimetype).filter_by(
+            user_id=session['user_id']).all()
     except SQLAlchemyError as e:
         app.logger.error(f"Database error: {e}")
         return apology("Error accessing uploads information.")
     return render_template('uploads.html', results=results, last_name=last_name, nonce=g.nonce)
 
 
+def record_file(user_id, file_name, secure_filename, **details):
+    """
+    Point the user's file name at a newly stored file, recording details of its contents (digest, size
+    and mimetype), without committing. Returns the stored file it replaces, if any, to be removed once
+    the change is committed.
+    """
+    values = {'secure_filename': secure_filename, 'last_access': int(time.time()), 'tier': HOT, **details}
+    recorded = db_session.query(SecFileMetadata).filter_by(user_id=user_id, filename=file_name)
+
+    # Each write only applies if the row is still as it was read, so of two uploads of the same name at
+    # once, the second to commit sees the first's file as the one it replaces, rather than leaving it
+    # stored with no row pointing at it
+    while True:
+        old_secfilename = recorded.with_entities(SecFileMetadata.secure_filename).scalar()
+        if old_secfilename is None:
+            missing = ~recorded.exists()
+            added = db_session.execute(insert(SecFileMetadata).from_select(
+                ['user_id', 'filename', *values],
+                select(literal(user_id), literal(file_name), *map(literal, values.values())).where(missing))).rowcount
+            if added:
+                return None
+        elif recorded.filter(SecFileMetadata.secure_filename == old_secfilename).update(values):
+            return old_secfilename
+
+
+def is_unchanged(user_id, file_name, digest, size):
+    """
+    Whether the user's file of this name already has exactly these contents, and they are in storage
+    """
+    stored = db_session.query(SecFileMetadata.digest, SecFileMetadata.size, SecFileMetadata.secure_filename,
+                              SecFileMetadata.tier).filter_by(user_id=user_id, filename=file_name).first()
+    return (stored is not None and stored.digest == digest and stored.size == size
+            and locate(app, stored.secure_filename, stored.tier)[0] is not None)
+
+
+def guess_mimetype(file_name, sent=None):
+    """
+    MIME type of a file, from its name, or else the type the browser sent with it
+    """
+    return mimetypes.guess_type(file_name)[0] or sent or 'application/octet-stream'
+
+
+def remove_stored(secure_filename):
+    """
+    Remove a stored file that is no longer recorded, from whichever storage tier holds it
+    """
+    remove_file(app, secure_filename)
+
+
 @data_routes.route('/new_upload', methods=["POST"])
 @login_required
 def new_upload():
@@ -283,103 +358,257 @@ def new_upload():
 
     if file:
         file_name = file.filename
-        file_data = file.read()
-        encrypted_data = cipher_suite.encrypt(file_data)
+
+        # Encrypt while reading the upload, a chunk at a time, so memory use doesn't grow with the file,
+        # hashing it on the way. The file only appears under its name once it is complete and synced to
+        # disk, and a re-upload of an unchanged file is dropped before then rather than stored again.
         secure_filename = str(uuid.uuid4()) + ".enc"
+        unchanged = False
         try:
-            row = db_session.query(SecFileMetadata.secure_filename).filter_by(
-                user_id=session['user_id'], filename=file_name).first()
+            with atomic_write(stored_path(app, secure_filename)) as dest:
+                digest, size = encrypt_stream(file.stream, dest)
+                unchanged = is_unchanged(session['user_id'], file_name, digest, size)
+                if unchanged:
+                    raise Discard
+        except OSError as e:
+            app.logger.error(f"File error: {e}")
+            flash("Error storing file.")
+            return redirect(url_for('data_routes.uploads'))
         except SQLAlchemyError as e:
             app.logger.error(f"Database error: {e}")
-            errors.append("Error accessing file data.")
-
-        if row:
-            old_secfilename = row.secure_filename
-            try:
-                db_session.query(SecFileMetadata).filter_by(
-                    user_id=session['user_id'], filename=file_name).update({'secure_filename': secure_filename})
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], old_secfilename))
-                db_session.commit()
-            except SQLAlchemyError as e:
-                db_session.rollback()
-                app.logger.error(f"Database error: {e}")
-                errors.append("Error updating file data.")
-        else:
-            try:
-                new_file = SecFileMetadata(
-                    user_id=session['user_id'], filename=file_name, secure_filename=secure_filename)
-                db_session.add(new_file)
-                db_session.commit()
-            except SQLAlchemyError as e:
-                db_session.rollback()
-                errors.append("Database error: " + str(e))
-
-        if errors:
-            flash(" ".join(errors))
+            flash("Error accessing file data.")
+            return redirect(url_for('data_routes.uploads'))
+        if unchanged:
             return redirect(url_for('data_routes.uploads'))
 
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename)
-
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        with open(os.path.join(app.config['UPLOAD_FOLDER'], secure_filename), 'wb') as file:
-            file.write(encrypted_data)
+        try:
+            old_secfilename = record_file(session['user_id'], file_name, secure_filename, digest=digest,
+                                          size=size, mimetype=guess_mimetype(file_name, file.mimetype))
+            db_session.commit()
+        except SQLAlchemyError as e:
+            db_session.rollback()
+            app.logger.error(f"Database error: {e}")
+            remove_stored(secure_filename)
+            flash("Error updating file data.")
             return redirect(url_for('data_routes.uploads'))
 
+        # The new version is stored and recorded, so the one it replaces can go
+        if old_secfilename:
+            remove_stored(old_secfilename)
+        return redirect(url_for('data_routes.uploads'))
+
     errors.append("No such file")
     flash(" ".join(errors))
     return redirect(url_for('data_routes.uploads'))
 
 
-@data_routes.route('/download', methods=["POST"])
+def get_upload_pool():
+    """
+    The worker's upload thread pool, started on first use so that processes forked from a preloading
+    server each start their own threads
+    """
+    global upload_pool
+    if upload_pool is None:
+        upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_THREADS, thread_name_prefix='upload')
+    return upload_pool
+
+
+def encrypt_upload(stream, path, stored):
+    """
+    Encrypt one spooled upload to path, unless it turns out to match the stored (digest, size).
+    Returns its digest, its size and whether it was written. Runs on the upload pool.
+    """
+    with atomic_write(path) as dest:
+        digest, size = encrypt_stream(stream, dest)
+        unchanged = stored == (digest, size)
+        if unchanged:
+            raise Discard
+    return digest, size, not unchanged
+
+
+@data_routes.route('/new_uploads', methods=["POST"])
+@login_required
+def new_uploads():
+    """
+    Stores a batch of uploaded files, encrypting them in parallel on the upload pool, and records them
+    all in one transaction. Reports what happened to each file.
+    """
+
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({"error": "No selected files."}), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({"error": f"Please upload at most {MAX_BATCH_FILES} files at a time."}), 400
+
+    try:
+        stored = {row.filename: (row.digest, row.size) for row in db_session.query(
+            SecFileMetadata.filename, SecFileMetadata.digest, SecFileMetadata.size).filter(
+            SecFileMetadata.user_id == session['user_id'], SecFileMetadata.filename.in_({f.filename for f in files}))}
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error: {e}")
+        return jsonify({"error": "Error accessing file data."}), 500
+
+    pool = get_upload_pool()
+    jobs = []
+    for file in files:
+        secure_filename = str(uuid.uuid4()) + ".enc"
+        job = pool.submit(encrypt_upload, file.stream, stored_path(app, secure_filename), stored.get(file.filename))
+        jobs.append((file, secure_filename, job))
+
+    # Whatever goes wrong with one file (its stream, its encryption, its record) fails only that file,
+    # and removes what was stored for it
+    results = []
+    written = []
+    for file, secure_filename, job in jobs:
+        result = {"filename": file.filename}
+        results.append(result)
+        try:
+            digest, size, stored_now = job.result()
+        except (OSError, DecryptionError, ClientDisconnected) as e:
+            app.logger.error(f"File error: {e}")
+            remove_stored(secure_filename)
+            result.update(status="error", error="Error storing file.")
+            continue
+        result.update(size=size, status="stored" if stored_now else "unchanged")
+        if stored_now:
+            details = dict(digest=digest, size=size, mimetype=guess_mimetype(file.filename, file.mimetype))
+            written.append((file, secure_filename, details, result))
+
+    # Each record is written under its own savepoint, so one that fails is rolled back alone and the
+    # others are still committed together
+    replaced = []
+    recorded = []
+    try:
+        begin_for_savepoints(db_session)
+        for file, secure_filename, details, result in written:
+            try:
+                with db_session.begin_nested():
+                    old_secfilename = record_file(session['user_id'], file.filename, secure_filename, **details)
+            except SQLAlchemyError as e:
+                app.logger.error(f"Database error: {e}")
+                remove_stored(secure_filename)
+                result.update(status="error", error="Error updating file data.")
+                continue
+            replaced.append(old_secfilename)
+            recorded.append((secure_filename, result))
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        app.logger.error(f"Database error: {e}")
+        for secure_filename, result in recorded:
+            remove_stored(secure_filename)
+            result.update(status="error", error="Error updating file data.")
+        return jsonify({"files": results}), 500
+
+    # The new versions are stored and recorded, so the ones they replace can go
+    for old_secfilename in replaced:
+        if old_secfilename:
+            remove_stored(old_secfilename)
+    return jsonify({"files": results}), 201 if recorded else 200
+
+
+@data_routes.route('/download', methods=["GET", "POST"])
 @login_required
 def download():
     """
-    Decrypts encrypted file on server and sends unencrypted file to user
+    Decrypts encrypted file on server and sends unencrypted file to user. GET requests may ask for byte
+    ranges, to resume an interrupted download or preview part of a large file.
     """
 
-    if not request.form.get('filename'):
+    if not request.values.get('filename'):
         flash("Please enter a valid filename")
         return redirect(url_for('data_routes.uploads'))
-    file_name = request.form.get('filename')
+    file_name = request.values.get('filename')
 
     try:
-        row = db_session.query(SecFileMetadata.secure_filename).filter_by(
-            user_id=session['user_id'], filename=file_name).first()
+        row = db_session.query(SecFileMetadata).filter_by(user_id=session['user_id'], filename=file_name).first()
+        now = int(time.time())
+        if row and now - row.last_access >= ACCESS_RESOLUTION:
+            row.last_access = now
+            db_session.commit()
     except SQLAlchemyError as e:
+        db_session.rollback()
         app.logger.error("Database error: %s", e)
         flash("Error accessing file.")
+        return redirect(url_for('data_routes.uploads'))
 
     if row:
         secure_filename = row.secure_filename
         try:
-            with open(os.path.join(app.config['UPLOAD_FOLDER'], secure_filename), 'rb') as file:
-                encrypted_data = file.read()
-                try:
-                    decrypted_data = cipher_suite.decrypt(encrypted_data)
-                except InvalidToken as e:
-                    app.logger.error(f"Decryption error: {e}")
-                    flash("Decryption error.")
-                    return redirect(url_for('data_routes.uploads'))
-        except (FileNotFoundError, PermissionError) as e:
+            # A file moved to cold storage for going unread is moved back before it is served
+            decrypted = open_decrypted(recall(app, secure_filename, row.tier))
+        except DecryptionError as e:
+            app.logger.error(f"Decryption error: {e}")
+            flash("Decryption error.")
+            return redirect(url_for('data_routes.uploads'))
+        except (OSError, SQLAlchemyError) as e:
             app.logger.error(f"File error: {e}")
             flash("File error.")
             return redirect(url_for('data_routes.uploads'))
 
-        stream = BytesIO(decrypted_data)
-        stream.seek(0)
-
+        # Decrypted a chunk at a time as the response is sent, and closed with it. A Range request only
+        # decrypts the chunks covering the range, and If-Range resumes only while the ETag still matches.
+        response = send_file(decrypted, mimetype=None, as_attachment=True, download_name=file_name,
+                             conditional=False, etag=decrypted.etag)
+        response.content_length = decrypted.size
+        response.accept_ranges = 'bytes'
         try:
-            return send_file(stream, mimetype=None, as_attachment=True, download_name=file_name, conditional=False)
-        except (FileNotFoundError, PermissionError) as e:
-            app.logger.error(f"File error: {e}")
-            flash("Error sending file.")
-            return redirect(url_for('data_routes.uploads'))
+            response.make_conditional(request, accept_ranges=True, complete_length=decrypted.size)
+        except RequestedRangeNotSatisfiable:
+            decrypted.close()
+            raise
+        return response
     else:
         flash("File not found.")
         return redirect(url_for('data_routes.uploads'))
 
 
+@data_routes.route('/download_all', methods=["GET"])
+@login_required
+def download_all():
+    """
+    Sends all of the user's stored files in one ZIP archive, built while it is sent: each file is
+    decrypted a chunk at a time straight into the archive, so memory use doesn't grow with the number or
+    size of the files
+    """
+
+    try:
+        rows = db_session.query(SecFileMetadata.filename, SecFileMetadata.secure_filename, SecFileMetadata.tier).filter_by(
+            user_id=session['user_id']).order_by(SecFileMetadata.filename).all()
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error: {e}")
+        flash("Error accessing files.")
+        return redirect(url_for('data_routes.uploads'))
+    if not rows:
+        flash("No files to download.")
+        return redirect(url_for('data_routes.uploads'))
+
+    def opener(row):
+        # Cold files are read where they are, rather than all moved back for one archive
+        def open_file():
+            path, _ = locate(app, row.secure_filename, row.tier)
+            if path is None:
+                raise FileNotFoundError(row.secure_filename)
+            return open_decrypted(path)
+        return open_file
+
+    def on_error(file_name, e):
+        app.logger.error(f"Error adding {file_name} to archive: {e}")
+
+    def generate():
+        try:
+            yield from stream_zip(((row.filename, opener(row)) for row in rows), CHUNK_SIZE, on_error)
+        except DecryptionError as e:
+            # Too late to tell the user, so the archive is cut short and the download fails
+            app.logger.error(f"Decryption error: {e}")
+            raise
+
+    archive_name = f"{session.get('last_name', 'Preppy')} Secure Documents.zip"
+    response = Response(stream_with_context(generate()), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=archive_name)
+    return response
+
+
 @data_routes.route('/delete_file', methods=["POST"])
 @login_required
 def delete_file():
@@ -399,20 +628,229 @@ def delete_file():
         flash("Error finding file.")
         return redirect(url_for('data_routes.uploads'))
 
+    # The row goes first, so a failed commit leaves the file still stored and listed. Only the version
+    # that was read is deleted, in case a re-upload has replaced it since.
     if row:
-        secure_filename = row.secure_filename
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
         try:
-            db_session.query(SecFileMetadata).filter_by(
-                user_id=session['user_id'], filename=file_name).delete()
+            deleted = db_session.query(SecFileMetadata).filter_by(
+                user_id=session['user_id'], filename=file_name, secure_filename=row.secure_filename).delete()
             db_session.commit()
         except SQLAlchemyError as e:
             db_session.rollback()
             app.logger.error(f"Database error: {e}")
             flash("Error deleting file.")
+            return redirect(url_for('data_routes.uploads'))
+        if deleted:
+            remove_stored(row.secure_filename)
         return redirect(url_for('data_routes.uploads'))
 
     flash("File not found.")
     return redirect(url_for('data_routes.uploads'))
+
+
+def partial_upload(upload_id):
+    """
+    The partly uploaded container for a resumable upload, kept on the same filesystem as finished files
+    so that storing it once finished is a rename
+    """
+    return PartialContainer(os.path.join(app.config['UPLOAD_FOLDER'], 'partial', upload_id + '.enc'))
+
+
+def find_upload(upload_id):
+    """
+    The signed-in user's unexpired resumable upload with the given id, or None
+    """
+    return db_session.query(UploadSessions).filter(
+        UploadSessions.id == upload_id, UploadSessions.user_id == session['user_id'],
+        UploadSessions.expiry > int(time.time())).first()
+
+
+def sweep_uploads(now):
+    """
+    Remove one batch of abandoned uploads, their rows and their partial files
+    """
+    expired = [row.id for row in db_session.query(UploadSessions.id).filter(
+        UploadSessions.expiry <= now).limit(UPLOAD_SWEEP_BATCH)]
+    if not expired:
+        return
+    db_session.execute(delete(UploadSessions).where(UploadSessions.id.in_(expired)))
+    db_session.commit()
+    for upload_id in expired:
+        partial_upload(upload_id).remove()
+
+
+@data_routes.route('/resumable_uploads', methods=["POST"])
+@login_required
+def create_upload():
+    """
+    Starts a resumable upload of the named file. The client then sends its bytes in order with PATCH,
+    asks for the saved offset after a dropped connection, and finishes the upload with finalize.
+    """
+
+    file_name = (request.get_json(silent=True) or {}).get('filename')
+    if not file_name:
+        return jsonify({"error": "Please provide a filename."}), 400
+
+    now = int(time.time())
+    upload_id = secrets.token_urlsafe(16)
+    partial = partial_upload(upload_id)
+    try:
+        sweep_uploads(now)
+        os.makedirs(os.path.dirname(partial.path), exist_ok=True)
+        partial.create()
+        db_session.add(UploadSessions(id=upload_id, user_id=session['user_id'], filename=file_name,
+                                      expiry=now + UPLOAD_SESSION_LIFETIME))
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        partial.remove()
+        app.logger.error(f"Database error: {e}")
+        return jsonify({"error": "Error starting upload."}), 500
+    except OSError as e:
+        partial.remove()
+        app.logger.error(f"File error: {e}")
+        return jsonify({"error": "Error starting upload."}), 500
+
+    return jsonify({"id": upload_id, "offset": 0, "chunk_size": CHUNK_SIZE}), 201
+
+
+@data_routes.route('/resumable_uploads/<upload_id>', methods=["GET", "PATCH", "DELETE"])
+@login_required
+def resumable_upload(upload_id):
+    """
+    GET reports how many bytes of the upload are saved. PATCH appends the request body, which must start
+    at the saved offset given in the Upload-Offset header. DELETE abandons the upload.
+    """
+
+    try:
+        upload = find_upload(upload_id)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error: {e}")
+        return jsonify({"error": "Error accessing upload."}), 500
+    if not upload:
+        return jsonify({"error": "No such upload."}), 404
+    partial = partial_upload(upload_id)
+
+    if request.method == 'DELETE':
+        try:
+            db_session.delete(upload)
+            db_session.commit()
+        except SQLAlchemyError as e:
+            db_session.rollback()
+            app.logger.error(f"Database error: {e}")
+            return jsonify({"error": "Error cancelling upload."}), 500
+        partial.remove()
+        return jsonify({"success": True})
+
+    # Only one request at a time may write an upload, so a retry can't interleave with its original
+    try:
+        f = partial.lock()
+    except BlockingIOError:
+        return jsonify({"error": "Upload is busy, try again."}), 409
+    except FileNotFoundError:
+        return jsonify({"error": "No such upload."}), 404
+
+    with f:
+        try:
+            offset = partial.offset(f)
+            if request.method == 'GET':
+                return jsonify({"offset": offset, "chunk_size": CHUNK_SIZE})
+
+            if request.headers.get('Upload-Offset', type=int) != offset:
+                return jsonify({"error": "Upload-Offset doesn't match the saved offset.", "offset": offset}), 409
+
+            # Encrypt the body as it is read, a chunk at a time; bytes that arrive before a dropped
+            # connection are kept, so the client resumes from the offset it then reads back
+            try:
+                offset = partial.append(f, request.stream)
+            except ClientDisconnected:
+                return jsonify({"error": "Upload interrupted."}), 400
+        except (DecryptionError, OSError) as e:
+            app.logger.error(f"File error: {e}")
+            return jsonify({"error": "Error storing upload."}), 500
+
+    try:
+        upload.expiry = int(time.time()) + UPLOAD_SESSION_LIFETIME
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        app.logger.error(f"Database error: {e}")
+    return jsonify({"offset": offset})
+
+
+@data_routes.route('/resumable_uploads/<upload_id>/finalize', methods=["POST"])
+@login_required
+def finalize_upload(upload_id):
+    """
+    Seals the rest of a resumable upload, records it under its file name and renames it into place,
+    then ends the upload
+    """
+
+    try:
+        upload = find_upload(upload_id)
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error: {e}")
+        return jsonify({"error": "Error accessing upload."}), 500
+    if not upload:
+        return jsonify({"error": "No such upload."}), 404
+    partial = partial_upload(upload_id)
+
+    try:
+        f = partial.lock()
+    except BlockingIOError:
+        return jsonify({"error": "Upload is busy, try again."}), 409
+    except FileNotFoundError:
+        return jsonify({"error": "No such upload."}), 404
+
+    # Its bytes arrived over several requests, so the finished container is read back to hash them. An
+    # unchanged file is dropped rather than replacing the copy already stored. Otherwise the row naming
+    # its stored file is committed first and the container renamed into place after, while the upload
+    # and its tail are kept until then, so an upload whose commit or rename fails is finished again.
+    secure_filename = str(uuid.uuid4()) + ".enc"
+    with f:
+        try:
+            partial.finish(f)
+            with open_decrypted(partial.path) as decrypted:
+                digest, size = content_digest(decrypted)
+            unchanged = is_unchanged(session['user_id'], upload.filename, digest, size)
+            if not unchanged:
+                old_secfilename = record_file(session['user_id'], upload.filename, secure_filename, digest=digest,
+                                              size=size, mimetype=guess_mimetype(upload.filename))
+                db_session.commit()
+                rename_file(partial.path, stored_path(app, secure_filename))
+        except (DecryptionError, OSError) as e:
+            app.logger.error(f"File error: {e}")
+            return jsonify({"error": "Error storing upload."}), 500
+        except SQLAlchemyError as e:
+            db_session.rollback()
+            app.logger.error(f"Database error: {e}")
+            return jsonify({"error": "Error updating file data."}), 500
+
+    # The file is stored and recorded, so the upload can end. Should that fail, the upload is left to
+    # expire and be swept.
+    try:
+        db_session.delete(upload)
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        app.logger.error(f"Database error: {e}")
+        if unchanged:
+            return jsonify({"error": "Error updating file data."}), 500
+    partial.remove()
+
+    if unchanged:
+        return jsonify({"filename": upload.filename, "size": size, "unchanged": True}), 200
+    if old_secfilename:
+        remove_stored(old_secfilename)
+    return jsonify({"filename": upload.filename, "size": size, "unchanged": False}), 201
+
+
+def pin_dict(row):
+    """
+    Convert a stored pin row to the degree-based dict used by the map
+    """
+    return {
+        'latitude': row.latitude_e6 / MICRODEGREES,
+        'longitude': row.longitude_e6 / MICRODEGREES,
+        'title': row.title
+    }
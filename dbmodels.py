@@ -2,15 +2,10 @@
 SQLAlchemy table model definitions
 """
 
-import os
-
-from dotenv import load_dotenv
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String, Text, create_engine
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Text
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.sql import func
 
-load_dotenv()
-
 Base = declarative_base()
 
 
@@ -19,16 +14,43 @@ class Calendar(Base):
     Table to store household member names input by users for use in the routine schedule
     """
     __tablename__ = 'calendar'
+    __table_args__ = (
+        Index('ix_calendar_user_id_name', 'user_id', 'name'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     name = Column(Text)
 
 
+class CatalogVersion(Base):
+    """
+    Table with one row naming the current seeding of the reference tables, so every process can tell when its cached catalog is stale
+    """
+    __tablename__ = 'catalog_version'
+    id = Column(Integer, primary_key=True, nullable=False)
+    generation = Column(Text, nullable=False)
+
+
+class Checklists(Base):
+    """
+    Table to store users' gobag, shelter and task checklists as bitmaps of chosen and completed catalog ids, one row per user and kit
+    """
+    __tablename__ = 'checklists'
+    __table_args__ = {'sqlite_with_rowid': False}
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
+    kit = Column(Text, primary_key=True, nullable=False)
+    selected = Column(LargeBinary, nullable=False, default=b'')
+    done = Column(LargeBinary, nullable=False, default=b'')
+
+
 class Contacts(Base):
     """
     Table to store user emergency contacts
     """
     __tablename__ = 'contacts'
+    __table_args__ = (
+        Index('ix_contacts_user_id', 'user_id'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     first_name = Column(Text)
@@ -40,33 +62,33 @@ class Contacts(Base):
 
 class Coordinates(Base):
     """
-    Table to store coordinates of user emergency meetup locations
+    Table to store coordinates of user emergency meetup locations, in integer microdegrees with a grid cell for area lookups
     """
     __tablename__ = 'coordinates'
+    __table_args__ = (
+        Index('ix_coordinates_user_id_cell', 'user_id', 'cell'),
+        {'sqlite_with_rowid': False},
+    )
     user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
-    latitude = Column(Float, primary_key=True, nullable=False)
-    longitude = Column(Float, primary_key=True, nullable=False)
+    latitude_e6 = Column(Integer, primary_key=True, nullable=False)
+    longitude_e6 = Column(Integer, primary_key=True, nullable=False)
+    cell = Column(Integer, nullable=False)
     title = Column(Text, default='')
 
 
 class CustomInput(Base):
     """
-    Table to store custom supplies and tasks input by users
+    Table to store custom supplies and tasks input by users, and whether users have checked them off
     """
     __tablename__ = 'custominput'
+    __table_args__ = (
+        Index('ix_custominput_user_id_type', 'user_id', 'type', 'name', 'uuid'),
+    )
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     type = Column(Text, nullable=False)
     name = Column(Text, nullable=False)
     uuid = Column(Text, primary_key=True, nullable=False)
-
-
-class CustomTasks(Base):
-    """
-    Table to store the ids of tasks that users want included in their to-do lists
-    """
-    __tablename__ = 'customtasks'
-    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
-    task_uuid = Column(Text, primary_key=True, nullable=False)
+    done = Column(Integer, default=0, nullable=False)
 
 
 class DisasterSupplies(Base):
@@ -93,6 +115,9 @@ class Events(Base):
     Table to store routine schedule events input by users
     """
     __tablename__ = 'events'
+    __table_args__ = (
+        Index('ix_events_person_id', 'person_id'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     person_id = Column(Integer, ForeignKey('calendar.id'), nullable=False)
     title = Column(Text, nullable=False)
@@ -109,6 +134,9 @@ class Families(Base):
     Table to store household makeup information, including whether anyone has special needs (a column for use in later development)
     """
     __tablename__ = 'families'
+    __table_args__ = (
+        Index('ix_families_user_id', 'user_id', unique=True),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     last_name = Column(Text, nullable=False)
@@ -120,20 +148,14 @@ class Families(Base):
     special_needs = Column(Text, default='No', nullable=False)
 
 
-class GoBags(Base):
-    """
-    Table to record what supplies users want for their gobags
-    """
-    __tablename__ = 'gobags'
-    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
-    supply_uuid = Column(Text, ForeignKey('supplies.uuid'), primary_key=True, nullable=False)
-
-
 class Medical(Base):
     """
     Table to store user household personal medical information
     """
     __tablename__ = 'medical'
+    __table_args__ = (
+        Index('ix_medical_user_id', 'user_id'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     first_name = Column(Text)
@@ -151,6 +173,9 @@ class Providers(Base):
     Table to store user medical provider info
     """
     __tablename__ = 'providers'
+    __table_args__ = (
+        Index('ix_providers_user_id', 'user_id'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     first_name = Column(Text)
@@ -160,44 +185,38 @@ class Providers(Base):
     address = Column(Text)
 
 
-class SavedSupplies(Base):
-    """
-    Table to store supplies users have already checked off, as well as whether they're included in a gobag or shelter-in-place kit
-    """
-    __tablename__ = 'savedsupplies'
-    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
-    supply_uuid = Column(Text, ForeignKey('supplies.uuid'), primary_key=True, nullable=False)
-    gobag = Column(Text, nullable=False, default='No')
-    shelter = Column(Text, nullable=False, default='No')
-
-
-class SavedTasks(Base):
-    """
-    Table to store tasks users have already checked off
-    """
-    __tablename__ = 'savedtasks'
-    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
-    task_uuid = Column(Text, ForeignKey('tasks.uuid'), primary_key=True, nullable=False)
-
-
 class SecFileMetadata(Base):
     """
     Table to store metadata for encrypted files uploaded by users
     """
     __tablename__ = 'secfilemetadata'
+    __table_args__ = (
+        Index('ix_secfilemetadata_user_id_filename', 'user_id', 'filename'),
+        Index('ix_secfilemetadata_tier_last_access', 'tier', 'last_access'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     filename = Column(Text, nullable=False)
     secure_filename = Column(Text, nullable=False)
+    last_access = Column(Integer, default=0, nullable=False)
+    tier = Column(Text, default='hot', nullable=False)
+    digest = Column(Text)
+    size = Column(Integer)
+    mimetype = Column(Text)
 
 
-class Shelters(Base):
+class Sessions(Base):
     """
-    Table to store information on what supplies users choose to include in their shelter-in-place kits
+    Table to store server-side browser sessions, keyed by the random id held in the session cookie
     """
-    __tablename__ = 'shelters'
-    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True, nullable=False)
-    supply_uuid = Column(Text, ForeignKey('supplies.uuid'), primary_key=True, nullable=False)
+    __tablename__ = 'sessions'
+    __table_args__ = (
+        Index('ix_sessions_expiry', 'expiry'),
+        {'sqlite_with_rowid': False},
+    )
+    id = Column(Text, primary_key=True, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    expiry = Column(Integer, nullable=False)
 
 
 class Sits(Base):
@@ -234,6 +253,9 @@ class Supplies(Base):
     Table with predefined supplies with info on age class as well as per-person amount (for later development) and whether for gobags or shelter-in-place
     """
     __tablename__ = 'supplies'
+    __table_args__ = (
+        Index('ix_supplies_item', 'item'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     uuid = Column(Text, unique=True, nullable=False)
     item = Column(Text, nullable=False)
@@ -251,6 +273,9 @@ class Tasks(Base):
     Table of predefined tasks associated with emergency prep. Column for task description included for further development
     """
     __tablename__ = 'tasks'
+    __table_args__ = (
+        Index('ix_tasks_task', 'task'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     uuid = Column(Text, unique=True)
     task = Column(Text, nullable=False)
@@ -262,12 +287,30 @@ class Tokens(Base):
     Table to store password reset tokens with timestamps and associated user ids
     """
     __tablename__ = 'tokens'
+    __table_args__ = (
+        Index('ix_tokens_user_id', 'user_id'),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     token = Column(Text, nullable=False, unique=True)
     timestamp = Column(DateTime, default=func.now, nullable=False)
 
 
+class UploadSessions(Base):
+    """
+    Table to store resumable uploads in progress, until they are finished or abandoned long enough to expire
+    """
+    __tablename__ = 'upload_sessions'
+    __table_args__ = (
+        Index('ix_upload_sessions_expiry', 'expiry'),
+        {'sqlite_with_rowid': False},
+    )
+    id = Column(Text, primary_key=True, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    filename = Column(Text, nullable=False)
+    expiry = Column(Integer, nullable=False)
+
+
 class Users(Base):
     """
     Table for all registered users, their ids and hashed passwords
@@ -276,8 +319,5 @@ class Users(Base):
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     username = Column(String(255), nullable=False, unique=True)
     hash = Column(String(128), nullable=False)
+    revision = Column(Integer, nullable=False, default=0, server_default='0')
 
-
-database_url = os.getenv("DATABASE_URL", "sqlite:///preppy.db")
-engine = create_engine(database_url)
-Base.metadata.create_all(engine)
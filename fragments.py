@@ -0,0 +1,313 @@
+"""
+Module caches rendered pages so repeat views skip their queries and Jinja rendering. Pages are rendered
+with placeholders for the per-request CSP nonce and CSRF token, which are filled in on the way out, and
+are keyed by user, data revision, reference data and template so any write makes the user's old renders
+unreachable.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app as app
+from flask import g, render_template, request, session
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+
+from catalog import get_catalog
+from revisions import build_id, current_revision
+from utils import private_directory
+
+# Stand-ins rendered unescaped into cached pages in place of per-request values. Autoescaping turns any
+# '<' in user data into '&lt;', so only the stand-ins themselves are found when they are filled in.
+NONCE_PLACEHOLDER = Markup('<preppy:nonce>')
+CSRF_PLACEHOLDER = Markup('<preppy:csrf>')
+
+FRAGMENT_BACKENDS = ('memory', 'file', 'off')
+
+# Bound on the per-worker cache of pages that render the same for every visitor
+SHARED_PAGE_BYTES = 4 * 1024 * 1024
+
+
+def render_with_placeholders(template, **context):
+    """
+    Render a template with placeholders where the request's nonce and CSRF token belong
+    """
+    return render_template(template, **context, nonce=NONCE_PLACEHOLDER, csrf_token=lambda: CSRF_PLACEHOLDER)
+
+
+def fill_placeholders(html):
+    """
+    Put the current request's nonce and CSRF token into a page rendered with placeholders
+    """
+    return html.replace(NONCE_PLACEHOLDER, g.nonce).replace(CSRF_PLACEHOLDER, generate_csrf())
+
+
+class FragmentCache:
+    """
+    Base cache: counts hits, misses and evictions and makes concurrent misses on a key compute it once
+    """
+
+    def __init__(self):
+        self.counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def get_or_compute(self, user_id, key, compute):
+        """
+        Return the cached page for the key, or compute it once however many requests miss at the same time.
+        compute returns the page, or a response to pass through uncached (a redirect or apology).
+        """
+        html = self.get(user_id, key)
+        if html is not None:
+            self.count('hits')
+            return html
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {'done': threading.Event(), 'html': None}
+
+        if not leader:
+            flight['done'].wait()
+            if flight['html'] is not None:
+                self.count('coalesced')
+                return flight['html']
+            return compute()
+
+        self.count('misses')
+        try:
+            result = compute()
+            if isinstance(result, str):
+                self.set(user_id, key, result)
+                flight['html'] = result
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight['done'].set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, backend=self.backend, entries=self.entries(), bytes=self.size())
+
+
+class MemoryFragmentCache(FragmentCache):
+    """
+    In-process LRU bounded by the total size of the cached pages
+    """
+    backend = 'memory'
+
+    def __init__(self, max_bytes):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()
+        self._by_user = {}
+        self._bytes = 0
+
+    def get(self, user_id, key):
+        with self._lock:
+            html = self._pages.get(key)
+            if html is not None:
+                self._pages.move_to_end(key)
+            return html
+
+    def set(self, user_id, key, html):
+        with self._lock:
+            if key in self._pages:
+                return
+            self._pages[key] = html
+            self._by_user.setdefault(user_id, set()).add(key)
+            self._bytes += len(html)
+            while self._bytes > self.max_bytes and self._pages:
+                old_key, old_html = self._pages.popitem(last=False)
+                self._by_user.get(old_key[0], set()).discard(old_key)
+                self._bytes -= len(old_html)
+                self.counters['evictions'] += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            for key in self._by_user.pop(user_id, ()):
+                html = self._pages.pop(key, None)
+                if html is not None:
+                    self._bytes -= len(html)
+                    self.counters['invalidations'] += 1
+
+    def entries(self):
+        return len(self._pages)
+
+    def size(self):
+        return self._bytes
+
+
+class FileFragmentCache(FragmentCache):
+    """
+    Pages stored as files in a local directory, one subdirectory per user, so every worker on the host
+    shares them. Least recently used files are evicted once the directory outgrows its size bound.
+    """
+    backend = 'file'
+
+    # Check the size bound every this many writes rather than scanning the directory on each one
+    EVICT_EVERY = 50
+
+    def __init__(self, directory, max_bytes):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, user_id, key):
+        return os.path.join(self.directory, str(user_id),
+                            hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + '.html')
+
+    def get(self, user_id, key):
+        path = self.path(user_id, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            os.utime(path)
+            return html
+        except FileNotFoundError:
+            return None
+
+    def set(self, user_id, key, html):
+        path = self.path(user_id, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.html'):
+                    path = os.path.join(root, name)
+                    try:
+                        info = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield info.st_mtime, info.st_size, path
+
+    def evict(self):
+        """
+        Remove least recently used pages until the directory is back under its size bound
+        """
+        files = sorted(self.files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.count('evictions')
+
+    def invalidate(self, user_id):
+        user_dir = os.path.join(self.directory, str(user_id))
+        try:
+            names = os.listdir(user_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(user_dir, name))
+                self.count('invalidations')
+            except FileNotFoundError:
+                continue
+
+    def entries(self):
+        return sum(1 for _ in self.files())
+
+    def size(self):
+        return sum(size for _, size, _ in self.files())
+
+
+def cached_render(template):
+    """
+    Serve the page from the fragment cache when the user's data hasn't changed. The view returns the
+    template's context (a dict), or a response to send as-is.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            cache = app.extensions.get('fragment_cache')
+
+            def compute():
+                result = f(*args, **kwargs)
+                if isinstance(result, dict):
+                    return render_with_placeholders(template, **result)
+                return result
+
+            # Only GETs are cached. Pending flash messages are rendered into the page, so it can't be
+            # shared with other views.
+            if cache is None or request.method != 'GET' or '_flashes' in session:
+                result = compute()
+            else:
+                key = (session['user_id'], current_revision(), get_catalog().generation, template, build_id,
+                       request.full_path, session.get('last_name'))
+                result = cache.get_or_compute(session['user_id'], key, compute)
+
+            if isinstance(result, str):
+                return fill_placeholders(result)
+            return result
+        return decorated_function
+    return decorator
+
+
+def render_shared(template, **context):
+    """
+    Render a page that looks the same for every visitor (login, register, apologies...) once per worker,
+    and serve later requests by filling the cached markup with their own nonce and CSRF token
+    """
+    cache = app.extensions.get('shared_pages')
+    if cache is None or '_flashes' in session:
+        return render_template(template, **context, nonce=g.nonce)
+
+    # The layout's navigation differs for signed-in users
+    key = (template, bool(session.get('user_id')), tuple(sorted(context.items())))
+    html = cache.get_or_compute(None, key, lambda: render_with_placeholders(template, **context))
+    return fill_placeholders(html)
+
+
+def init_fragment_cache(flask_app):
+    """
+    Install the fragment cache named by FRAGMENT_CACHE (memory, file or off; default memory)
+    """
+    backend = os.getenv('FRAGMENT_CACHE', 'memory')
+    if backend not in FRAGMENT_BACKENDS:
+        raise ValueError(f"FRAGMENT_CACHE must be one of {', '.join(FRAGMENT_BACKENDS)}, not {backend!r}")
+
+    max_bytes = int(os.getenv('FRAGMENT_CACHE_BYTES', str(32 * 1024 * 1024)))
+    if backend == 'memory':
+        flask_app.extensions['fragment_cache'] = MemoryFragmentCache(max_bytes)
+    elif backend == 'file':
+        # Cached pages hold users' data, so they are kept where only the app's user can read them
+        directory = os.getenv('FRAGMENT_CACHE_DIR')
+        if not directory:
+            directory = os.path.join(private_directory(flask_app.instance_path), 'fragments')
+        flask_app.extensions['fragment_cache'] = FileFragmentCache(private_directory(directory), max_bytes)
+    else:
+        flask_app.extensions['fragment_cache'] = None
+
+    # Pages shared by all visitors are small and few, so each worker keeps its own copies in memory
+    flask_app.extensions['shared_pages'] = None if backend == 'off' else MemoryFragmentCache(SHARED_PAGE_BYTES)
@@ -3,7 +3,9 @@ Module contains apology and login_required helper functions
 """
 
 from functools import wraps
-from flask import redirect, render_template, session
+from flask import redirect, session
+
+from fragments import render_shared
 
 
 def apology(message, code=400):
@@ -28,7 +30,7 @@ def apology(message, code=400):
             s = s.replace(old, new)
         return s
 
-    return render_template("apology.html", top=code, bottom=escape(message)), code
+    return render_shared("apology.html", top=code, bottom=escape(message)), code
 
 
 def login_required(f):
@@ -2,10 +2,42 @@
 Module to set up sql database inside docker container
 """
 
+import argparse
 import csv
+import os
 
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+
+from catalog import invalidate
 from dbmodels import Base, DisasterSupplies, DisasterTasks, Sits, StateDisasters, States, Supplies, Tasks
-from preppydb import db_session
+from preppydb import database_url, db_session
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def alembic_config():
+    """
+    Alembic settings for the app's db, built here rather than read from alembic.ini so that its logging
+    setup is left alone
+    """
+    config = Config()
+    config.set_main_option('script_location', os.path.join(BASE_DIR, 'alembic'))
+    config.set_main_option('sqlalchemy.url', database_url.replace('%', '%%'))
+    return config
+
+
+def migrate():
+    """
+    Bring the db schema up to date, leaving its data alone: run the migrations an existing db hasn't had
+    yet, or create the tables of a new one and mark it as up to date
+    """
+    if inspect(db_session.bind).get_table_names():
+        command.upgrade(alembic_config(), 'head')
+    else:
+        Base.metadata.create_all(bind=db_session.bind)
+        command.stamp(alembic_config(), 'head')
 
 
 def init_db():
@@ -16,8 +48,9 @@ def init_db():
     # Drop existing tables
     Base.metadata.drop_all(bind=db_session.bind)
 
-    # Create db tables
+    # Create db tables, which are then as the latest migration leaves them
     Base.metadata.create_all(bind=db_session.bind)
+    command.stamp(alembic_config(), 'head')
 
     # Insert initial data into tables from csv files
     with open('sits.csv', 'r', newline='', encoding='utf-8') as csvfile:
@@ -62,6 +95,15 @@ def init_db():
         db_session.bulk_save_objects(state_disasters_data)
         db_session.commit()
 
+    # Reference data has changed, so any cached catalog is stale
+    invalidate()
+
 
 if __name__ == "__main__":
-    init_db()
+    parser = argparse.ArgumentParser(description="Create the Preppy database")
+    parser.add_argument('--migrate', action='store_true',
+                        help="only bring the schema up to date, without dropping or reseeding anything")
+    if parser.parse_args().migrate:
+        migrate()
+    else:
+        init_db()
@@ -3,14 +3,108 @@ Module sets up database connection based on .env file
 """
 
 import os
+import time
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import QueuePool, create_engine, event, make_url
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import scoped_session, sessionmaker
 
 load_dotenv()
 
 database_url = os.getenv("DATABASE_URL", "sqlite:///preppy.db")
-engine = create_engine(database_url)
+
+# Connection pool settings, tunable per deployment
+pool_options = {
+    'pool_pre_ping': True,
+    'pool_recycle': int(os.getenv("DB_POOL_RECYCLE", "1800")),
+}
+
+# Sizing only applies to a queue pool: in-memory SQLite gets one connection per thread, and rejects these
+url = make_url(database_url)
+if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+    pool_options.update({
+        'pool_size': int(os.getenv("DB_POOL_SIZE", "5")),
+        'max_overflow': int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        'pool_timeout': int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    })
+
+# SQLite production tuning profile, applied to every new connection unless SQLITE_TUNING=off
+sqlite_tuning = os.getenv("SQLITE_TUNING", "on") != "off"
+sqlite_pragmas = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+    'mmap_size': int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024))),
+    'cache_size': int(os.getenv("SQLITE_CACHE_SIZE", "-16000")),
+    'temp_store': 'MEMORY',
+}
+optimize_interval = int(os.getenv("SQLITE_OPTIMIZE_INTERVAL", "3600"))
+last_optimize = time.monotonic()
+
+engine = create_engine(database_url, **pool_options)
+
+# Writes that insert a row or update the one already there are written as INSERT ... ON CONFLICT DO
+# UPDATE, which only these databases share
+UPSERT_DIALECTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+if engine.dialect.name not in UPSERT_DIALECTS:
+    raise ValueError(f"DATABASE_URL must be a SQLite or PostgreSQL database, not {engine.dialect.name}")
 Session = sessionmaker(bind=engine)
-db_session = Session()
+
+# Each thread (and so each request) gets its own session, released on app context teardown
+db_session = scoped_session(Session)
+
+
+def dispose_after_fork():
+    """
+    Give a forked worker its own connection pool, leaving the parent's connections to the parent
+    """
+    engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dispose_after_fork)
+
+
+if engine.dialect.name == 'sqlite' and sqlite_tuning:
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """
+        Apply the tuning profile to each new SQLite connection
+        """
+        cursor = dbapi_connection.cursor()
+        for pragma, value in sqlite_pragmas.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+    @event.listens_for(engine, "checkin")
+    def optimize_sqlite(dbapi_connection, connection_record):
+        """
+        Periodically let SQLite refresh its query planner statistics
+        """
+        global last_optimize
+        if time.monotonic() - last_optimize < optimize_interval:
+            return
+        last_optimize = time.monotonic()
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA optimize")
+        cursor.close()
+
+
+def upsert(table):
+    """
+    An INSERT in the db's dialect, which can take on_conflict_do_update()
+    """
+    return UPSERT_DIALECTS[engine.dialect.name](table)
+
+
+def begin_for_savepoints(session):
+    """
+    Make sure the session's transaction has begun in the db before begin_nested() is used. pysqlite only
+    begins one ahead of the first write, so a SAVEPOINT sent earlier would itself become the transaction,
+    and releasing it would commit.
+    """
+    connection = session.connection()
+    if engine.dialect.name == 'sqlite' and not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN")
@@ -0,0 +1,128 @@
+"""
+Module keeps a per-user revision number, bumped after every write request, so that pages built from a
+user's data can be revalidated with ETags instead of being re-rendered
+"""
+
+import hashlib
+import os
+import time
+
+from functools import wraps
+
+from flask import current_app as app
+from flask import g, make_response, request, session
+from sqlalchemy import update
+from sqlalchemy.exc import SQLAlchemyError
+
+from catalog import get_catalog
+from dbmodels import Users
+from preppydb import db_session, engine
+
+# Requests that never change user data
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def deployed_build():
+    """
+    Hash of the templates and asset manifest, so a deploy that changes page markup changes every ETag
+    """
+    digest = hashlib.sha256()
+    paths = [os.path.join(root, name) for root, _, names in os.walk(os.path.join(BASE_DIR, 'templates'))
+             for name in names]
+    paths.append(os.path.join(BASE_DIR, 'static', 'dist', 'manifest.json'))
+    for path in sorted(paths):
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+build_id = deployed_build()
+
+
+def current_revision():
+    """
+    The signed-in user's revision number, read from the db at most once per request
+    """
+    if 'revision' not in g:
+        g.revision = db_session.query(Users.revision).filter_by(id=session['user_id']).scalar() or 0
+    return g.revision
+
+
+def bump_revision(user_id):
+    """
+    Mark everything previously served from the user's data as stale
+    """
+    with engine.begin() as connection:
+        connection.execute(update(Users).where(Users.id == user_id).values(revision=Users.revision + 1))
+
+
+def csrf_window():
+    """
+    Which half of the CSRF time limit it is now. A page revalidated under one window's ETag was rendered
+    in that window, so the tokens in its forms still have at least half their lifetime left.
+    """
+    limit = app.config.get('WTF_CSRF_TIME_LIMIT')
+    return int(time.time() // (limit / 2)) if limit else 0
+
+
+def page_etag():
+    """
+    Weak ETag for the current page: a hash of the user, their revision, the reference data, the CSRF
+    window and everything else the markup depends on
+    """
+    return hashlib.sha256("\0".join(str(part) for part in (
+        build_id, session['user_id'], current_revision(), get_catalog().generation, csrf_window(),
+        request.full_path, session.get('last_name'), session.get('csrf_token'))
+    ).encode('utf-8')).hexdigest()[:32]
+
+
+def revalidated(f):
+    """
+    Answer repeat GETs with 304 Not Modified while the user's data hasn't changed
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Pending flash messages are shown by the next render, so it can't be skipped
+        if '_flashes' in session:
+            return f(*args, **kwargs)
+
+        try:
+            etag = page_etag()
+        except SQLAlchemyError as e:
+            app.logger.error("Database error: %s", e)
+            return f(*args, **kwargs)
+
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        return response
+    return decorated_function
+
+
+def init_revisions(flask_app):
+    """
+    Bump the signed-in user's revision after every request that may have written their data
+    """
+
+    @flask_app.after_request
+    def bump_after_write(response):
+        if request.method in SAFE_METHODS or 'user_id' not in session or response.status_code >= 400:
+            return response
+        try:
+            bump_revision(session['user_id'])
+        except SQLAlchemyError as e:
+            flask_app.logger.error("Database error: %s", e)
+
+        # Pages cached under the old revision can't be served again, so free the space they take
+        cache = flask_app.extensions.get('fragment_cache')
+        if cache is not None:
+            cache.invalidate(session['user_id'])
+        return response
@@ -0,0 +1,558 @@
+"""
+Module encrypts users' stored files in a chunked container, so files of any size are encrypted while
+they stream in from the request and decrypted while they stream out, in constant memory. Chunks are
+compressed before they are sealed whenever that makes them smaller. Files stored before the container
+existed are single Fernet tokens, and are still read.
+"""
+
+import base64
+import fcntl
+import functools
+import hashlib
+import hmac
+import io
+import os
+import struct
+import tempfile
+import zlib
+
+from collections import namedtuple
+
+KEYFILE = 'keyfile'
+
+# Container layout: a header (magic, chunk size, random nonce prefix, codec, random salt), then one record
+# per chunk of plaintext: its sealed length and the AES-GCM sealed chunk. Each container is sealed under
+# its own key, derived from the keyfile's key with its salt, so no two files share a key and nonces can't
+# repeat across them however many chunks are stored. Chunk i is sealed under the nonce prefix + i + a
+# last-chunk flag, with the header as associated data, so records that are reordered, dropped, or cut off
+# at the end fail to decrypt. A sealed footer after the records holds the plaintext size and where each
+# record starts, and the file ends with the footer's length.
+MAGIC = b'PREPPYC3'
+SALT_SIZE = 32
+HEADER = struct.Struct(f'>8sI7sB{SALT_SIZE}s')
+RECORD = struct.Struct('>I')
+NONCE_INDEX = struct.Struct('>IB')
+FOOTER_SIZE = struct.Struct('>Q')
+TRAILER = struct.Struct('>I')
+FOOTER_NONCE_INDEX = NONCE_INDEX.pack(0xFFFFFFFF, 2)
+TAG_SIZE = 16
+CHUNK_SIZE = 64 * 1024
+
+# Codecs a container's chunks may be compressed with. Each sealed chunk starts with a flag saying
+# whether it was, since chunks that don't shrink (already compressed scans, photos) are stored as is.
+CODECS = {'off': 0, 'zlib': 1}
+STORED, COMPRESSED = 0, 1
+ZLIB_LEVEL = 6
+
+# Before compressing a chunk, a sample of it is compressed quickly, and the chunk is stored as is if the
+# sample doesn't shrink by much: compressing random-looking data at full effort costs more than the rest
+# of storing it
+PROBE_SIZE = 4096
+PROBE_RATIO = 0.95
+
+# Codec for newly stored files (UPLOAD_COMPRESSION=zlib or off)
+if os.getenv('UPLOAD_COMPRESSION', 'zlib') not in CODECS:
+    raise ValueError(f"UPLOAD_COMPRESSION must be one of {', '.join(CODECS)}, not {os.getenv('UPLOAD_COMPRESSION')!r}")
+upload_codec = CODECS[os.getenv('UPLOAD_COMPRESSION', 'zlib')]
+
+# A container still being uploaded keeps the bytes that may yet be its last chunk in a tail file beside
+# it: the count of records sealed so far and where they end, then the pending bytes sealed under a
+# random nonce
+TAIL = struct.Struct('>QQ')
+NONCE_SIZE = 12
+
+# What the header and footer say about a container
+Container = namedtuple('Container', ['header', 'chunk_size', 'prefix', 'codec', 'offsets', 'size', 'data_end'])
+
+_keys = None
+
+
+class DecryptionError(Exception):
+    """
+    Raised when a stored file fails authentication or isn't in a format written by this app
+    """
+
+
+def load_keys():
+    """
+    Return the Fernet cipher for files stored before chunking and the key that per-file keys are derived
+    from, reading the keyfile (or creating it on first run) and importing cryptography only once a worker
+    needs them
+    """
+    global _keys
+    if _keys is None:
+        from cryptography.fernet import Fernet
+
+        # Write a new key aside and link it into place, so workers starting together can't each create
+        # a different key or read a half-written one
+        if not os.path.exists(KEYFILE):
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(KEYFILE)))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(Fernet.generate_key())
+                os.link(tmp, KEYFILE)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+        with open(KEYFILE, 'rb') as f:
+            key = f.read()
+
+        # Per-file keys are derived from the existing key, so one keyfile still covers every stored file
+        _keys = (Fernet(key), base64.urlsafe_b64decode(key))
+    return _keys
+
+
+@functools.lru_cache(maxsize=256)
+def file_cipher(header):
+    """
+    The AES-GCM cipher for a container's chunks, under its own key derived with the salt in its header
+    """
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    salt = HEADER.unpack(header)[4]
+    return AESGCM(HKDF(algorithm=hashes.SHA256(), length=32, salt=salt,
+                       info=b'preppy file chunks v3').derive(load_keys()[1]))
+
+
+def chunk_nonce(prefix, index, last):
+    return prefix + NONCE_INDEX.pack(index, last)
+
+
+def read_full(source, size):
+    """
+    Read up to size bytes, fewer only at the end of the stream
+    """
+    data = source.read(size)
+    while data and len(data) < size:
+        more = source.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+@functools.lru_cache(maxsize=1)
+def digest_key():
+    """
+    Key for content digests, derived from the keyfile's key apart from the chunk keys
+    """
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                info=b'preppy file digests v1').derive(load_keys()[1])
+
+
+def content_digest(source, block_size=1024 * 1024):
+    """
+    HMAC-SHA256 (hex) and size of everything read from source, a block at a time, as encrypt_stream
+    computes them. The digest is keyed, so a leaked copy of the db can't be used to confirm guesses of
+    what users have stored.
+    """
+    digest = hmac.new(digest_key(), digestmod=hashlib.sha256)
+    size = 0
+    block = source.read(block_size)
+    while block:
+        digest.update(block)
+        size += len(block)
+        block = source.read(block_size)
+    return digest.hexdigest(), size
+
+
+def new_header(chunk_size=CHUNK_SIZE, codec=None):
+    return HEADER.pack(MAGIC, chunk_size, os.urandom(7), upload_codec if codec is None else codec,
+                       os.urandom(SALT_SIZE))
+
+
+def read_header(f):
+    """
+    Read the header of an open container, or None if f starts with something else
+    """
+    f.seek(0)
+    header = f.read(HEADER.size)
+    return header if len(header) == HEADER.size and header.startswith(MAGIC) else None
+
+
+def compressible(chunk):
+    probe = chunk[:PROBE_SIZE]
+    return len(zlib.compress(probe, 1)) < len(probe) * PROBE_RATIO
+
+
+def seal_record(header, index, last, chunk):
+    """
+    Compress (if that helps) and seal one chunk, returning its record
+    """
+    _, _, prefix, codec, _ = HEADER.unpack(header)
+    packed = None
+    if codec == CODECS['zlib'] and chunk and compressible(chunk):
+        compressed = zlib.compress(chunk, ZLIB_LEVEL)
+        if len(compressed) < len(chunk):
+            packed = bytes((COMPRESSED,)) + compressed
+    if packed is None:
+        packed = bytes((STORED,)) + chunk
+    sealed = file_cipher(header).encrypt(chunk_nonce(prefix, index, last), packed, header)
+    return RECORD.pack(len(sealed)) + sealed
+
+
+def seal_footer(header, size, offsets):
+    """
+    Seal the plaintext size and record offsets, returning the footer and trailer that end a container
+    """
+    prefix = HEADER.unpack(header)[2]
+    index = FOOTER_SIZE.pack(size) + struct.pack(f'>{len(offsets)}Q', *offsets)
+    sealed = file_cipher(header).encrypt(prefix + FOOTER_NONCE_INDEX, index, header)
+    return sealed + TRAILER.pack(len(sealed))
+
+
+def encrypt_stream(source, dest, chunk_size=CHUNK_SIZE, codec=None):
+    """
+    Encrypt everything read from source into a container written to dest, a chunk at a time, hashing
+    the plaintext on the way. Returns its content digest and size.
+    """
+    header = new_header(chunk_size, codec)
+    dest.write(header)
+    digest = hmac.new(digest_key(), digestmod=hashlib.sha256)
+
+    offsets = []
+    position = len(header)
+    size = 0
+    chunk = read_full(source, chunk_size)
+    while True:
+        # Read one chunk ahead to know whether this one is the last
+        following = read_full(source, chunk_size) if len(chunk) == chunk_size else b''
+        last = not following
+        digest.update(chunk)
+        record = seal_record(header, len(offsets), last, chunk)
+        offsets.append(position)
+        dest.write(record)
+        position += len(record)
+        size += len(chunk)
+        if last:
+            break
+        chunk = following
+
+    dest.write(seal_footer(header, size, offsets))
+    return digest.hexdigest(), size
+
+
+def read_container(f, end):
+    """
+    Read what the header and footer of an open container say about it, or None if f isn't a container
+    """
+    from cryptography.exceptions import InvalidTag
+
+    if end < HEADER.size + TRAILER.size:
+        return None
+    header = read_header(f)
+    if header is None:
+        return None
+
+    _, chunk_size, prefix, codec, _ = HEADER.unpack(header)
+    f.seek(end - TRAILER.size)
+    footer_size, = TRAILER.unpack(f.read(TRAILER.size))
+    data_end = end - TRAILER.size - footer_size
+    if data_end < len(header):
+        raise DecryptionError("Encrypted file is corrupt.")
+    f.seek(data_end)
+    try:
+        footer = file_cipher(header).decrypt(prefix + FOOTER_NONCE_INDEX, f.read(footer_size), header)
+    except InvalidTag as e:
+        raise DecryptionError("File index failed authentication.") from e
+    size, = FOOTER_SIZE.unpack_from(footer)
+    count, remainder = divmod(len(footer) - FOOTER_SIZE.size, 8)
+    if count < 1 or remainder:
+        raise DecryptionError("File index is corrupt.")
+    offsets = struct.unpack_from(f'>{count}Q', footer, FOOTER_SIZE.size)
+    return Container(header, chunk_size, prefix, codec, offsets, size, data_end)
+
+
+def decrypt_records(f, container, index=0):
+    """
+    Yield the plaintext of each record of an open container, from record index (where f is positioned)
+    """
+    from cryptography.exceptions import InvalidTag
+
+    aead = file_cipher(container.header)
+    count = len(container.offsets)
+    while True:
+        length = f.read(RECORD.size)
+        if len(length) < RECORD.size:
+            raise DecryptionError("Encrypted file is truncated.")
+        sealed_size, = RECORD.unpack(length)
+        if sealed_size > container.chunk_size + 1 + TAG_SIZE:
+            raise DecryptionError("Encrypted file is corrupt.")
+        sealed = f.read(sealed_size)
+        last = index == count - 1
+        try:
+            packed = aead.decrypt(chunk_nonce(container.prefix, index, last), sealed, container.header)
+        except InvalidTag as e:
+            raise DecryptionError(f"Chunk {index} failed authentication.") from e
+        yield unpack_chunk(container, packed)
+        if last:
+            return
+        index += 1
+
+
+def unpack_chunk(container, packed):
+    """
+    A chunk's plaintext from its sealed contents, which start with a flag saying whether it was compressed
+    """
+    if packed[0] == STORED:
+        return packed[1:]
+    decompressor = zlib.decompressobj()
+    chunk = decompressor.decompress(memoryview(packed)[1:], container.chunk_size)
+    if decompressor.unconsumed_tail:
+        raise DecryptionError("Encrypted file is corrupt.")
+    return chunk
+
+
+def ciphertext_etag(head, tail, end):
+    """
+    Strong ETag for a stored file: its random header (or Fernet IV), final authentication tag and size
+    change whenever its bytes do, so reading a few bytes identifies the version without decrypting it
+    """
+    return hashlib.sha256(head + tail + str(end).encode('ascii')).hexdigest()[:32]
+
+
+class DecryptedFile(io.RawIOBase):
+    """
+    Seekable read-only file of a stored container's plaintext. Reads decrypt one chunk at a time, and a
+    seek jumps straight to the chunk covering the new position, so a byte range costs only its chunks.
+    """
+
+    def __init__(self, f, container, etag):
+        super().__init__()
+        self._file = f
+        self._container = container
+        self._chunks = None
+        self._buffer = memoryview(b'')
+        self._pos = 0
+        self.size = container.size
+        self.etag = etag
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(offset, 0)
+        self._chunks = None
+        self._buffer = memoryview(b'')
+        return self._pos
+
+    def load(self):
+        """
+        Decrypt the chunk covering the current position, and line the following ones up behind it
+        """
+        chunk_size = self._container.chunk_size
+        index, skip = divmod(self._pos, chunk_size)
+        index = min(index, len(self._container.offsets) - 1)
+        self._file.seek(self._container.offsets[index])
+        self._chunks = decrypt_records(self._file, self._container, index)
+        self._buffer = memoryview(next(self._chunks))[skip:]
+
+    def readinto(self, b):
+        if self._pos >= self.size:
+            return 0
+        if self._chunks is None:
+            self.load()
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = memoryview(chunk)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        self._pos += n
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class LegacyFile(io.BytesIO):
+    """
+    Plaintext of a file stored before chunking, which has to be decrypted whole
+    """
+
+    def __init__(self, data, etag):
+        super().__init__(data)
+        self.size = len(data)
+        self.etag = etag
+
+
+def open_decrypted(path):
+    """
+    Open a stored file for reading its plaintext. The index and first chunk are checked up front, so a
+    file that was tampered with or encrypted under another key raises DecryptionError here, before any
+    of it is sent.
+    """
+    f = open(path, 'rb')
+    try:
+        end = os.fstat(f.fileno()).st_size
+        head = f.read(HEADER.size)
+        f.seek(max(end - TAG_SIZE * 2, 0))
+        etag = ciphertext_etag(head, f.read(), end)
+
+        container = read_container(f, end)
+        if container is not None:
+            decrypted = DecryptedFile(f, container, etag)
+            decrypted.load()
+            return decrypted
+
+        # Files stored before chunking are a single Fernet token, decrypted whole
+        from cryptography.fernet import InvalidToken
+        f.seek(0)
+        try:
+            data = load_keys()[0].decrypt(f.read())
+        except InvalidToken as e:
+            raise DecryptionError("File failed authentication.") from e
+        f.close()
+        return LegacyFile(data, etag)
+    except BaseException:
+        f.close()
+        raise
+
+
+class PartialContainer:
+    """
+    A container written across several requests. Chunks are sealed as soon as later bytes show they
+    aren't the last, the remainder waits (sealed) in the tail file, and finish() seals it as the last
+    chunk. The tail is replaced atomically after records are written, so an interrupted append is rolled
+    back to the last saved offset.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tail_path = path + '.tail'
+
+    def create(self, chunk_size=CHUNK_SIZE):
+        header = new_header(chunk_size)
+        with open(self.path, 'wb') as f:
+            f.write(header)
+        self.save_tail(header, 0, len(header), b'')
+
+    def lock(self):
+        """
+        Take the container for one request, raising BlockingIOError if another request holds it
+        """
+        f = open(self.path, 'r+b')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def save_tail(self, header, records, data_end, pending):
+        state = TAIL.pack(records, data_end)
+        nonce = os.urandom(NONCE_SIZE)
+        sealed = file_cipher(header).encrypt(nonce, bytes(pending), header + state)
+        tmp = self.tail_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(state + nonce + sealed)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.tail_path)
+
+    def load_tail(self, f):
+        """
+        Read the container's header, its count of sealed records, where they end and its pending bytes
+        """
+        from cryptography.exceptions import InvalidTag
+
+        header = read_header(f)
+        if header is None:
+            raise DecryptionError("Upload is corrupt.")
+        with open(self.tail_path, 'rb') as t:
+            tail = t.read()
+        state = tail[:TAIL.size]
+        records, data_end = TAIL.unpack(state)
+        nonce = tail[TAIL.size:TAIL.size + NONCE_SIZE]
+        try:
+            pending = file_cipher(header).decrypt(nonce, tail[TAIL.size + NONCE_SIZE:], header + state)
+        except InvalidTag as e:
+            raise DecryptionError("Upload state failed authentication.") from e
+        return header, records, data_end, bytearray(pending)
+
+    def offset(self, f):
+        header, records, _, pending = self.load_tail(f)
+        return records * HEADER.unpack(header)[1] + len(pending)
+
+    def append(self, f, source):
+        """
+        Encrypt everything read from source onto the locked container f, returning the new offset. If
+        reading source fails part way (a dropped connection), what arrived before is kept.
+        """
+        header, records, data_end, pending = self.load_tail(f)
+        chunk_size = HEADER.unpack(header)[1]
+
+        # Drop records written after the tail was last saved, by an append that didn't finish
+        f.seek(data_end)
+        f.truncate()
+        try:
+            while True:
+                block = source.read(chunk_size)
+                if not block:
+                    break
+                pending += block
+
+                # A full chunk is only sealed once bytes follow it, since the last one is sealed differently
+                while len(pending) > chunk_size:
+                    record = seal_record(header, records, False, bytes(pending[:chunk_size]))
+                    f.write(record)
+                    data_end += len(record)
+                    del pending[:chunk_size]
+                    records += 1
+        finally:
+            f.flush()
+            os.fsync(f.fileno())
+            self.save_tail(header, records, data_end, pending)
+        return records * chunk_size + len(pending)
+
+    def finish(self, f):
+        """
+        Seal the pending bytes as the last chunk of the locked container f and write its index,
+        returning its plaintext size. The tail is kept, so the upload can still be finished again (or
+        appended to) until remove() is called; both start over from the saved offset.
+        """
+        header, records, data_end, pending = self.load_tail(f)
+        chunk_size = HEADER.unpack(header)[1]
+        f.seek(data_end)
+        f.truncate()
+        f.write(seal_record(header, records, True, bytes(pending)))
+        size = records * chunk_size + len(pending)
+
+        # Records were written across requests, so find where each starts from their lengths
+        offsets = []
+        position = len(header)
+        for _ in range(records + 1):
+            offsets.append(position)
+            f.seek(position)
+            position += RECORD.size + RECORD.unpack(f.read(RECORD.size))[0]
+        f.seek(position)
+        f.write(seal_footer(header, size, offsets))
+        f.flush()
+        os.fsync(f.fileno())
+        return size
+
+    def remove(self):
+        for path in (self.path, self.tail_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
@@ -0,0 +1,146 @@
+"""
+Module provides the browser session backends: server-side sessions stored in the app database, or
+signed cookies carrying the (small) session payload themselves
+"""
+
+import os
+import secrets
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from sqlalchemy import delete, select
+from werkzeug.datastructures import CallbackDict
+
+from dbmodels import Sessions
+from preppydb import engine, upsert
+
+SESSION_BACKENDS = ('sql', 'cookie')
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """
+    Session dict that remembers its id, row expiry and signed-in user, and notes when it has been read or
+    changed
+    """
+
+    def __init__(self, initial=None, sid=None, expiry=0, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expiry = expiry
+        self.new = new
+        self.user_id = (initial or {}).get('user_id')
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class SqlSessionInterface(SessionInterface):
+    """
+    Keep sessions in the sessions table, writing only when a session changes or nears expiry, and sweep
+    expired rows in bounded batches at most once per sweep interval
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, sweep_interval=300, sweep_batch=500):
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.last_sweep = 0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with engine.connect() as connection:
+                row = connection.execute(select(Sessions.data, Sessions.expiry).where(
+                    (Sessions.id == sid) & (Sessions.expiry > int(time.time())))).first()
+            if row:
+                return ServerSession(self.serializer.loads(row.data.decode('utf-8')), sid=sid, expiry=row.expiry)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = int(time.time())
+
+        # Responses that read the session differ per cookie
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and not session.new:
+                with engine.begin() as connection:
+                    connection.execute(delete(Sessions).where(Sessions.id == session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # A session that signs someone in (or another user) moves to a new id and its old row is removed,
+        # so an id planted or seen before sign-in is worthless afterwards
+        rotated = None
+        if not session.new and dict.get(session, 'user_id') != session.user_id:
+            rotated, session.sid, session.new = session.sid, secrets.token_urlsafe(32), True
+
+        # Skip the write for unchanged sessions until half their lifetime has passed
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        if session.modified or session.expiry - now < lifetime // 2:
+            stmt = upsert(Sessions).values(id=session.sid, data=self.serializer.dumps(dict(session)).encode('utf-8'),
+                                           expiry=now + lifetime)
+            stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={
+                'data': stmt.excluded.data, 'expiry': stmt.excluded.expiry})
+            with engine.begin() as connection:
+                if rotated:
+                    connection.execute(delete(Sessions).where(Sessions.id == rotated))
+                connection.execute(stmt)
+            self.sweep(now)
+
+        if self.should_set_cookie(app, session) or session.new:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+    def sweep(self, now):
+        """
+        Delete one batch of expired sessions, leaving the rest for later sweeps so no request stalls long
+        """
+        if now - self.last_sweep < self.sweep_interval:
+            return
+        expired = select(Sessions.id).where(Sessions.expiry <= now).limit(self.sweep_batch)
+        with engine.begin() as connection:
+            # Only some requests sweep, so the sweep is kept out of their query budget
+            connection.execution_options(budget_exempt=True)
+            deleted = connection.execute(delete(Sessions).where(Sessions.id.in_(expired))).rowcount
+
+        # A full batch means more are waiting, so sweep again on the next write
+        if deleted < self.sweep_batch:
+            self.last_sweep = now
+
+
+def init_sessions(app):
+    """
+    Install the session backend named by SESSION_BACKEND (default: sql)
+    """
+    backend = os.getenv('SESSION_BACKEND', 'sql')
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"SESSION_BACKEND must be one of {', '.join(SESSION_BACKENDS)}, not {backend!r}")
+
+    if backend == 'cookie':
+        app.session_interface = SecureCookieSessionInterface()
+    else:
+        app.session_interface = SqlSessionInterface(
+            sweep_interval=int(os.getenv('SESSION_SWEEP_INTERVAL', '300')),
+            sweep_batch=int(os.getenv('SESSION_SWEEP_BATCH', '500')))
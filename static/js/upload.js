@@ -0,0 +1,113 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('upload');
+
+    form.addEventListener('submit', function(event) {
+        const files = form.querySelector('input[type="file"]').files;
+        if (!files.length) {
+            return;
+        }
+        event.preventDefault();
+
+        const button = form.querySelector('button[type="submit"]');
+        button.disabled = true;
+
+        // A single file is sent in resumable parts; several are sent together and stored in parallel
+        let upload;
+        if (files.length > 1) {
+            button.textContent = 'Uploading ' + files.length + ' files';
+            upload = uploadBatch(files);
+        } else {
+            upload = uploadResumable(files[0], function(sent) {
+                button.textContent = 'Uploading ' + Math.floor(100 * sent / Math.max(files[0].size, 1)) + '%';
+            });
+        }
+
+        upload
+            .then(() => {
+                window.location.href = '/uploads';
+            })
+            .catch(error => {
+                button.disabled = false;
+                button.textContent = 'Upload';
+                alert(error.message);
+            });
+    });
+});
+
+
+// Bytes sent per request, and how often to retry a request that fails before giving up
+const PART_SIZE = 1024 * 1024;
+const MAX_RETRIES = 8;
+
+
+function uploadBatch(files) {
+    const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+    const body = new FormData();
+    for (const file of files) {
+        body.append('files', file);
+    }
+
+    return fetch('/new_uploads', {method: 'POST', headers: {'X-CSRFToken': csrfToken}, body: body})
+        .then(response => response.json())
+        .then(data => {
+            const failed = (data.files || []).filter(result => result.status === 'error');
+            if (data.error || failed.length) {
+                throw new Error(data.error || 'Could not store: ' + failed.map(result => result.filename).join(', '));
+            }
+            return data;
+        });
+}
+
+
+function uploadResumable(file, onProgress) {
+    const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+    const headers = {'X-CSRFToken': csrfToken};
+
+    return request('/resumable_uploads', {
+        method: 'POST',
+        headers: {...headers, 'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name})
+    })
+        .then(upload => sendFrom(file, upload.id, 0, headers, onProgress, 0))
+        .then(id => request('/resumable_uploads/' + id + '/finalize', {method: 'POST', headers: headers}));
+}
+
+
+// Send the file from offset onwards; after a failure, ask the server how much it saved and carry on from there
+function sendFrom(file, id, offset, headers, onProgress, retries) {
+    onProgress(offset);
+    if (offset >= file.size) {
+        return Promise.resolve(id);
+    }
+
+    return request('/resumable_uploads/' + id, {
+        method: 'PATCH',
+        headers: {...headers, 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': String(offset)},
+        body: file.slice(offset, offset + PART_SIZE)
+    })
+        .then(saved => sendFrom(file, id, saved.offset, headers, onProgress, 0))
+        .catch(error => {
+            if (retries >= MAX_RETRIES) {
+                throw error;
+            }
+            return wait(1000 * 2 ** Math.min(retries, 5))
+                .then(() => request('/resumable_uploads/' + id, {headers: headers}))
+                .then(saved => sendFrom(file, id, saved.offset, headers, onProgress, retries + 1),
+                      () => sendFrom(file, id, offset, headers, onProgress, retries + 1));
+        });
+}
+
+
+function request(url, options) {
+    return fetch(url, options).then(response => response.json().then(data => {
+        if (!response.ok) {
+            throw new Error(data.error || 'Upload failed.');
+        }
+        return data;
+    }));
+}
+
+
+function wait(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
@@ -0,0 +1,303 @@
+"""
+Module keeps users' stored files in two tiers: recently read files in the upload folder, and files
+nobody has read for a while in a cheaper cold storage folder. A background job moves idle files to cold
+storage a batch at a time, and a download recalls a cold file to the upload folder before serving it.
+Within each folder files are spread over two levels of subdirectories named after the start of their
+(random) names, so no directory grows past a few files however many are stored.
+"""
+
+import argparse
+import fcntl
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import select, update
+
+from dbmodels import SecFileMetadata
+from preppydb import engine
+
+HOT, COLD = 'hot', 'cold'
+
+
+# Names of stored files (a uuid4 and .enc), which are sharded by their first four characters
+STORED_NAME = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.enc')
+
+
+def tier_folder(app, tier):
+    return app.config['UPLOAD_FOLDER'] if tier == HOT else app.config['COLD_STORAGE_FOLDER']
+
+
+def shard_path(folder, secure_filename):
+    """
+    Where a stored file belongs in a folder: 6f/1c/6f1c...enc
+    """
+    return os.path.join(folder, secure_filename[:2], secure_filename[2:4], secure_filename)
+
+
+def stored_path(app, secure_filename, tier=HOT):
+    """
+    Where a stored file belongs in a tier, creating its shard directories if needed
+    """
+    path = shard_path(tier_folder(app, tier), secure_filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+class Discard(Exception):
+    """
+    Raised inside atomic_write to drop what was written, leaving path as it was
+    """
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Write a file through a temporary file beside it, synced and then renamed into place, so path is
+    either absent, its old contents, or complete. The directory is synced too, so the rename survives a
+    crash. The temporary file is removed if writing fails or is given up with Discard.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except Discard:
+        os.remove(tmp)
+        return
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    sync_directory(os.path.dirname(path))
+
+
+def sync_directory(path):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def rename_file(src, dest):
+    """
+    Move a complete, synced file to dest on the same filesystem, syncing the directory so the move
+    survives a crash
+    """
+    os.replace(src, dest)
+    sync_directory(os.path.dirname(dest))
+
+
+def copy_file(src, dest):
+    with open(src, 'rb') as source, atomic_write(dest) as f:
+        shutil.copyfileobj(source, f, 1024 * 1024)
+
+
+def candidate_paths(folder, secure_filename):
+    # Files stored before sharding sit at the top of the folder until rehome() moves them
+    return shard_path(folder, secure_filename), os.path.join(folder, secure_filename)
+
+
+def move_file(app, secure_filename, src_tier, dest_tier):
+    """
+    Move a stored file between tiers: copy it, record its new tier, then remove the old copy. A move cut
+    short leaves the file readable wherever it is recorded, and locate() finds it in either tier.
+    """
+    if not app.config.get('COLD_STORAGE_FOLDER'):
+        return
+    src, found = locate(app, secure_filename, src_tier)
+    if found != src_tier:
+        raise FileNotFoundError(secure_filename)
+    copy_file(src, stored_path(app, secure_filename, dest_tier))
+    with engine.begin() as connection:
+        connection.execute(update(SecFileMetadata).where(
+            SecFileMetadata.secure_filename == secure_filename).values(tier=dest_tier))
+    try:
+        os.remove(src)
+    except FileNotFoundError:
+        pass
+
+
+def locate(app, secure_filename, tier):
+    """
+    Path of a stored file, looking in its recorded tier first and then the other, as the tiering job may
+    have moved it since its row was read. Returns (path, tier), or (None, None) if it is in neither.
+    """
+    tiers = (tier, COLD if tier == HOT else HOT) if app.config.get('COLD_STORAGE_FOLDER') else (HOT,)
+    for candidate in tiers:
+        for path in candidate_paths(tier_folder(app, candidate), secure_filename):
+            if os.path.exists(path):
+                return path, candidate
+    return None, None
+
+
+def recall(app, secure_filename, tier):
+    """
+    Path of a stored file about to be read, moving it back to the upload folder first if it is cold.
+    Raises FileNotFoundError if it is in neither tier.
+    """
+    path, found = locate(app, secure_filename, tier)
+    if path is None:
+        raise FileNotFoundError(secure_filename)
+    if found == COLD:
+        move_file(app, secure_filename, COLD, HOT)
+        path = shard_path(tier_folder(app, HOT), secure_filename)
+    return path
+
+
+def remove_file(app, secure_filename):
+    """
+    Remove a stored file from whichever tier holds it
+    """
+    for tier in (HOT, COLD):
+        folder = tier_folder(app, tier)
+        if not folder:
+            continue
+        for path in candidate_paths(folder, secure_filename):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+
+
+def tier_idle_files(app, now, batch):
+    """
+    Move one batch of files unread for COLD_AFTER_DAYS to cold storage, returning how many were moved
+    """
+    cutoff = now - app.config['COLD_AFTER_DAYS'] * 86400
+    with engine.connect() as connection:
+        idle = connection.execute(select(SecFileMetadata.secure_filename).where(
+            SecFileMetadata.tier == HOT, SecFileMetadata.last_access < cutoff).limit(batch)).scalars().all()
+    moved = 0
+    for secure_filename in idle:
+        try:
+            move_file(app, secure_filename, HOT, COLD)
+            moved += 1
+        except FileNotFoundError:
+            continue
+    return moved
+
+
+class TieringJob:
+    """
+    Runs the tiering job in a background thread at most once per interval in each worker, and only in one
+    worker at a time, guarded by a lock file in cold storage
+    """
+
+    def __init__(self, app, interval, batch):
+        self.app = app
+        self.interval = interval
+        self.batch = batch
+        self.last_run = time.monotonic()
+        self._lock = threading.Lock()
+
+    def schedule(self, response):
+        if time.monotonic() - self.last_run >= self.interval and self._lock.acquire(blocking=False):
+            self.last_run = time.monotonic()
+            threading.Thread(target=self.run_in_background, daemon=True).start()
+        return response
+
+    def run_in_background(self):
+        try:
+            self.run()
+        except Exception as e:
+            self.app.logger.error(f"Tiering error: {e}")
+        finally:
+            self._lock.release()
+
+    def run(self):
+        """
+        Move idle files to cold storage a batch at a time until none are left, returning how many moved
+        """
+        moved = 0
+        with open(os.path.join(self.app.config['COLD_STORAGE_FOLDER'], '.tiering.lock'), 'wb') as lock:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return moved
+            while True:
+                batch = tier_idle_files(self.app, int(time.time()), self.batch)
+                moved += batch
+                if batch < self.batch:
+                    return moved
+
+
+def rehome_batch(folder, names):
+    moved = 0
+    for name in names:
+        path = shard_path(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.rename(os.path.join(folder, name), path)
+            moved += 1
+        except FileNotFoundError:
+            continue
+    return moved
+
+
+def rehome(folder, workers=8, batch=500):
+    """
+    Move files stored at the top of a folder, before sharding, into their shard directories. Batches of
+    renames run in parallel, which pays off on network filesystems where each one is a round trip.
+    Returns how many files were moved.
+    """
+    def batches():
+        names = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and STORED_NAME.fullmatch(entry.name):
+                    names.append(entry.name)
+                    if len(names) == batch:
+                        yield names
+                        names = []
+        if names:
+            yield names
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(lambda names: rehome_batch(folder, names), batches()))
+
+
+def init_storage(app):
+    """
+    Configure the cold storage tier from COLD_STORAGE_FOLDER (tiering is off when unset) and schedule the
+    tiering job after requests
+    """
+    app.config['COLD_STORAGE_FOLDER'] = os.getenv('COLD_STORAGE_FOLDER')
+    app.config['COLD_AFTER_DAYS'] = int(os.getenv('COLD_AFTER_DAYS', '30'))
+    if not app.config['COLD_STORAGE_FOLDER']:
+        return
+    os.makedirs(app.config['COLD_STORAGE_FOLDER'], exist_ok=True)
+    job = TieringJob(app, interval=int(os.getenv('TIERING_INTERVAL', '3600')),
+                     batch=int(os.getenv('TIERING_BATCH', '100')))
+    app.after_request(job.schedule)
+
+
+if __name__ == "__main__":
+    # Run the tiering job once, e.g. from cron, instead of waiting for the app to schedule it. With
+    # --rehome, move files stored before sharding into their shard directories instead.
+    parser = argparse.ArgumentParser(description="Maintain the stored files of users")
+    parser.add_argument('--rehome', action='store_true', help="shard files stored in a flat upload folder")
+    parser.add_argument('--workers', type=int, default=8, help="parallel batches of renames (with --rehome)")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    flask_app = create_app()
+    if args.rehome:
+        for tier in (HOT, COLD):
+            if tier_folder(flask_app, tier):
+                print(f"Moved {rehome(tier_folder(flask_app, tier), args.workers)} {tier} files into shards.")
+    elif flask_app.config['COLD_STORAGE_FOLDER']:
+        job = TieringJob(flask_app, interval=0, batch=int(os.getenv('TIERING_BATCH', '100')))
+        print(f"Moved {job.run()} files to cold storage.")
+    else:
+        print("COLD_STORAGE_FOLDER is not set, so tiering is off.")
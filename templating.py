@@ -0,0 +1,30 @@
+"""
+Module compiles every template when the app is built, keeping the compiled code in a bytecode cache
+directory shared by all workers, so no request after a deploy waits on Jinja compiling a page
+"""
+
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+from utils import private_directory
+
+
+def init_templates(app):
+    """
+    Cache compiled templates in TEMPLATE_CACHE_DIR (by default the app's instance folder, or nowhere if
+    set to off) and compile them all now
+    """
+    directory = os.getenv('TEMPLATE_CACHE_DIR')
+    if not directory:
+        directory = os.path.join(private_directory(app.instance_path), 'template-cache')
+
+    # Entries are keyed by template path and checked against a hash of its source, so an edited
+    # template is recompiled and its entry replaced rather than served stale. Cached code is run as it
+    # is loaded, so the directory must be private to the app's user.
+    if directory != 'off':
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(private_directory(directory))
+
+    # Loading puts each template in the environment's cache, which forked workers inherit
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
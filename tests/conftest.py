@@ -0,0 +1,99 @@
+"""
+Shared setup for the tests: a scratch directory holding the db, keyfile, logs and uploads, with query
+budgets asserted on every route that has one
+"""
+
+import io
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='preppy-tests-')
+
+# Settings are read when the app's modules are first imported, and init_db reads its csv files from the
+# working directory, so both are in place before any test imports them
+for name in os.listdir(ROOT):
+    if name.endswith('.csv'):
+        shutil.copy(os.path.join(ROOT, name), WORKDIR)
+os.makedirs(os.path.join(WORKDIR, 'logs'))
+os.makedirs(os.path.join(WORKDIR, 'uploads'))
+os.chdir(WORKDIR)
+sys.path.insert(0, ROOT)
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'preppy.db')}",
+    UPLOAD_FOLDER=os.path.join(WORKDIR, 'uploads'),
+    SECRET_KEY='test-secret-key',
+    MAIL_PORT='25',
+    TEMPLATE_CACHE_DIR=os.path.join(WORKDIR, 'template-cache'),
+    QUERY_BUDGETS='on',
+)
+
+_users = itertools.count()
+
+
+def seed_in_subprocess(directory=WORKDIR):
+    """
+    Reseed the reference tables from the csv files in directory, from a process of its own as a deploy
+    would. This also empties every user table.
+    """
+    subprocess.run([sys.executable, '-c', 'import init_db; init_db.init_db()'], cwd=directory,
+                   env=dict(os.environ, PYTHONPATH=ROOT), check=True)
+
+
+@pytest.fixture(scope='session')
+def app():
+    import init_db
+    from app import create_app
+
+    init_db.init_db()
+    flask_app = create_app()
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    """
+    A test client signed in as a newly registered user
+    """
+    test_client = app.test_client()
+    email = f"user{next(_users)}@example.com"
+    response = test_client.post('/register', data={'username': email, 'password': 'pw', 'confirmation': 'pw'})
+    assert response.status_code == 302
+    return test_client
+
+
+@pytest.fixture
+def household(client):
+    """
+    A signed-in client whose user has entered their household
+    """
+    response = client.post('/editfamily', data={'name': 'Doe', 'adults': 2, 'seniors': 0, 'children': 1,
+                                                'pets': 0, 'state': 'CA', 'special': 'No'})
+    assert response.status_code == 302
+    return client
+
+
+def upload(client, name, data):
+    """
+    Store a file through the single-file upload form
+    """
+    return client.post('/new_upload', data={'file': (io.BytesIO(data), name)}, content_type='multipart/form-data')
+
+
+def stored_files(app):
+    """
+    Names of the finished files in the upload folder, leaving out uploads still in progress
+    """
+    names = set()
+    for _, directories, files in os.walk(app.config['UPLOAD_FOLDER']):
+        if 'partial' in directories:
+            directories.remove('partial')
+        names.update(name for name in files if name.endswith('.enc'))
+    return names
@@ -0,0 +1,25 @@
+import os
+
+from conftest import WORKDIR
+
+
+def db_state():
+    """
+    Size and modification time of the db file and its write-ahead log, so a write to either shows up.
+    They are only stat'ed: closing a file SQLite has open would drop the locks it holds on it.
+    """
+    state = []
+    for name in ('preppy.db', 'preppy.db-wal'):
+        path = os.path.join(WORKDIR, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            state.append((name, stat.st_size, stat.st_mtime_ns))
+    return state
+
+
+def test_create_app_does_not_write_to_the_db(app):
+    from app import create_app
+
+    before = db_state()
+    create_app()
+    assert db_state() == before
@@ -0,0 +1,52 @@
+import os
+import shutil
+import time
+
+import catalog
+from catalog import get_catalog, refresh_catalog, stored_generation
+from conftest import ROOT, WORKDIR, seed_in_subprocess
+
+
+def test_catalog_is_loaded_once_per_generation(app):
+    with app.test_request_context():
+        loaded = get_catalog()
+        assert get_catalog() is loaded
+        assert loaded.generation == stored_generation()
+
+
+def reseed_states(tmp_path, full_name):
+    """
+    Reseed from another process, renaming California in the states table
+    """
+    for name in os.listdir(ROOT):
+        if name.endswith('.csv'):
+            shutil.copy(os.path.join(ROOT, name), tmp_path)
+    states = tmp_path / 'states.csv'
+    states.write_text(states.read_text().replace('California', full_name))
+    seed_in_subprocess(tmp_path)
+
+
+def test_reseed_by_another_process_reloads_catalog(app, tmp_path, monkeypatch):
+    before = get_catalog()
+    assert before.states_by_code['CA'].full_name == 'California'
+
+    try:
+        reseed_states(tmp_path, 'Alta California')
+        # Checked moments ago, so the next check isn't due yet
+        monkeypatch.setattr(catalog, '_checked_at', time.monotonic())
+        with app.test_request_context():
+            refresh_catalog()
+        assert get_catalog() is before
+
+        monkeypatch.setattr(catalog, 'check_interval', 0)
+        with app.test_request_context():
+            refresh_catalog()
+        after = get_catalog()
+        assert after is not before
+        assert after.states_by_code['CA'].full_name == 'Alta California'
+    finally:
+        seed_in_subprocess(WORKDIR)
+
+    with app.test_request_context():
+        refresh_catalog()
+    assert get_catalog().states_by_code['CA'].full_name == 'California'
@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.mark.parametrize('post, page', [('/postbuild', '/gobag'), ('/postshelter', '/stockshelter')])
+def test_unknown_supplies_are_flashed_and_known_ones_saved(household, post, page):
+    response = household.post(post, data={'supply': ['water', 'no such supply']})
+    assert response.status_code == 302 and response.location.endswith(page)
+
+    response = household.get(page)
+    assert b'Supplies not found: no such supply.' in response.data
+    assert b'water' in response.data
+
@@ -0,0 +1,41 @@
+import io
+import os
+import zipfile
+
+from conftest import upload
+
+
+def test_download_serves_ranges(client):
+    data = os.urandom(200_003)
+    assert upload(client, 'scan.pdf', data).status_code == 302
+
+    response = client.get('/download?filename=scan.pdf')
+    assert response.data == data and response.headers['Accept-Ranges'] == 'bytes'
+    etag = response.headers['ETag']
+
+    response = client.get('/download?filename=scan.pdf', headers={'Range': 'bytes=65530-131080'})
+    assert response.status_code == 206 and response.data == data[65530:131081]
+    response = client.get('/download?filename=scan.pdf', headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206 and response.data == data[-10:]
+    response = client.get('/download?filename=scan.pdf', headers={'Range': 'bytes=5-9', 'If-Range': etag})
+    assert response.status_code == 206 and response.data == data[5:10]
+    response = client.get('/download?filename=scan.pdf', headers={'Range': 'bytes=5-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200 and response.data == data
+    assert client.get('/download?filename=scan.pdf', headers={'Range': 'bytes=300000-'}).status_code == 416
+    assert client.get('/download?filename=scan.pdf', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_download_all_streams_every_file(client):
+    files = {'a.txt': b'first', 'b.bin': os.urandom(150_000)}
+    for name, data in files.items():
+        upload(client, name, data)
+
+    response = client.get('/download_all')
+    assert response.status_code == 200 and response.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.testzip() is None
+        assert {name: archive.read(name) for name in archive.namelist()} == files
+
+
+def test_download_all_without_files_redirects(client):
+    assert client.get('/download_all').status_code == 302
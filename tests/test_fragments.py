@@ -0,0 +1,75 @@
+import threading
+
+from fragments import NONCE_PLACEHOLDER, FileFragmentCache, MemoryFragmentCache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryFragmentCache(max_bytes=10)
+    cache.set(1, (1, 'a'), 'aaaa')
+    cache.set(1, (1, 'b'), 'bbbb')
+    assert cache.get(1, (1, 'a')) == 'aaaa'
+    cache.set(2, (2, 'c'), 'cccc')
+    assert cache.get(1, (1, 'b')) is None
+    assert cache.get(1, (1, 'a')) == 'aaaa' and cache.size() <= 10
+
+
+def test_invalidate_drops_only_that_users_pages(tmp_path):
+    for cache in (MemoryFragmentCache(1024), FileFragmentCache(str(tmp_path), 1024)):
+        cache.set(1, (1, 'page'), 'mine')
+        cache.set(2, (2, 'page'), 'theirs')
+        cache.invalidate(1)
+        assert cache.get(1, (1, 'page')) is None
+        assert cache.get(2, (2, 'page')) == 'theirs'
+
+
+def test_concurrent_misses_compute_once():
+    cache = MemoryFragmentCache(1024)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'page'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_compute(1, (1, 'p'), compute)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(cache.get_or_compute(1, (1, 'p'), compute)))
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+    assert results == ['page', 'page'] and len(calls) == 1
+
+
+
+def test_cached_pages_carry_fresh_nonces(household):
+    first = household.get('/contacts')
+    second = household.get('/contacts')
+    assert first.status_code == second.status_code == 200
+    nonce = first.headers['Content-Security-Policy'].split("'nonce-")[1].split("'")[0]
+    assert nonce.encode() in first.data and nonce.encode() not in second.data
+
+
+def test_user_text_is_not_mistaken_for_a_placeholder(household):
+    household.post('/new_contact', data={'first_name': 'Eve', 'last_name': str(NONCE_PLACEHOLDER),
+                                         'phone': '555', 'email': 'eve@example.com', 'address': 'Here'})
+    for _ in range(2):
+        response = household.get('/contacts')
+        assert response.status_code == 200
+        assert b'&lt;preppy:nonce&gt;' in response.data
+
+
+def test_only_gets_are_cached(app, household):
+    def lookups():
+        counters = app.extensions['fragment_cache'].counters
+        return counters['hits'], counters['misses'], counters['coalesced']
+
+    household.get('/buildgobag')
+    before = lookups()
+    assert household.post('/buildgobag').status_code == 200
+    assert lookups() == before
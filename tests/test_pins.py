@@ -0,0 +1,27 @@
+import pytest
+
+
+def test_saved_pins_are_found_nearby(client):
+    response = client.post('/save_coords', json=[[40.7128, -74.006, 'Library'], [41.0, -73.0]])
+    assert response.json == {'success': True}
+
+    response = client.get('/nearby_pins', query_string={'latitude': 40.71, 'longitude': -74.0, 'radius': 5})
+    assert response.json == [{'latitude': 40.7128, 'longitude': -74.006, 'title': 'Library'}]
+
+
+@pytest.mark.parametrize('pins', [
+    {'lat': 1}, [{'lat': 1, 'lng': 2}], [[1]], [[1, 2, 3, 4]], [['x', 2]], [[91, 0]], [[0, 1e309]],
+    [[0, 2, 7]], [[True, 2]],
+])
+def test_invalid_pins_are_rejected(client, pins):
+    response = client.post('/save_coords', json=pins)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('args', [
+    {'latitude': 'nan', 'longitude': 0}, {'latitude': 0, 'longitude': 'inf'},
+    {'latitude': 0, 'longitude': 0, 'radius': 'inf'}, {'latitude': 0, 'longitude': 0, 'radius': -1},
+    {'latitude': 95, 'longitude': 0}, {'longitude': 0},
+])
+def test_invalid_searches_are_rejected(client, args):
+    assert client.get('/nearby_pins', query_string=args).status_code == 400
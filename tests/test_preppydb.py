@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy.dialects import postgresql, sqlite
+
+import preppydb
+from dbmodels import Checklists
+
+
+@pytest.mark.parametrize('dialect', [sqlite.dialect(), postgresql.dialect()])
+def test_upsert_speaks_the_engines_dialect(monkeypatch, dialect):
+    monkeypatch.setattr(preppydb.engine.dialect, 'name', dialect.name)
+    stmt = preppydb.upsert(Checklists).values(user_id=1, kit='gobag', selected=b'', done=b'')
+    stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'kit'], set_={'done': stmt.excluded.done})
+    assert 'ON CONFLICT (user_id, kit) DO UPDATE' in str(stmt.compile(dialect=dialect))
+
+
+def test_released_savepoints_stay_inside_the_transaction(app):
+    session = preppydb.db_session
+    session.query(Checklists).count()
+    preppydb.begin_for_savepoints(session)
+    with session.begin_nested():
+        session.execute(preppydb.upsert(Checklists).values(user_id=999, kit='gobag', selected=b'', done=b''))
+    session.rollback()
+    assert session.query(Checklists).filter_by(user_id=999).count() == 0
+    session.remove()
@@ -0,0 +1,24 @@
+import pytest
+
+import utils
+
+
+def test_query_budgets_are_checked():
+    assert utils.query_budgets
+
+
+@pytest.mark.parametrize('page', ['/family', '/buildgobag', '/gobag', '/shelter', '/stockshelter', '/tasks',
+                                  '/customtasks'])
+def test_pages_stay_within_query_budget(household, page):
+    household.post('/postbuild', data={'supply': ['water', 'food']})
+    household.post('/postshelter', data={'supply': ['water']})
+    household.post('/posttasks', data={'task': ['get_vaccinated', 'prepare_go_bags']})
+    response = household.get(page)
+    assert response.status_code == 200
+
+
+def test_budget_covers_the_whole_request(app, household, monkeypatch):
+    # The family page's own query fits in one, but loading the session takes another
+    monkeypatch.setattr(app.view_functions['userinfo_routes.family'], 'query_budget', 1)
+    with pytest.raises(AssertionError, match='budget is 1'):
+        household.get('/family')
@@ -0,0 +1,61 @@
+import os
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+
+import data_routes
+from conftest import stored_files
+from preppydb import db_session
+
+
+def test_resumable_upload(client):
+    data = os.urandom(150_001)
+    upload_id = client.post('/resumable_uploads', json={'filename': 'big.bin'}).json['id']
+    offset = 0
+    for size in (1, 70_000, 80_000):
+        response = client.patch(f'/resumable_uploads/{upload_id}', data=data[offset:offset + size],
+                                headers={'Upload-Offset': str(offset)})
+        offset += size
+        assert response.json['offset'] == offset
+
+    response = client.patch(f'/resumable_uploads/{upload_id}', data=b'x', headers={'Upload-Offset': '3'})
+    assert response.status_code == 409 and response.json['offset'] == offset
+    assert client.get(f'/resumable_uploads/{upload_id}').json['offset'] == offset
+    client.patch(f'/resumable_uploads/{upload_id}', data=data[offset:], headers={'Upload-Offset': str(offset)})
+
+    response = client.post(f'/resumable_uploads/{upload_id}/finalize')
+    assert response.status_code == 201 and response.json['size'] == len(data)
+    assert client.get('/download?filename=big.bin').data == data
+    assert client.get(f'/resumable_uploads/{upload_id}').status_code == 404
+
+
+def test_finalize_can_be_retried_after_failed_commit(app, client):
+    data = os.urandom(70_000)
+    upload_id = client.post('/resumable_uploads', json={'filename': 'retry.bin'}).json['id']
+    client.patch(f'/resumable_uploads/{upload_id}', data=data, headers={'Upload-Offset': '0'})
+    before = stored_files(app)
+
+    failure = OperationalError('COMMIT', {}, Exception('database is locked'))
+    with mock.patch.object(db_session, 'commit', side_effect=failure):
+        assert client.post(f'/resumable_uploads/{upload_id}/finalize').status_code == 500
+    assert stored_files(app) == before
+    assert client.get(f'/resumable_uploads/{upload_id}').json['offset'] == len(data)
+
+    assert client.post(f'/resumable_uploads/{upload_id}/finalize').status_code == 201
+    assert client.get('/download?filename=retry.bin').data == data
+
+
+def test_finalize_can_be_retried_after_failed_rename(app, client):
+    data = os.urandom(70_000)
+    upload_id = client.post('/resumable_uploads', json={'filename': 'moved.bin'}).json['id']
+    client.patch(f'/resumable_uploads/{upload_id}', data=data, headers={'Upload-Offset': '0'})
+    before = stored_files(app)
+
+    with mock.patch.object(data_routes, 'rename_file', side_effect=OSError('disk full')):
+        assert client.post(f'/resumable_uploads/{upload_id}/finalize').status_code == 500
+    assert stored_files(app) == before
+
+    assert client.post(f'/resumable_uploads/{upload_id}/finalize').status_code == 201
+    assert client.get('/download?filename=moved.bin').data == data
+    assert len(stored_files(app)) == len(before) + 1
+    assert not os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], 'partial'))
@@ -0,0 +1,48 @@
+import time
+
+from catalog import invalidate
+
+
+def test_pages_revalidate_until_user_data_changes(household):
+    # The first page after signing in may add a CSRF token to the session, which is part of the ETag
+    household.get('/contacts')
+    response = household.get('/contacts')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    response = household.get('/contacts', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    household.post('/new_contact', data={'first_name': 'Ada', 'last_name': 'Lovelace', 'phone': '555',
+                                         'email': 'ada@example.com', 'address': 'London'})
+    response = household.get('/contacts', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert b'Lovelace' in response.data
+
+
+def test_etags_differ_between_users(app, household):
+    other = app.test_client()
+    other.post('/register', data={'username': 'other-etag@example.com', 'password': 'pw', 'confirmation': 'pw'})
+    other.post('/editfamily', data={'name': 'Roe', 'adults': 1, 'seniors': 0, 'children': 0, 'pets': 0,
+                                    'state': 'NY', 'special': 'No'})
+    etag = household.get('/contacts').headers['ETag']
+    assert other.get('/contacts', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_etags_change_before_csrf_tokens_expire(app, household, monkeypatch):
+    household.get('/contacts')
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    etag = household.get('/contacts').headers['ETag']
+    assert household.get('/contacts', headers={'If-None-Match': etag}).status_code == 304
+
+    monkeypatch.setattr(time, 'time', lambda: now + app.config['WTF_CSRF_TIME_LIMIT'] / 2)
+    response = household.get('/contacts', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+
+
+def test_etags_change_when_reference_data_does(household):
+    household.get('/contacts')
+    etag = household.get('/contacts').headers['ETag']
+    invalidate()
+    assert household.get('/contacts', headers={'If-None-Match': etag}).status_code == 200
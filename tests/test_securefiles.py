@@ -0,0 +1,84 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+import securefiles
+from securefiles import DecryptionError, PartialContainer, encrypt_stream, open_decrypted
+
+CHUNK = 1024
+
+
+def store(path, data, codec=None):
+    with open(path, 'wb') as f:
+        _, size = encrypt_stream(io.BytesIO(data), f, chunk_size=CHUNK, codec=codec)
+    assert size == len(data)
+    return path
+
+
+@pytest.mark.parametrize('size', [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 5 * CHUNK + 17])
+@pytest.mark.parametrize('codec', [securefiles.CODECS['off'], securefiles.CODECS['zlib']])
+def test_container_round_trip(tmp_path, size, codec):
+    data = (os.urandom(size // 2) + b'compressible ' * size)[:size]
+    with open_decrypted(store(tmp_path / 'file.enc', data, codec)) as decrypted:
+        assert decrypted.size == size
+        assert decrypted.read() == data
+
+
+def test_seek_reads_only_the_range(tmp_path):
+    data = os.urandom(10 * CHUNK + 5)
+    with open_decrypted(store(tmp_path / 'file.enc', data)) as decrypted:
+        for start, length in ((0, 10), (CHUNK - 3, 6), (3 * CHUNK, CHUNK), (10 * CHUNK, 100)):
+            decrypted.seek(start)
+            assert securefiles.read_full(decrypted, length) == data[start:start + length]
+
+
+def test_each_container_has_its_own_salt(tmp_path):
+    first = store(tmp_path / 'a.enc', b'same').read_bytes()[:securefiles.HEADER.size]
+    second = store(tmp_path / 'b.enc', b'same').read_bytes()[:securefiles.HEADER.size]
+    assert first.startswith(securefiles.MAGIC)
+    assert securefiles.HEADER.unpack(first)[4] != securefiles.HEADER.unpack(second)[4]
+
+
+@pytest.mark.parametrize('position', [10, securefiles.HEADER.size + 8, -8])
+def test_tampering_fails_authentication(tmp_path, position):
+    path = store(tmp_path / 'file.enc', os.urandom(3 * CHUNK))
+    raw = bytearray(path.read_bytes())
+    raw[position] ^= 1
+    path.write_bytes(raw)
+    with pytest.raises(DecryptionError):
+        with open_decrypted(path) as decrypted:
+            decrypted.read()
+
+
+def test_fernet_files_are_still_read(tmp_path):
+    path = tmp_path / 'legacy.enc'
+    path.write_bytes(securefiles.load_keys()[0].encrypt(b'stored before chunking'))
+    with open_decrypted(path) as decrypted:
+        assert decrypted.read() == b'stored before chunking'
+
+
+def test_partial_container_resumes_and_finishes_again(tmp_path):
+    data = os.urandom(4 * CHUNK + 3)
+    partial = PartialContainer(str(tmp_path / 'upload.enc'))
+    partial.create(chunk_size=CHUNK)
+    with partial.lock() as f:
+        assert partial.append(f, io.BytesIO(data[:1500])) == 1500
+    with partial.lock() as f:
+        assert partial.offset(f) == 1500
+        partial.append(f, io.BytesIO(data[1500:]))
+        assert partial.finish(f) == len(data)
+        assert partial.finish(f) == len(data)
+    with open_decrypted(partial.path) as decrypted:
+        assert decrypted.read() == data
+
+    partial.remove()
+    assert not os.path.exists(partial.path) and not os.path.exists(partial.tail_path)
+
+
+def test_content_digest_is_keyed_and_taken_while_encrypting():
+    digest, size = securefiles.content_digest(io.BytesIO(b'contents'))
+    assert size == 8
+    assert digest != hashlib.sha256(b'contents').hexdigest()
+    assert encrypt_stream(io.BytesIO(b'contents'), io.BytesIO()) == (digest, size)
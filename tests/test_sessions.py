@@ -0,0 +1,32 @@
+from sqlalchemy import select
+
+from dbmodels import Sessions
+from preppydb import engine
+
+
+def session_ids():
+    with engine.connect() as connection:
+        return set(connection.execute(select(Sessions.id)).scalars())
+
+
+def test_signing_in_rotates_session_id(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['last_name'] = 'Doe'
+    before = client.get_cookie('session').value
+    assert before in session_ids()
+
+    response = client.post('/register', data={'username': 'rotate@example.com', 'password': 'pw',
+                                              'confirmation': 'pw'})
+    assert response.status_code == 302
+    after = client.get_cookie('session').value
+    assert after != before
+    assert before not in session_ids() and after in session_ids()
+    with client.session_transaction() as session:
+        assert session['last_name'] == 'Doe' and session['user_id']
+
+
+def test_unchanged_user_keeps_session_id(client):
+    sid = client.get_cookie('session').value
+    assert client.get('/family').status_code in (200, 302)
+    assert client.get_cookie('session').value == sid
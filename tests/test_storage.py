@@ -0,0 +1,81 @@
+import os
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import storage
+from storage import COLD, HOT
+
+
+@pytest.fixture
+def folders(app, tmp_path):
+    """
+    A stand-in app with its own hot and cold folders (the db comes from the app fixture)
+    """
+    return SimpleNamespace(config={'UPLOAD_FOLDER': str(tmp_path / 'hot'), 'COLD_STORAGE_FOLDER': str(tmp_path / 'cold'),
+                                   'COLD_AFTER_DAYS': 30})
+
+
+def new_name():
+    return str(uuid.uuid4()) + '.enc'
+
+
+def test_stored_files_are_sharded(folders):
+    name = new_name()
+    path = storage.stored_path(folders, name)
+    assert path == os.path.join(folders.config['UPLOAD_FOLDER'], name[:2], name[2:4], name)
+    assert os.path.isdir(os.path.dirname(path))
+
+
+def test_atomic_write_leaves_nothing_behind_on_failure(tmp_path):
+    path = tmp_path / 'file'
+    path.write_bytes(b'old')
+    with pytest.raises(RuntimeError):
+        with storage.atomic_write(str(path)) as f:
+            f.write(b'half')
+            raise RuntimeError
+    assert path.read_bytes() == b'old'
+    assert os.listdir(tmp_path) == ['file']
+
+    with storage.atomic_write(str(path)) as f:
+        f.write(b'unwanted')
+        raise storage.Discard
+    assert path.read_bytes() == b'old'
+    assert os.listdir(tmp_path) == ['file']
+
+    with storage.atomic_write(str(path)) as f:
+        f.write(b'new')
+    assert path.read_bytes() == b'new'
+
+
+def test_files_move_between_tiers_and_are_recalled(folders):
+    name = new_name()
+    with open(storage.stored_path(folders, name), 'wb') as f:
+        f.write(b'contents')
+
+    storage.move_file(folders, name, HOT, COLD)
+    path, tier = storage.locate(folders, name, HOT)
+    assert tier == COLD and open(path, 'rb').read() == b'contents'
+
+    path = storage.recall(folders, name, COLD)
+    assert path == storage.shard_path(folders.config['UPLOAD_FOLDER'], name)
+    assert storage.locate(folders, name, COLD) == (path, HOT)
+
+    storage.remove_file(folders, name)
+    assert storage.locate(folders, name, HOT) == (None, None)
+    with pytest.raises(FileNotFoundError):
+        storage.recall(folders, name, HOT)
+
+
+def test_rehome_moves_flat_files_into_shards(tmp_path):
+    names = [new_name() for _ in range(7)]
+    for name in names:
+        (tmp_path / name).write_bytes(name.encode())
+    (tmp_path / 'README').write_bytes(b'not a stored file')
+
+    assert storage.rehome(str(tmp_path), workers=2, batch=3) == len(names)
+    for name in names:
+        with open(storage.shard_path(str(tmp_path), name), 'rb') as f:
+            assert f.read() == name.encode()
+    assert (tmp_path / 'README').exists()
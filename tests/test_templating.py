@@ -0,0 +1,6 @@
+import os
+
+
+def test_every_template_is_compiled_into_the_cache(app):
+    directory = os.environ['TEMPLATE_CACHE_DIR']
+    assert len(os.listdir(directory)) == len(app.jinja_env.list_templates())
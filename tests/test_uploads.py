@@ -0,0 +1,59 @@
+import io
+import os
+
+from sqlalchemy import text
+
+import data_routes
+from conftest import stored_files, upload
+from preppydb import db_session
+
+
+def test_delete_file_removes_row_and_bytes(app, client):
+    before = stored_files(app)
+    upload(client, 'gone.txt', b'bye')
+    assert len(stored_files(app)) == len(before) + 1
+    assert client.post('/delete_file', data={'filename': 'gone.txt'}).status_code == 302
+    assert stored_files(app) == before
+    assert client.get('/download?filename=gone.txt').status_code == 302
+
+
+def test_unchanged_upload_is_not_stored_again(app, client):
+    upload(client, 'notes.txt', b'same')
+    before = stored_files(app)
+    upload(client, 'notes.txt', b'same')
+    assert stored_files(app) == before
+    upload(client, 'notes.txt', b'changed')
+    assert len(stored_files(app)) == len(before)
+    assert client.get('/download?filename=notes.txt').data == b'changed'
+
+
+def test_batch_upload_reports_each_file(client):
+    files = [(io.BytesIO(b'one'), 'one.txt'), (io.BytesIO(os.urandom(100_000)), 'two.bin')]
+    response = client.post('/new_uploads', data={'files': files}, content_type='multipart/form-data')
+    assert response.status_code == 201
+    assert [entry['status'] for entry in response.json['files']] == ['stored', 'stored']
+
+    files = [(io.BytesIO(b'one'), 'one.txt'), (io.BytesIO(b'three'), 'three.txt')]
+    response = client.post('/new_uploads', data={'files': files}, content_type='multipart/form-data')
+    assert [entry['status'] for entry in response.json['files']] == ['unchanged', 'stored']
+    assert client.get('/download?filename=one.txt').data == b'one'
+
+
+def test_failed_record_leaves_the_rest_of_the_batch(app, client, monkeypatch):
+    real_record_file = data_routes.record_file
+
+    def record_file(user_id, file_name, *args, **details):
+        if file_name == 'bad.txt':
+            db_session.execute(text("INSERT INTO no_such_table VALUES (1)"))
+        return real_record_file(user_id, file_name, *args, **details)
+
+    monkeypatch.setattr(data_routes, 'record_file', record_file)
+    before = stored_files(app)
+    files = [(io.BytesIO(b'a'), 'first.txt'), (io.BytesIO(b'b'), 'bad.txt'), (io.BytesIO(b'c'), 'last.txt')]
+    response = client.post('/new_uploads', data={'files': files}, content_type='multipart/form-data')
+    assert response.status_code == 201
+    assert [entry['status'] for entry in response.json['files']] == ['stored', 'error', 'stored']
+    assert len(stored_files(app)) == len(before) + 2
+    assert client.get('/download?filename=first.txt').data == b'a'
+    assert client.get('/download?filename=last.txt').data == b'c'
+    assert client.get('/download?filename=bad.txt').status_code == 302
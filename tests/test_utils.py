@@ -0,0 +1,26 @@
+import os
+import stat
+
+import pytest
+
+from utils import private_directory
+
+
+def test_private_directory_is_created_for_owner_only(tmp_path):
+    path = private_directory(str(tmp_path / 'cache'))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+
+
+def test_private_directory_tightens_existing_mode(tmp_path):
+    path = tmp_path / 'cache'
+    path.mkdir(mode=0o777)
+    os.chmod(path, 0o777)
+    private_directory(str(path))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+
+
+def test_private_directory_refuses_symlink(tmp_path):
+    (tmp_path / 'elsewhere').mkdir()
+    os.symlink(tmp_path / 'elsewhere', tmp_path / 'cache')
+    with pytest.raises(PermissionError):
+        private_directory(str(tmp_path / 'cache'))
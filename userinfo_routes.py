@@ -10,10 +10,13 @@ from flask import Blueprint, flash, g, jsonify, redirect, render_template, reque
 from flask import current_app as app
 from sqlalchemy.exc import SQLAlchemyError
 
-from dbmodels import Calendar, Events, Families, Medical, Providers, States
+from catalog import get_catalog
+from dbmodels import Calendar, Events, Families, Medical, Providers
+from fragments import cached_render
 from helpers import apology, login_required
 from preppydb import db_session
-from utils import load_states
+from revisions import revalidated
+from utils import get_household, load_states, query_budget
 
 userinfo_routes = Blueprint('userinfo_routes', __name__)
 
@@ -25,6 +28,7 @@ api_key = os.getenv('GOOGLE_API_KEY')
 
 @userinfo_routes.route("/family", methods=["GET"])
 @login_required
+@query_budget(3)
 @load_states
 def family():
     """
@@ -35,24 +39,21 @@ def family():
 
     # Check if the user has a family in db
     try:
-        userfam = db_session.query(Families).filter_by(user_id=session['user_id']).first()
+        household = get_household()
     except SQLAlchemyError as e:
         app.logger.error("Database error: %s", e)
         return apology("Database error accessing household information.")
 
     # If so, retrieve their family info
-    if userfam:
+    if household:
+        userfam = household.family
         fam['name'] = userfam.last_name
         fam['adults'] = userfam.adults
         fam['seniors'] = userfam.seniors
         fam['children'] = userfam.children
         fam['pets'] = userfam.pets
         fam['special'] = userfam.special_needs
-        try:
-            fam['state'] = db_session.query(States.state).filter_by(id=userfam.state_id).scalar()
-        except SQLAlchemyError as e:
-            app.logger.error("Database error: %s", e)
-            return apology("Database error accessing state info.")
+        fam['state'] = household.state.state if household.state else None
 
     # if not, fill family dict with blank info
     else:
@@ -81,13 +82,14 @@ def editfamily():
 
     # If the user already has family data in the db, update it with the new values
     try:
-        row = db_session.query(Families.user_id).filter_by(user_id=session['user_id']).first()
-        state_id = db_session.query(States.id).filter_by(state=validated_data["state"]).first().id
+        row = get_household()
     except SQLAlchemyError as e:
         app.logger.error("Database error: %s", e)
         flash("Error updating household info.")
         return redirect(url_for('userinfo_routes.family'))
 
+    state_id = get_catalog().states_by_code[validated_data["state"]].id
+
     if row:
         try:
             db_session.query(Families).filter_by(user_id=session['user_id']).update({
@@ -99,6 +101,7 @@ def editfamily():
                 'state_id': state_id,
                 'special_needs': validated_data["special"],
             })
+            db_session.commit()
         except SQLAlchemyError as e:
             db_session.rollback()
             app.logger.error("Database error: %s", e)
@@ -116,6 +119,9 @@ def editfamily():
             app.logger.error("Database error: %s", e)
             errors.append("Database error adding household information.")
 
+    # The household context cached for this request is now stale
+    g.pop('household', None)
+
     if errors:
         flash(" ".join(errors))
 
@@ -127,6 +133,7 @@ def editfamily():
 
 @userinfo_routes.route("/routines", methods=['GET'])
 @login_required
+@revalidated
 def routines():
     """
     Send user's saved event data to routines page
@@ -165,6 +172,7 @@ def routines():
 
 @userinfo_routes.route("/getfamily")
 @login_required
+@revalidated
 def getfamily():
     """
     Sends family members saved in calendar table to fullCalendar
@@ -321,6 +329,8 @@ def add_event():
 
 @userinfo_routes.route('/medical', methods=['GET'])
 @login_required
+@revalidated
+@cached_render('medical.html')
 def medical():
     """
     Retrieve user's saved medical info and send to front end template
@@ -336,7 +346,7 @@ def medical():
     except SQLAlchemyError as e:
         app.logger.error("Database error: %s", e)
         return apology("Error retrieving medical information.")
-    return render_template('medical.html', results=results, last_name=last_name, nonce=g.nonce)
+    return {'results': results, 'last_name': last_name}
 
 
 @userinfo_routes.route('/add_medical', methods=['POST'])
@@ -524,15 +534,15 @@ def edit_provider():
 
 @userinfo_routes.route('/user_state', methods=["GET"])
 @login_required
+@revalidated
 def user_state():
     """
     Provide user's state from db to fullCalendar
     """
 
     try:
-        subquery = db_session.query(Families.state_id).filter_by(user_id=session['user_id'])
-        state_record = db_session.query(States.full_name).filter(States.id.in_(subquery)).first()
-        state = state_record.full_name if state_record else None
+        household = get_household()
+        state = household.state.full_name if household and household.state else None
     except SQLAlchemyError as e:
         app.logger.error("Database error: %s", e)
         return apology("Error retrieving user state.")
@@ -2,22 +2,50 @@
 Module contains helper functions and initializations
 """
 
+import math
 import os
+import stat
 
+from collections import namedtuple
 from functools import wraps
 
-from flask import g
+from flask import current_app as app
+from flask import flash, g, has_request_context, request, session
 from flask_mail import Mail
 from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import event
 
-from dbmodels import States
-from preppydb import db_session
+from catalog import get_catalog, household_mask
+from dbmodels import Families
+from preppydb import db_session, engine
 
-mail = Mail()
+# The signed-in user's household, with what the catalog says about it
+Household = namedtuple('Household', ['family', 'state', 'state_disasters', 'mask'])
+
+# Meetup pins are stored in integer microdegrees and bucketed into a grid of 0.1 degree cells
+MICRODEGREES = 1_000_000
+CELL_MICRODEGREES = 100_000
+CELLS_PER_ROW = 360 * MICRODEGREES // CELL_MICRODEGREES
+EARTH_RADIUS_KM = 6371.0
+MAX_SEARCH_CELLS = 400
 
 # Secret key for password reset
 secret_key = os.getenv('SECRET_KEY')
 
+# Count statements per request so routes can be held to a query budget (development aid)
+query_budgets = os.getenv('QUERY_BUDGETS', 'off') == 'on'
+
+if query_budgets:
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        """
+        Tally each statement sent to the db during a request, except those run with the budget_exempt
+        execution option
+        """
+        if has_request_context() and not conn.get_execution_options().get('budget_exempt'):
+            g.query_count = g.get('query_count', 0) + 1
+
 
 def load_states(f):
     """
@@ -26,14 +54,172 @@ def load_states(f):
 
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        g.states = [row.state for row in db_session.query(States.state).all()]
+        g.states = get_catalog().state_codes
         return f(*args, **kwargs)
     return decorated_function
 
 
+def query_budget(limit):
+    """
+    Hold a route to at most `limit` statements per request, checked when QUERY_BUDGETS=on. The count covers
+    the whole request, from loading the session to saving it, hooks included. Housekeeping that lands on
+    a request now and then rather than on every one (the catalog's reseed check and the session sweep)
+    runs budget_exempt and is left out.
+    """
+
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+def check_query_budget(exception=None):
+    """
+    Fail the request if its route used more statements than its query budget
+    """
+    view = app.view_functions.get(request.endpoint)
+    limit = getattr(view, 'query_budget', None)
+    if limit is None or exception is not None:
+        return
+    used = g.get('query_count', 0)
+    app.logger.debug("%s used %d of %d queries", request.endpoint, used, limit)
+    assert used <= limit, f"{request.endpoint} used {used} queries, budget is {limit}"
+
+
+def init_query_budgets(flask_app):
+    """
+    Check each request against its route's query budget once it is over, when QUERY_BUDGETS=on
+    """
+    if query_budgets:
+        flask_app.teardown_request(check_query_budget)
+
+
+def get_household():
+    """
+    Return the signed-in user's household context (None if they haven't entered one), loading it from
+    the db at most once per request
+    """
+    if 'household' not in g:
+        family = db_session.query(Families).filter_by(user_id=session['user_id']).first()
+        if family is None:
+            g.household = None
+        else:
+            catalog = get_catalog()
+            g.household = Household(
+                family=family,
+                state=catalog.states_by_id.get(family.state_id),
+                state_disasters=catalog.state_disaster_names(family.state_id),
+                mask=household_mask(family.adults, family.seniors, family.children, family.pets))
+    return g.household
+
+
 def generate_reset_token(email):
     """
     Generates a secure password reset token upon request
     """
     serializer = URLSafeTimedSerializer(secret_key)
     return serializer.dumps(email, salt='password-reset-salt')
+
+
+def get_mail():
+    """
+    The app's mail extension, set up on first use
+    """
+    if 'mail' not in app.extensions:
+        Mail(app)
+    return app.extensions['mail']
+
+
+def resolve_names(names, lookup):
+    """
+    Map submitted catalog names to their ids, returning the ids and any names not found
+    """
+    ids = {}
+    unknown = []
+    for name in names:
+        if name in lookup:
+            ids[lookup[name].id] = None
+        else:
+            unknown.append(name)
+    return list(ids), unknown
+
+
+def flash_unknown(kind, names):
+    """
+    Tell the user which submitted names weren't found, and so were left out of what was saved
+    """
+    if names:
+        flash(f"{kind} not found: " + ", ".join(names) + ".")
+
+
+def parse_degrees(value, limit):
+    """
+    A latitude (limit 90) or longitude (limit 180) as float degrees, raising ValueError unless it is a
+    finite number within the limit
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"{value!r} is not a number of degrees")
+    degrees = float(value)
+    if not math.isfinite(degrees) or abs(degrees) > limit:
+        raise ValueError(f"{value!r} is not within {limit} degrees")
+    return degrees
+
+
+def to_microdegrees(degrees):
+    """
+    Convert a latitude or longitude in degrees to fixed-point integer microdegrees
+    """
+    return round(float(degrees) * MICRODEGREES)
+
+
+def grid_cell(latitude_e6, longitude_e6):
+    """
+    Index of the grid cell containing a point given in microdegrees
+    """
+    row = min((latitude_e6 + 90 * MICRODEGREES) // CELL_MICRODEGREES, CELLS_PER_ROW // 2 - 1)
+    column = min((longitude_e6 + 180 * MICRODEGREES) // CELL_MICRODEGREES, CELLS_PER_ROW - 1)
+    return row * CELLS_PER_ROW + column
+
+
+def cells_within(latitude, longitude, radius_km):
+    """
+    Grid cells overlapping the bounding box of a circle around a point given in degrees,
+    or None if the box is too large or wraps around the globe to be worth narrowing by cell
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    if abs(latitude) + lat_delta >= 90:
+        return None
+    lng_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(latitude))))
+    if abs(longitude) + lng_delta >= 180:
+        return None
+
+    south, west = divmod(grid_cell(to_microdegrees(latitude - lat_delta),
+                                   to_microdegrees(longitude - lng_delta)), CELLS_PER_ROW)
+    north, east = divmod(grid_cell(to_microdegrees(latitude + lat_delta),
+                                   to_microdegrees(longitude + lng_delta)), CELLS_PER_ROW)
+    if (north - south + 1) * (east - west + 1) > MAX_SEARCH_CELLS:
+        return None
+    return [row * CELLS_PER_ROW + column for row in range(south, north + 1) for column in range(west, east + 1)]
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance in kilometres between two points given in degrees
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def private_directory(path):
+    """
+    Create a directory only the app's user may use, or check an existing one is. Raises PermissionError
+    if another user owns it or it is a symlink, as whoever can write there can plant files the app loads.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} must be a directory owned by the user running the app")
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        os.chmod(path, 0o700)
+    return path